@@ -8,6 +8,7 @@ import pandas as pd
 
 import functools
 import itertools
+import math
 import time
 
 from nltk.corpus import stopwords
@@ -19,6 +20,11 @@ from nltk.corpus import wordnet as wn
 
 import pickle
 
+from helpers.question_store import QuestionStore
+from helpers.stem_table import StemTable
+from helpers.parallel import ShardedRunner
+from helpers.sketches import QuestionSketches
+
 # * Variables
 
 BASE_DIR = 'data/'
@@ -26,11 +32,6 @@ TRAIN_DATA_FILENAME = "vanilla_train"
 TRAIN_DATA_FILE = BASE_DIR + TRAIN_DATA_FILENAME + '.csv'
 TEST_DATA_FILE = BASE_DIR + 'test.csv'
 PREPROCESSED = 'preprocessed/'
-PREPROCESSED_TRAIN_WORDS = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'words.pkl'
-PREPROCESSED_TRAIN_DF = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'dataframe.hdf'
-
-PREPROCESSED_TEST_WORDS = BASE_DIR + PREPROCESSED + "test" + '-' + 'words.pkl'
-PREPROCESSED_TEST_DF = BASE_DIR + PREPROCESSED + "test" + '-' + 'dataframe.hdf'
 
 start_time = time.time()
 # * Constructor
@@ -38,7 +39,9 @@ start_time = time.time()
 class CountsFeatures:
     def __init__(self,
                  train_data_filename=TRAIN_DATA_FILENAME,
-                 test_data_filename=TEST_DATA_FILE):
+                 test_data_filename=TEST_DATA_FILE,
+                 stem_table=None,
+                 n_workers=1):
 
         self.TRAIN_DATA_FILENAME = train_data_filename
         self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
@@ -47,44 +50,26 @@ class CountsFeatures:
                                      train_data_filename + \
                                      "-counts-train.csv"
         self.CUSTOM_FEATURES_TEST = 'custom/counts-test.csv'
+        self.stem_table = stem_table
+        self.n_workers = n_workers
 
-    def stems_freq(self, row):
-        
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))                
-        q1stems = {}
-        q2stems = {}
-
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            stem = stemmer.stem(word)
-            try:
-                q1stems[stem] += 1
-            except KeyError:
-                q1stems[stem] = 1
-
-        for word in row['question2']:
-            stem = stemmer.stem(word)
-            try:
-                q2stems[stem] += 1
-            except KeyError:
-                q2stems[stem] = 1
+    def stem_counts(self, words):
+        """Sketches a question as (stem id -> count, number of words)."""
+        qstems = Counter(self._stem_table().stems(words).tolist())
+        return (qstems, len(words))
+
+    def _stems_freq(self, q1, q2):
+        q1stems, q1len = q1
+        q2stems, q2len = q2
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
         q1freqs = {}
         for stem in q1stems:
-            q1freqs[stem] = q1stems[stem] / len(row['question1'])
+            q1freqs[stem] = q1stems[stem] / q1len
         q2freqs = {}
         for stem in q2stems:
-            q2freqs[stem] = q2stems[stem] / len(row['question2'])
+            q2freqs[stem] = q2stems[stem] / q2len
 
         score = 0
         for stem in q1freqs:
@@ -101,35 +86,9 @@ class CountsFeatures:
         R = score
         return R
 
-    def stems_share(self, row):
-        
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))        
-
-        q1stems = {}
-        q2stems = {}
-
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            stem = stemmer.stem(word)
-            try:
-                q1stems[stem] += 1
-            except KeyError:
-                q1stems[stem] = 1
-
-        for word in row['question2']:
-            stem = stemmer.stem(word)
-            try:
-                q2stems[stem] += 1
-            except KeyError:
-                q2stems[stem] = 1
+    def _stems_share(self, q1, q2):
+        q1stems, _ = q1
+        q2stems, _ = q2
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
@@ -141,53 +100,25 @@ class CountsFeatures:
              len(shared_stems_in_q2))/(len(q1stems) + len(q2stems))
         return R
 
-    def stems_weighted_difference(self, row):
-        
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-
-        q1stems = {}
-        q2stems = {}
-
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            stem = stemmer.stem(word)
-            try:
-                q1stems[stem] += 1
-            except KeyError:
-                q1stems[stem] = 1
-
-        for word in row['question2']:
-            stem = stemmer.stem(word)
-            try:
-                q2stems[stem] += 1
-            except KeyError:
-                q2stems[stem] = 1
+    def _stems_weighted_difference(self, q1, q2):
+        q1stems, q1len = q1
+        q2stems, q2len = q2
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
 
         q1freqs = {}
         for stem in q1stems:
-            q1freqs[stem] = q1stems[stem] / len(row['question1'])
+            q1freqs[stem] = q1stems[stem] / q1len
         q2freqs = {}
         for stem in q2stems:
-            q2freqs[stem] = q2stems[stem] / len(row['question2'])
+            q2freqs[stem] = q2stems[stem] / q2len
 
         unique_stems_in_q1 = [s for s in q1stems.keys() if s not in q2stems]
         unique_stems_in_q2 = [s for s in q2stems.keys() if s not in q1stems]
 
         score = 0
 
-        rel_q1freq = sum([q1freqs[s] for s in unique_stems_in_q1])
-        rel_q2freq = sum([q2freqs[s] for s in unique_stems_in_q2])
         for stem in unique_stems_in_q1:
             score += q1freqs[stem]
 
@@ -198,36 +129,10 @@ class CountsFeatures:
 
         return score
 
-    def stems_tversky_index(self, row):
-        
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-
+    def _stems_tversky_index(self, q1, q2):
         alpha = 0.7
-        q1stems = {}
-        q2stems = {}
-
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            stem = stemmer.stem(word)
-            try:
-                q1stems[stem] += 1
-            except KeyError:
-                q1stems[stem] = 1
-
-        for word in row['question2']:
-            stem = stemmer.stem(word)
-            try:
-                q2stems[stem] += 1
-            except KeyError:
-                q2stems[stem] = 1
+        q1stems, _ = q1
+        q2stems, _ = q2
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
@@ -244,6 +149,57 @@ class CountsFeatures:
 
         return index
 
+    def _stems_fused(self, q1, q2):
+        """Computes stems_freq, stems_share, stems_weighted_difference and
+        stems_tversky_index together, in one pass over both questions."""
+        alpha = 0.7
+        q1stems, q1len = q1
+        q2stems, q2len = q2
+
+        if len(q1stems) == 0 or len(q2stems) == 0:
+            return (0, 0, 0, 0)
+
+        freq = 0
+        difference = 0
+        shared = 0
+        for stem, count in q1stems.items():
+            if stem in q2stems:
+                freq += q2stems[stem] / q2len
+                shared += 1
+            else:
+                freq -= count / q1len
+                difference += count / q1len
+        for stem, count in q2stems.items():
+            if stem in q1stems:
+                freq += q1stems[stem] / q1len
+            else:
+                freq -= count / q2len
+                difference += count / q2len
+
+        unique_in_q1 = len(q1stems) - shared
+        unique_in_q2 = len(q2stems) - shared
+        share = 2 * shared / (len(q1stems) + len(q2stems))
+        tversky = shared / (shared
+                            + (1-alpha) * (alpha * min(unique_in_q1, unique_in_q2) +
+                                           (1-alpha) * max(unique_in_q1, unique_in_q2)))
+        return (freq, share, difference / 2, tversky)
+
+    def stems_freq(self, row):
+        return self._stems_freq(self.stem_counts(row['question1']),
+                                self.stem_counts(row['question2']))
+
+    def stems_share(self, row):
+        return self._stems_share(self.stem_counts(row['question1']),
+                                 self.stem_counts(row['question2']))
+
+    def stems_weighted_difference(self, row):
+        return self._stems_weighted_difference(self.stem_counts(row['question1']),
+                                               self.stem_counts(row['question2']))
+
+    def stems_tversky_index(self, row):
+        return self._stems_tversky_index(self.stem_counts(row['question1']),
+                                         self.stem_counts(row['question2']))
+
     def most_freq_2_sdf(self, row):
         
         try:
@@ -280,26 +236,11 @@ class CountsFeatures:
             return maxDistance - MostFreqKSimilarity(MostFreqKHashing(inputStr1,K),
                                                      MostFreqKHashing(inputStr2,K))
 
-        q1stems = {}
-        q2stems = {}
-        stops = set(stopwords.words("english"))
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q1stems[stem] += 1
-                except KeyError:
-                    q1stems[stem] = 1
-
-        for word in row['question2']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q2stems[stem] += 1
-                except KeyError:
-                    q2stems[stem] = 1
+        table = self._stem_table()
+        q1stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question1'], keep_stops=False))
+        q2stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question2'], keep_stops=False))
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
@@ -380,26 +321,11 @@ class CountsFeatures:
             return maxDistance - MostFreqKSimilarity(MostFreqKHashing(inputStr1,K),
                                                      MostFreqKHashing(inputStr2,K))
 
-        q1stems = {}
-        q2stems = {}
-        stops = set(stopwords.words("english"))
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q1stems[stem] += 1
-                except KeyError:
-                    q1stems[stem] = 1
-
-        for word in row['question2']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q2stems[stem] += 1
-                except KeyError:
-                    q2stems[stem] = 1
+        table = self._stem_table()
+        q1stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question1'], keep_stops=False))
+        q2stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question2'], keep_stops=False))
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
@@ -455,27 +381,12 @@ class CountsFeatures:
             if row['test_id'] % 10000 == 0:
                 elapsed = time.time() - start_time
                 print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-        from wagnerfischerpp import WagnerFischer
-        q1stems = {}
-        q2stems = {}
-        stops = set(stopwords.words("english"))
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q1stems[stem] += 1
-                except KeyError:
-                    q1stems[stem] = 1
-
-        for word in row['question2']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q2stems[stem] += 1
-                except KeyError:
-                    q2stems[stem] = 1
+        from helpers.wagnerfischerpp import levenshtein
+        table = self._stem_table()
+        q1stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question1'], keep_stops=False))
+        q2stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question2'], keep_stops=False))
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
@@ -501,22 +412,7 @@ class CountsFeatures:
 
         if len(q1set) == 0 or len(q2set) == 0:
             return 0
-        elif len(q1set) <= len(q2set):
-            q_min = q1set
-            q_max = q2set
-        else:
-            q_min = q2set
-            q_max = q1set
-
-        combinations = [zip(x,q_min) for x in itertools.permutations(q_max,len(q_min))]
-
-        R = 0
-        for cycle in combinations:
-            for word1, word2 in cycle:
-                R += WagnerFischer(word1, word2).cost
-
-        R /= len(q1set) + len(q2set)
-        return R
+        return self._permutations_distance(q1set, q2set, levenshtein)
 
     def wagner_fischer_reverse(self, row):
         
@@ -528,27 +424,12 @@ class CountsFeatures:
             if row['test_id'] % 10000 == 0:
                 elapsed = time.time() - start_time
                 print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-        from wagnerfischerpp import WagnerFischer
-        q1stems = {}
-        q2stems = {}
-        stops = set(stopwords.words("english"))
-        stemmer = SnowballStemmer('english')
-
-        for word in row['question1']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q1stems[stem] += 1
-                except KeyError:
-                    q1stems[stem] = 1
-
-        for word in row['question2']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                try:
-                    q2stems[stem] += 1
-                except KeyError:
-                    q2stems[stem] = 1
+        from helpers.wagnerfischerpp import levenshtein
+        table = self._stem_table()
+        q1stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question1'], keep_stops=False))
+        q2stems = Counter(table.stem_vocabulary[s]
+                          for s in table.stems(row['question2'], keep_stops=False))
 
         if len(q1stems) == 0 or len(q2stems) == 0:
             return 0
@@ -573,24 +454,35 @@ class CountsFeatures:
 
         if len(q1set) == 0 or len(q2set) == 0:
             return 0
-        elif len(q1set) <= len(q2set):
+        return self._permutations_distance(q1set, q2set, levenshtein)
+
+    def _permutations_distance(self, q1set, q2set, distance):
+        """Sums the distances between the words zipped together by every
+        permutation of k words of the larger set with the k words of the
+        smaller one, over the number of words in both sets.
+
+        Each word of the larger set meets each word of the smaller one in
+        (m-1)!/(m-k)! of the permutations, m being the size of the larger
+        set, so the sum is that many times the sum of the distance matrix.
+        """
+        if len(q1set) <= len(q2set):
             q_min = q1set
             q_max = q2set
         else:
             q_min = q2set
             q_max = q1set
-
-        combinations = [zip(x,q_min) for x in itertools.permutations(q_max,len(q_min))]
-
-        R = 0
-        for cycle in combinations:
-            for word1, word2 in cycle:
-                R += WagnerFischer(word1, word2).cost
-
+        distances = [distance(word1, word2) for word1 in q_max for word2 in q_min]
+        R = sum(distances) * (math.factorial(len(q_max) - 1) //
+                              math.factorial(len(q_max) - len(q_min)))
         R /= len(q1set) + len(q2set)
         return R
 
-    def build_features(self, data):
+    def _stem_table(self):
+        if self.stem_table is None:
+            self.stem_table = StemTable()
+        return self.stem_table
+
+    def build_features(self, data, fused=True):
         X = pd.DataFrame()
         # commented features give poor differentiability results
         # print("Calculating wagner_fischer...")
@@ -601,17 +493,34 @@ class CountsFeatures:
         # X['most_freq_2_sdf'] = data.apply(self.most_freq_2_sdf, axis=1, raw=True)
         # print("Calculating most_freq_2_sdf_reverse...")
         # X['most_freq_2_sdf_reverse'] = data.apply(self.most_freq_2_sdf_reverse, axis=1, raw=True)
-        print("Calculating stems_freq...")
-        X['stems_freq'] = data.apply(self.stems_freq, axis=1, raw=True)
-        print("Calculating stems_share...")
-        X['stems_share'] = data.apply(self.stems_share, axis=1, raw=True)
-        print("Calculating stems_weighted_difference...")
-        X['stems_weighted_difference'] = data.apply(self.stems_weighted_difference, axis=1, raw=True)
-        print("Calculating stems_tversky_index...")
-        X['stems_tversky_index'] = data.apply(self.stems_tversky_index, axis=1, raw=True)
+        print("Stemming the questions...")
+        stems = QuestionSketches(data, self.stem_counts)
+        if fused:
+            print("Calculating the stems features in one pass...")
+            X = stems.combine_columns(self._stems_fused,
+                                      ['stems_freq', 'stems_share',
+                                       'stems_weighted_difference',
+                                       'stems_tversky_index'])
+        else:
+            print("Calculating stems_freq...")
+            X['stems_freq'] = stems.combine(self._stems_freq)
+            print("Calculating stems_share...")
+            X['stems_share'] = stems.combine(self._stems_share)
+            print("Calculating stems_weighted_difference...")
+            X['stems_weighted_difference'] = stems.combine(self._stems_weighted_difference)
+            print("Calculating stems_tversky_index...")
+            X['stems_tversky_index'] = stems.combine(self._stems_tversky_index)
 
         return X
 
+    def _build_features(self, data):
+        if self.n_workers == 1:
+            return self.build_features(data)
+        factory = functools.partial(CountsFeatures,
+                                    self.TRAIN_DATA_FILENAME,
+                                    self.TEST_DATA_FILE)
+        return ShardedRunner(factory, self.n_workers).build_features(data)
+
     def run(self):
         if exists(self.CUSTOM_FEATURES_TRAIN) and exists(self.CUSTOM_FEATURES_TEST):
             print("Using cached nltk features for {}..."
@@ -623,20 +532,11 @@ class CountsFeatures:
             if exists(self.CUSTOM_FEATURES_TRAIN):
                 print("Using cached features for the training data set...")
             else:
-                if exists(PREPROCESSED_TRAIN_DF):
-                    df_train = pd.read_hdf(PREPROCESSED_TRAIN_DF, 'df_data')
-                else:
-                    df_train = pd.read_csv(self.TRAIN_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_train['question1'] = df_train['question1']\
-                                            .map(lambda x: str(x).strip().split())
-                    df_train['question2'] = df_train['question2']\
-                                            .map(lambda x: str(x).strip().split())
-
-                    df_train.to_hdf(PREPROCESSED_TRAIN_DF,'df_data',mode='w')
+                df_train = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                                self.TEST_DATA_FILE).frame('train')
 
                 print("Computing features for the training data set...")
-                X_train = self.build_features(df_train)
+                X_train = self._build_features(df_train)
                 print("Saving...")
                 X_train.to_csv(self.CUSTOM_FEATURES_TRAIN, index=False)
 
@@ -644,18 +544,10 @@ class CountsFeatures:
                 print("Using cached features the test data set...")
             else:
                 print("Processing the testing data set...")
-                if exists(PREPROCESSED_TEST_DF):
-                    df_test = pd.read_hdf(PREPROCESSED_TEST_DF, 'df_data')
-                else:
-                    df_test = pd.read_csv(self.TEST_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_test['question1'] = df_test['question1']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test['question2'] = df_test['question2']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test.to_hdf(PREPROCESSED_TEST_DF,'df_data',mode='w')
+                df_test = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                               self.TEST_DATA_FILE).frame('test')
 
                 print("Computing features for the test data set...")
-                X_test = self.build_features(df_test)
+                X_test = self._build_features(df_test)
                 print("Saving...")
                 X_test.to_csv(self.CUSTOM_FEATURES_TEST, index=False)
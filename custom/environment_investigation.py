@@ -19,6 +19,10 @@ from nltk.corpus import wordnet as wn
 
 import pickle
 
+from helpers.question_store import QuestionStore
+from helpers.stem_table import StemTable
+from helpers.parallel import ShardedRunner
+
 # * Variables
 
 BASE_DIR = 'data/'
@@ -26,11 +30,6 @@ TRAIN_DATA_FILENAME = "vanilla_train"
 TRAIN_DATA_FILE = BASE_DIR + TRAIN_DATA_FILENAME + '.csv'
 TEST_DATA_FILE = BASE_DIR + 'test.csv'
 PREPROCESSED = 'preprocessed/'
-PREPROCESSED_TRAIN_WORDS = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'words.pkl'
-PREPROCESSED_TRAIN_DF = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'dataframe.hdf'
-
-PREPROCESSED_TEST_WORDS = BASE_DIR + PREPROCESSED + "test" + '-' + 'words.pkl'
-PREPROCESSED_TEST_DF = BASE_DIR + PREPROCESSED + "test" + '-' + 'dataframe.hdf'
 
 start_time = time.time()
 # * Constructor
@@ -38,7 +37,9 @@ start_time = time.time()
 class EnvFeatures:
     def __init__(self,
                  train_data_filename=TRAIN_DATA_FILENAME,
-                 test_data_filename=TEST_DATA_FILE):
+                 test_data_filename=TEST_DATA_FILE,
+                 stem_table=None,
+                 n_workers=1):
 
         self.TRAIN_DATA_FILENAME = train_data_filename
         self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
@@ -47,6 +48,8 @@ class EnvFeatures:
                                      train_data_filename + \
                                      "-env-train.csv"
         self.CUSTOM_FEATURES_TEST = 'custom/env-test.csv'
+        self.stem_table = stem_table
+        self.n_workers = n_workers
 
     def kendall_tau(self, row):
         try:
@@ -58,21 +61,9 @@ class EnvFeatures:
                 elapsed = time.time() - start_time
                 print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
 
-        stemmer = SnowballStemmer('english')
-
-        q1 = []
-        q2 = []
-
-        stops = set(stopwords.words("english"))
-
-        for word in row['question1']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                q1.append(stem)
-        for word in row['question2']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                q2.append(stem)
+        table = self._stem_table()
+        q1 = table.stems(row['question1'], keep_stops=False).tolist()
+        q2 = table.stems(row['question2'], keep_stops=False).tolist()
 
         q1stemmed = [word for word in q1 if word in q2]
         q2stemmed = [word for word in q2 if word in q1]
@@ -101,21 +92,9 @@ class EnvFeatures:
                 elapsed = time.time() - start_time
                 print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
 
-        stemmer = SnowballStemmer('english')
-
-        q1 = []
-        q2 = []
-
-        stops = set(stopwords.words("english"))
-
-        for word in row['question1']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                q1.append(stem)
-        for word in row['question2']:
-            if word not in stops:
-                stem = stemmer.stem(word)
-                q2.append(stem)
+        table = self._stem_table()
+        q1 = table.stems(row['question1'], keep_stops=False).tolist()
+        q2 = table.stems(row['question2'], keep_stops=False).tolist()
 
         q1stemmed = [word for word in q1 if word in q2]
         q2stemmed = [word for word in q2 if word in q1]
@@ -192,6 +171,11 @@ class EnvFeatures:
         count /= len(q1_words) + len(q2_words)
         return count
 
+    def _stem_table(self):
+        if self.stem_table is None:
+            self.stem_table = StemTable()
+        return self.stem_table
+
     def build_features(self, data):
         X = pd.DataFrame()
         print("Calculating kendall_tau...")
@@ -205,6 +189,14 @@ class EnvFeatures:
 
         return X
 
+    def _build_features(self, data):
+        if self.n_workers == 1:
+            return self.build_features(data)
+        factory = functools.partial(EnvFeatures,
+                                    self.TRAIN_DATA_FILENAME,
+                                    self.TEST_DATA_FILE)
+        return ShardedRunner(factory, self.n_workers).build_features(data)
+
     def run(self):
         if exists(self.CUSTOM_FEATURES_TRAIN) and exists(self.CUSTOM_FEATURES_TEST):
             print("Using cached nltk features for {}..."
@@ -216,20 +208,11 @@ class EnvFeatures:
             if exists(self.CUSTOM_FEATURES_TRAIN):
                 print("Using cached features for the training data set...")
             else:
-                if exists(PREPROCESSED_TRAIN_DF):
-                    df_train = pd.read_hdf(PREPROCESSED_TRAIN_DF, 'df_data')
-                else:
-                    df_train = pd.read_csv(self.TRAIN_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_train['question1'] = df_train['question1']\
-                                            .map(lambda x: str(x).strip().split())
-                    df_train['question2'] = df_train['question2']\
-                                            .map(lambda x: str(x).strip().split())
-
-                    df_train.to_hdf(PREPROCESSED_TRAIN_DF,'df_data',mode='w')
+                df_train = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                                self.TEST_DATA_FILE).frame('train')
 
                 print("Computing features for the training data set...")
-                X_train = self.build_features(df_train)
+                X_train = self._build_features(df_train)
                 print("Saving...")
                 X_train.to_csv(self.CUSTOM_FEATURES_TRAIN, index=False)
 
@@ -237,18 +220,10 @@ class EnvFeatures:
                 print("Using cached features the test data set...")
             else:
                 print("Processing the testing data set...")
-                if exists(PREPROCESSED_TEST_DF):
-                    df_test = pd.read_hdf(PREPROCESSED_TEST_DF, 'df_data')
-                else:
-                    df_test = pd.read_csv(self.TEST_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_test['question1'] = df_test['question1']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test['question2'] = df_test['question2']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test.to_hdf(PREPROCESSED_TEST_DF,'df_data',mode='w')
+                df_test = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                               self.TEST_DATA_FILE).frame('test')
 
                 print("Computing features for the test data set...")
-                X_test = self.build_features(df_test)
+                X_test = self._build_features(df_test)
                 print("Saving...")
                 X_test.to_csv(self.CUSTOM_FEATURES_TEST, index=False)
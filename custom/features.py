@@ -7,12 +7,16 @@ import os
 from os.path import exists
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 import functools
+import itertools
 
 from nltk.corpus import stopwords
 from collections import Counter
 
+from helpers.question_store import QuestionStore
+
 # * Variables
 
 BASE_DIR = 'data/'
@@ -198,7 +202,135 @@ class CustomFeatures:
         R = np.sum(shared_weights) / np.sum(total_weights)
         return R
 
-    def build_features(self, data, stops, weights):
+    def _encode_tokens(self, data):
+        """Encodes both question columns as flat arrays of word ids.
+
+        Every question is tokenized exactly once: the words of all rows
+        are concatenated into a single id array per column, and the
+        offsets array marks where each row starts, so that row i spans
+        ids[offsets[i]:offsets[i+1]].  Both columns share one vocabulary.
+        """
+        q1_lengths = data['question1'].map(len).values
+        q2_lengths = data['question2'].map(len).values
+        words = list(itertools.chain.from_iterable(data['question1'])) + \
+                list(itertools.chain.from_iterable(data['question2']))
+        codes, vocabulary = pd.factorize(pd.Series(words, dtype=object))
+        codes = codes.astype(np.int64)
+        q1_offsets = np.concatenate([[0], np.cumsum(q1_lengths)])
+        q2_offsets = np.concatenate([[0], np.cumsum(q2_lengths)])
+        q1_ids = codes[:q1_offsets[-1]]
+        q2_ids = codes[q1_offsets[-1]:]
+        return (np.asarray(vocabulary, dtype=object),
+                (q1_ids, q1_offsets),
+                (q2_ids, q2_offsets))
+
+    def _incidence(self, ids, offsets, vocabulary_size):
+        """Builds a binary rows x vocabulary matrix of unique words."""
+        matrix = sparse.csr_matrix((np.ones(len(ids)), ids, offsets),
+                                   shape=(len(offsets) - 1, vocabulary_size))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix
+
+    def _ratio(self, l1, l2):
+        """Mirrors wc_ratio: nan for an empty q2, 0 for an empty q1."""
+        l1 = l1.astype(np.float64)
+        l2 = l2.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(l1 == 0, 0.0, l2 / l1)
+        ratio[l2 == 0] = np.nan
+        return ratio
+
+    def _share(self, shared, total):
+        """Divides element-wise, leaving nan where the total is 0."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return shared / total
+
+    def _build_columnar_features(self, data, stops, weights):
+        vocabulary, (q1_ids, q1_offsets), (q2_ids, q2_offsets) = \
+            self._encode_tokens(data)
+        V = len(vocabulary)
+
+        is_stop = np.array([word in stops for word in vocabulary], dtype=bool)
+        keep = sparse.diags((~is_stop).astype(np.float64))
+        word_weights = np.array([weights.get(word, 0) for word in vocabulary],
+                                dtype=np.float64)
+        word_lengths = np.array([len(word) for word in vocabulary],
+                                dtype=np.int64)
+
+        q1 = self._incidence(q1_ids, q1_offsets, V)
+        q2 = self._incidence(q2_ids, q2_offsets, V)
+        q1_stop = q1 @ keep
+        q2_stop = q2 @ keep
+        both = q1.multiply(q2)
+        both_stop = q1_stop.multiply(q2_stop)
+
+        def row_sums(matrix, vector=None):
+            if vector is None:
+                return np.asarray(matrix.sum(axis=1)).ravel()
+            return matrix @ vector
+
+        l1 = np.diff(q1_offsets)
+        l2 = np.diff(q2_offsets)
+        u1 = row_sums(q1).astype(np.int64)
+        u2 = row_sums(q2).astype(np.int64)
+        s1 = row_sums(q1_stop).astype(np.int64)
+        s2 = row_sums(q2_stop).astype(np.int64)
+        common = row_sums(both).astype(np.int64)
+        common_stop = row_sums(both_stop).astype(np.int64)
+        # differences of running sums, which unlike reduceat also hold
+        # for empty questions at the end
+        c1 = np.concatenate([[0], np.cumsum(word_lengths[q1_ids])])[q1_offsets]
+        c2 = np.concatenate([[0], np.cumsum(word_lengths[q2_ids])])[q2_offsets]
+        c1 = np.diff(c1)
+        c2 = np.diff(c2)
+
+        X = pd.DataFrame()
+
+        word_match = self._share(2 * common_stop, s1 + s2)
+        word_match[(s1 == 0) | (s2 == 0)] = 0
+        X['word_match'] = word_match
+
+        tfidf = self._share(2 * row_sums(both, word_weights),
+                            row_sums(q1, word_weights) +
+                            row_sums(q2, word_weights))
+        tfidf[(u1 == 0) | (u2 == 0)] = 0
+        X['tfidf_wm'] = tfidf
+
+        tfidf_stops = self._share(2 * row_sums(both_stop, word_weights),
+                                  row_sums(q1_stop, word_weights) +
+                                  row_sums(q2_stop, word_weights))
+        tfidf_stops[(s1 == 0) | (s2 == 0)] = 0
+        X['tfidf_wm_stops'] = tfidf_stops
+
+        union = u1 + u2 - common
+        X['jaccard'] = common / np.maximum(union, 1)
+        X['wc_diff'] = np.abs(l1 - l2)
+        X['wc_ratio'] = self._ratio(l1, l2)
+        X['wc_diff_unique'] = np.abs(u1 - u2)
+        X['wc_ratio_unique'] = self._ratio(u1, u2)
+        X['wc_diff_unq_stop'] = np.abs(s1 - s2)
+        X['wc_ratio_unique_stop'] = self._ratio(s1, s2)
+
+        same_start = np.full(len(l1), np.nan)
+        nonempty = (l1 > 0) & (l2 > 0)
+        same_start[nonempty] = (q1_ids[q1_offsets[:-1][nonempty]] ==
+                                q2_ids[q2_offsets[:-1][nonempty]])
+        X['same_start'] = same_start
+
+        X['char_diff'] = np.abs(c1 - c2)
+        X['char_diff_unq_stop'] = np.abs(
+            row_sums(q1_stop, word_lengths).astype(np.int64) -
+            row_sums(q2_stop, word_lengths).astype(np.int64))
+        X['total_unique_words'] = union
+        X['total_unq_words_stop'] = s1 + s2 - common_stop
+        X['char_ratio'] = self._ratio(c1, c2)
+
+        return X
+
+    def build_features(self, data, stops, weights, columnar=True):
+        if columnar:
+            return self._build_columnar_features(data, stops, weights)
         X = pd.DataFrame()
         f = functools.partial(self.word_match_share, stops=stops)
         X['word_match'] = data.apply(f, axis=1, raw=True)
@@ -247,19 +379,10 @@ class CustomFeatures:
                   .format(self.TRAIN_DATA_FILENAME))
         else:
             print("Processing the training data set...")
-            
-            df_train = pd.read_csv(self.TRAIN_DATA_FILE,
-                                   encoding="utf-8").fillna(" ")
-            df_train['question1'] = df_train['question1']\
-                                    .map(lambda x: str(x).lower().split())
-            df_train['question2'] = df_train['question2']\
-                                    .map(lambda x: str(x).lower().split())
-    
-            train_qs = pd.Series(df_train['question1'].tolist() +
-                                 df_train['question2'].tolist())
-    
-            words = [x for y in train_qs for x in y]
-            counts = Counter(words)
+            store = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                         self.TEST_DATA_FILE)
+
+            counts = store.word_counts('train', lower=True)
             weights = {word: self.get_weight(count)
                        for word, count in counts.items()}
     
@@ -268,6 +391,7 @@ class CustomFeatures:
                 print("Using cached features the training data set...")
             else:
                 print("Computing features for the training data set...")
+                df_train = store.frame('train', lower=True)
                 X_train = self.build_features(df_train, stops, weights)
                 print("Saving...")
                 X_train.to_csv(self.CUSTOM_FEATURES_TRAIN, index=False)
@@ -275,14 +399,8 @@ class CustomFeatures:
                 print("Using cached features the test data set...")
             else:
                 print("Processing the testing data set...")
-                df_test = pd.read_csv(self.TEST_DATA_FILE,
-                                       encoding="utf-8").fillna(" ")
-                df_test['question1'] = df_test['question1']\
-                                        .map(lambda x: str(x).lower().split())
-                df_test['question2'] = df_test['question2']\
-                                        .map(lambda x: str(x).lower().split())
+                df_test = store.frame('test', lower=True)
                 print("Computing features for the test data set...")
                 X_test = self.build_features(df_test, stops, weights)
                 print("Saving...")
                 X_test.to_csv(self.CUSTOM_FEATURES_TEST, index=False)
-        
@@ -20,6 +20,9 @@ from nltk.corpus import wordnet as wn
 
 import pickle
 
+from helpers.question_store import QuestionStore
+from helpers.parallel import ShardedRunner
+
 # * Variables
 
 BASE_DIR = 'data/'
@@ -27,11 +30,6 @@ TRAIN_DATA_FILENAME = "vanilla_train"
 TRAIN_DATA_FILE = BASE_DIR + TRAIN_DATA_FILENAME + '.csv'
 TEST_DATA_FILE = BASE_DIR + 'test.csv'
 PREPROCESSED = 'preprocessed/'
-PREPROCESSED_TRAIN_WORDS = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'words.pkl'
-PREPROCESSED_TRAIN_DF = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'dataframe.hdf'
-
-PREPROCESSED_TEST_WORDS = BASE_DIR + PREPROCESSED + "test" + '-' + 'words.pkl'
-PREPROCESSED_TEST_DF = BASE_DIR + PREPROCESSED + "test" + '-' + 'dataframe.hdf'
 
 LOCATIONS = BASE_DIR + "cities.csv"
 
@@ -41,7 +39,8 @@ start_time = time.time()
 class AzFeatures:
     def __init__(self,
                  train_data_filename=TRAIN_DATA_FILENAME,
-                 test_data_filename=TEST_DATA_FILE):
+                 test_data_filename=TEST_DATA_FILE,
+                 n_workers=1):
 
         self.TRAIN_DATA_FILENAME = train_data_filename
         self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
@@ -50,6 +49,7 @@ class AzFeatures:
                                      train_data_filename + \
                                      "-az-train.csv"
         self.CUSTOM_FEATURES_TEST = 'custom/az-test.csv'
+        self.n_workers = n_workers
 
         locations = pd.read_csv(LOCATIONS, encoding="utf-8")
         countries = set(locations['Country'].dropna(inplace=False).values.tolist())
@@ -131,6 +131,14 @@ class AzFeatures:
 
         return X
 
+    def _build_features(self, data):
+        if self.n_workers == 1:
+            return self.build_features(data)
+        factory = functools.partial(AzFeatures,
+                                    self.TRAIN_DATA_FILENAME,
+                                    self.TEST_DATA_FILE)
+        return ShardedRunner(factory, self.n_workers).build_features(data)
+
     def run(self):
         if exists(self.CUSTOM_FEATURES_TRAIN) and exists(self.CUSTOM_FEATURES_TEST):
             print("Using cached az features for {}..."
@@ -142,20 +150,11 @@ class AzFeatures:
             if exists(self.CUSTOM_FEATURES_TRAIN):
                 print("Using cached features for the training data set...")
             else:
-                if exists(PREPROCESSED_TRAIN_DF):
-                    df_train = pd.read_hdf(PREPROCESSED_TRAIN_DF, 'df_data')
-                else:
-                    df_train = pd.read_csv(self.TRAIN_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_train['question1'] = df_train['question1']\
-                                            .map(lambda x: str(x).strip().split())
-                    df_train['question2'] = df_train['question2']\
-                                            .map(lambda x: str(x).strip().split())
-
-                    df_train.to_hdf(PREPROCESSED_TRAIN_DF,'df_data',mode='w')
+                df_train = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                                self.TEST_DATA_FILE).frame('train')
 
                 print("Computing features for the training data set...")
-                X_train = self.build_features(df_train)
+                X_train = self._build_features(df_train)
                 print("Saving...")
                 X_train.to_csv(self.CUSTOM_FEATURES_TRAIN, index=False)
 
@@ -163,18 +162,10 @@ class AzFeatures:
                 print("Using cached features the test data set...")
             else:
                 print("Processing the testing data set...")
-                if exists(PREPROCESSED_TEST_DF):
-                    df_test = pd.read_hdf(PREPROCESSED_TEST_DF, 'df_data')
-                else:
-                    df_test = pd.read_csv(self.TEST_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_test['question1'] = df_test['question1']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test['question2'] = df_test['question2']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test.to_hdf(PREPROCESSED_TEST_DF,'df_data',mode='w')
+                df_test = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                               self.TEST_DATA_FILE).frame('test')
 
                 print("Computing features for the test data set...")
-                X_test = self.build_features(df_test)
+                X_test = self._build_features(df_test)
                 print("Saving...")
                 X_test.to_csv(self.CUSTOM_FEATURES_TEST, index=False)
@@ -9,6 +9,7 @@ from scipy.stats import kendalltau
 from scipy.spatial.distance import directed_hausdorff
 from scipy.spatial.distance import correlation
 from scipy.spatial import procrustes
+from scipy import sparse
 import functools
 import itertools
 import time
@@ -17,16 +18,17 @@ import string
 from nltk.corpus import stopwords
 from nltk.stem import SnowballStemmer
 
-from collections import Counter
+from collections import Counter, OrderedDict
 
 from nltk.corpus import wordnet as wn
 
-import gensim
-from gensim.models.word2vec import Word2Vec
-
-
 import pickle
 
+from helpers.question_store import QuestionStore
+from helpers.parallel import ShardedRunner
+from helpers.sketches import QuestionSketches
+from helpers.embedding_store import EmbeddingStore
+
 # * Variables
 
 BASE_DIR = 'data/'
@@ -36,21 +38,23 @@ TEST_DATA_FILE = BASE_DIR + 'test.csv'
 EMBEDDING_FILE = BASE_DIR + 'GoogleNews-vectors-negative300.bin'
 
 PREPROCESSED = 'preprocessed/'
-PREPROCESSED_TRAIN_WORDS = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'words.pkl'
-PREPROCESSED_TRAIN_DF = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-' + 'dataframe.hdf'
-
-PREPROCESSED_TEST_WORDS = BASE_DIR + PREPROCESSED + "test" + '-' + 'words.pkl'
-PREPROCESSED_TEST_DF = BASE_DIR + PREPROCESSED + "test" + '-' + 'dataframe.hdf'
 PREPROCESSED_WORDVECS = BASE_DIR + PREPROCESSED + TRAIN_DATA_FILENAME + '-word2vec-dict.pkl'
 LOCATIONS = BASE_DIR + "cities.csv"
 
+# pairs per block of the batched features
+BATCH_SIZE = 50000
+# padded word slots per block of the padded word matrices
+MATRIX_BATCH_SLOTS = 50000
+PUNCTUATION = {ord(c): None for c in string.punctuation}
+
 start_time = time.time()
 # * Constructor
 
 class BukyFeatures:
     def __init__(self,
                  train_data_filename=TRAIN_DATA_FILENAME,
-                 test_data_filename=TEST_DATA_FILE):
+                 test_data_filename=TEST_DATA_FILE,
+                 n_workers=1):
 
         self.TRAIN_DATA_FILENAME = train_data_filename
         self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
@@ -59,7 +63,8 @@ class BukyFeatures:
                                      train_data_filename + \
                                      "-buky-train.csv"
         self.CUSTOM_FEATURES_TEST = 'custom/buky-test.csv'
-        self.model = gensim.models.KeyedVectors.load_word2vec_format(EMBEDDING_FILE, binary=True)
+        self.n_workers = n_workers
+        self.model = EmbeddingStore(EMBEDDING_FILE)
         self.wordvecs = {}
 
     def getWordVecs(self, words):
@@ -74,99 +79,73 @@ class BukyFeatures:
                 self.wordvecs[word] = np.zeros(300)
         return changed_words
 
-    def dot_mean_word2vec(self, row):
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-
-        q1 = self.getWordVecs(row['question1'])
-        q2 = self.getWordVecs(row['question2'])
+    def word2vec_sum(self, words):
+        """Sketches a question as (stripped words, sum of their vectors)."""
+        q = self.getWordVecs(words)
+        q_vec = np.zeros(300)
+        for word in q:
+            q_vec += self.wordvecs[word]
+        return (q, q_vec)
 
+    def _dot_mean_word2vec(self, q1, q2):
+        (q1, q1_sum), (q2, q2_sum) = q1, q2
         if len(q1) == 0 or len(q2) == 0:
             return 0
+        return np.dot(q1_sum / len(q1), q2_sum / len(q2))
 
-        q1_vec = np.zeros(300)
-        q2_vec = np.zeros(300)
-
-        for word in q1:
-            q1_vec += self.wordvecs[word]
-        q1_vec /= len(q1)
-        for word in q2:
-            q2_vec += self.wordvecs[word]
-        q2_vec /= len(q2)
-
-        return np.dot(q1_vec, q2_vec)
-
-    def euch_cross_mean_word2vec(self, row):
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-        q1 = self.getWordVecs(row['question1'])
-        q2 = self.getWordVecs(row['question2'])
+    def _mean_stats(self, q, q_sum):
+        q_vec = q_sum / len(q)
+        return np.array([np.mean(q_vec), np.var(q_vec), np.median(q_vec)])
 
+    def _euch_cross_mean_word2vec(self, q1, q2):
+        (q1, q1_sum), (q2, q2_sum) = q1, q2
         if len(q1) == 0 or len(q2) == 0:
             return 0
+        q1_vec = self._mean_stats(q1, q1_sum)
+        q2_vec = self._mean_stats(q2, q2_sum)
+        return np.linalg.norm(np.cross(q1_vec, q2_vec))
 
-        q1_vec = np.zeros(300)
-        q2_vec = np.zeros(300)
-
-        for word in q1:
-            word = word.translate({ord(c): None for c in string.punctuation})
-            q1_vec += self.wordvecs[word]
-        q1_vec /= len(q1)
-        for word in q2:
-            word = word.translate({ord(c): None for c in string.punctuation})
-            q2_vec += self.wordvecs[word]
-        q2_vec /= len(q2)
-
-        q1_vec = np.array([np.mean(q1_vec), np.var(q1_vec), np.median(q1_vec)])
-        q2_vec = np.array([np.mean(q2_vec), np.var(q2_vec), np.median(q2_vec)])
-
-        score = np.linalg.norm(np.cross(q1_vec, q2_vec))
-        return score
+    def _one_cross_mean_word2vec(self, q1, q2):
+        (q1, q1_sum), (q2, q2_sum) = q1, q2
+        if len(q1) == 0 or len(q2) == 0:
+            return 0
+        q1_vec = self._mean_stats(q1, q1_sum)
+        q2_vec = self._mean_stats(q2, q2_sum)
+        return np.linalg.norm(np.cross(q1_vec, q2_vec), ord=1)
 
-    def one_cross_mean_word2vec(self, row):
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-        q1 = self.getWordVecs(row['question1'])
-        q2 = self.getWordVecs(row['question2'])
+    def _log_diff_word2vec(self, q1, q2):
+        (q1, q1_sum), (q2, q2_sum) = q1, q2
+        if len(q1) == 0 or len(q2) == 0:
+            return 0
+        q1_vec = 1 + q1_sum
+        q2_vec = 1 + q2_sum
+        return np.log(1 + np.linalg.norm(q2_vec - q1_vec) / (len(q1) + len(q2)))
 
+    def _naive_diff_word2vec(self, q1, q2):
+        (q1, q1_sum), (q2, q2_sum) = q1, q2
         if len(q1) == 0 or len(q2) == 0:
             return 0
+        q1_vec = 1 + q1_sum
+        q2_vec = 1 + q2_sum
+        return abs(np.linalg.norm(q2_vec) / len(q2) - np.linalg.norm(q1_vec) / len(q1))
 
-        q1_vec = np.zeros(300)
-        q2_vec = np.zeros(300)
+    def _correlation_am_word2vec(self, q1, q2):
+        (q1, q1_sum), (q2, q2_sum) = q1, q2
+        if len(q1) == 0 or len(q2) == 0:
+            return 0
+        return correlation(q1_sum / len(q1), q2_sum / len(q2))
 
-        for word in q1:
-            word = word.translate({ord(c): None for c in string.punctuation})
-            q1_vec += self.wordvecs[word]
-        q1_vec /= len(q1)
-        for word in q2:
-            word = word.translate({ord(c): None for c in string.punctuation})
-            q2_vec += self.wordvecs[word]
-        q2_vec /= len(q2)
+    def dot_mean_word2vec(self, row):
+        return self._dot_mean_word2vec(self.word2vec_sum(row['question1']),
+                                       self.word2vec_sum(row['question2']))
 
-        q1_vec = np.array([np.mean(q1_vec), np.var(q1_vec), np.median(q1_vec)])
-        q2_vec = np.array([np.mean(q2_vec), np.var(q2_vec), np.median(q2_vec)])
+    def euch_cross_mean_word2vec(self, row):
+        return self._euch_cross_mean_word2vec(self.word2vec_sum(row['question1']),
+                                              self.word2vec_sum(row['question2']))
 
-        score = np.linalg.norm(np.cross(q1_vec, q2_vec), ord=1)
-        return score
+    def one_cross_mean_word2vec(self, row):
+        return self._one_cross_mean_word2vec(self.word2vec_sum(row['question1']),
+                                             self.word2vec_sum(row['question2']))
 
     def unique_dot_mean_word2vec(self, row):
         try:
@@ -275,59 +254,12 @@ class BukyFeatures:
 
 
     def log_diff_word2vec(self, row):
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-        q1 = self.getWordVecs(row['question1'])
-        q2 = self.getWordVecs(row['question2'])
-
-        if len(q1) == 0 or len(q2) == 0:
-            return 0
-
-        q1_vec = np.ones(300)
-        q2_vec = np.ones(300)
-
-        for word in q1:
-            q1_vec += self.wordvecs[word]
-
-        for word in q2:
-            q2_vec += self.wordvecs[word]
-
-        score = np.log(1 + np.linalg.norm(q2_vec - q1_vec) / (len(q1) + len(q2)))
-        return score
+        return self._log_diff_word2vec(self.word2vec_sum(row['question1']),
+                                       self.word2vec_sum(row['question2']))
 
     def naive_diff_word2vec(self, row):
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-
-        q1 = self.getWordVecs(row['question1'])
-        q2 = self.getWordVecs(row['question2'])
-
-        if len(q1) == 0 or len(q2) == 0:
-            return 0
-
-        q1_vec = np.ones(300)
-        q2_vec = np.ones(300)
-
-        for word in q1:
-            q1_vec += self.wordvecs[word]
-
-        for word in q2:
-            q2_vec += self.wordvecs[word]
-
-        score = abs(np.linalg.norm(q2_vec) / len(q2) - np.linalg.norm(q1_vec) / len(q1))
-        return score
+        return self._naive_diff_word2vec(self.word2vec_sum(row['question1']),
+                                         self.word2vec_sum(row['question2']))
 
     def directed_hausdorff_word2vec(self, row):
         try:
@@ -397,8 +329,9 @@ class BukyFeatures:
         q1 = self.getWordVecs(row['question1'])
         q2 = self.getWordVecs(row['question2'])
 
-        q1 = list(set(word for word in q1 if word not in stops))
-        q2 = list(set(word for word in q2 if word not in stops))
+        # the first distinct words, as set() would trim them in random order
+        q1 = list(OrderedDict.fromkeys(word for word in q1 if word not in stops))
+        q2 = list(OrderedDict.fromkeys(word for word in q2 if word not in stops))
 
         trim_length = min(4, min(len(q1), len(q2)))
         q1 = q1[:trim_length]
@@ -413,7 +346,11 @@ class BukyFeatures:
         q1_vecs = np.concatenate(q1_vecs, axis=0)
         q2_vecs = np.concatenate(q2_vecs, axis=0)
 
-        score = procrustes(q1_vecs, q2_vecs)[2]
+        try:
+            score = procrustes(q1_vecs, q2_vecs)[2]
+        except ValueError:
+            # all the words share one vector, e.g. none is in the model
+            return 0
         return score
 
     def procrustes_unique_word2vec(self, row):
@@ -430,8 +367,8 @@ class BukyFeatures:
         q1_words = self.getWordVecs(row['question1'])
         q2_words = self.getWordVecs(row['question2'])
 
-        q1 = list(set( word for word in q1_words if word not in q2_words and word not in stops))
-        q2 = list(set( word for word in q2_words if word not in q1_words and word not in stops))
+        q1 = list(OrderedDict.fromkeys( word for word in q1_words if word not in q2_words and word not in stops))
+        q2 = list(OrderedDict.fromkeys( word for word in q2_words if word not in q1_words and word not in stops))
 
         trim_length = min(3, min(len(q1), len(q2)))                
         q1 = q1[:trim_length]
@@ -446,7 +383,11 @@ class BukyFeatures:
         q1_vecs = np.concatenate(q1_vecs, axis=0)
         q2_vecs = np.concatenate(q2_vecs, axis=0)
 
-        score = procrustes(q1_vecs, q2_vecs)[2]
+        try:
+            score = procrustes(q1_vecs, q2_vecs)[2]
+        except ValueError:
+            # all the words share one vector, e.g. none is in the model
+            return 0
         return score
 
 
@@ -480,67 +421,294 @@ class BukyFeatures:
         score = correlation(q1_vec, q2_vec)
         return score
     def correlation_am_word2vec(self, row):
-        try:
-            if row['id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-        except KeyError:
-            if row['test_id'] % 10000 == 0:
-                elapsed = time.time() - start_time
-                print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-        q1 = self.getWordVecs(row['question1'])
-        q2 = self.getWordVecs(row['question2'])
-
-        if len(q1) == 0 or len(q2) == 0:
-            return 0
-
-        q1_vec = np.zeros(300)
-        q2_vec = np.zeros(300)
-
-        for word in q1:
-            q1_vec += self.wordvecs[word]
-        q1_vec /= len(q1)
-        for word in q2:
-            q2_vec += self.wordvecs[word]
-        q2_vec /= len(q2)
-
-        score = correlation(q1_vec, q2_vec)
-        return score
-
-    def build_features(self, data):
+        return self._correlation_am_word2vec(self.word2vec_sum(row['question1']),
+                                             self.word2vec_sum(row['question2']))
+
+# * Batched Features
+
+    def _embed_tokens(self, data):
+        """Maps the tokens of both question columns to rows of a word vector
+        matrix, stripping the punctuation once per distinct token."""
+        columns = []
+        for column in ('question1', 'question2'):
+            lengths = np.fromiter(map(len, data[column]), dtype=np.int64,
+                                  count=len(data))
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            columns.append((list(itertools.chain.from_iterable(data[column])),
+                            offsets))
+        tokens = pd.Series(columns[0][0] + columns[1][0], dtype=object)
+        token_ids, raw_words = pd.factorize(tokens)
+        stripped = pd.Series([w.translate(PUNCTUATION) for w in raw_words],
+                             dtype=object)
+        stripped_ids, words = pd.factorize(stripped)
+        word_ids = stripped_ids[token_ids]
+
+        # words without a vector keep a zero row
+        vectors = np.zeros((len(words), 300), dtype=np.float32)
+        rows = self.model.lookup(words)
+        vectors[rows >= 0] = self.model.vectors[rows[rows >= 0]]
+        stops = set(stopwords.words("english"))
+        is_stop = np.array([w in stops for w in words], dtype=bool)
+
+        n_tokens = len(columns[0][0])
+        return ((word_ids[:n_tokens], columns[0][1]),
+                (word_ids[n_tokens:], columns[1][1]),
+                vectors, is_stop)
+
+    def _matrix_batches(self, widths):
+        """Splits the pairs into blocks of at most MATRIX_BATCH_SLOTS padded
+        word slots, a block being as wide as its widest pair."""
+        n = len(widths)
+        widths = np.maximum(widths, 1)
+        start = 0
+        while start < n:
+            # a block holds at most MATRIX_BATCH_SLOTS pairs
+            window = np.maximum.accumulate(widths[start:start + MATRIX_BATCH_SLOTS])
+            slots = window * np.arange(1, len(window) + 1)
+            end = start + max(int(np.searchsorted(slots, MATRIX_BATCH_SLOTS,
+                                                  side='right')), 1)
+            yield start, end
+            start = end
+
+    def _stack(self, ids, lengths, width, vectors):
+        """Stacks the word vectors of each question into a zero padded
+        (n, width, 300) array, with the word ids (-1 for padding)."""
+        n = len(lengths)
+        rank = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        rows = np.repeat(np.arange(n), lengths)
+        stacked = np.zeros((n, width, vectors.shape[1]), dtype=vectors.dtype)
+        stacked[rows, rank] = vectors[ids]
+        word_ids = np.full((n, width), -1, dtype=np.int64)
+        word_ids[rows, rank] = ids
+        return stacked, word_ids
+
+    def _batched_hausdorff(self, ids1, l1, ids2, l2, vectors):
+        """Directed Hausdorff distances from question1 to question2, for
+        MATRIX_BATCH_SLOTS padded words at a time."""
+        n = len(l1)
+        result = np.zeros(n)
+        o1 = np.concatenate([[0], np.cumsum(l1)])
+        o2 = np.concatenate([[0], np.cumsum(l2)])
+        for start, end in self._matrix_batches(np.maximum(l1, l2)):
+            valid = (l1[start:end] > 0) & (l2[start:end] > 0)
+            if not valid.any():
+                continue
+            a, w1 = self._stack(ids1[o1[start]:o1[end]], l1[start:end],
+                                max(l1[start:end].max(), 1), vectors)
+            b, w2 = self._stack(ids2[o2[start]:o2[end]], l2[start:end],
+                                max(l2[start:end].max(), 1), vectors)
+            # the float32 vectors are multiplied in float64
+            squared = (np.einsum('nik,nik->ni', a, a, dtype=np.float64)[:, :, None] +
+                       np.einsum('njk,njk->nj', b, b, dtype=np.float64)[:, None, :] -
+                       2 * np.matmul(a, b.transpose(0, 2, 1), dtype=np.float64))
+            distances = np.sqrt(np.maximum(squared, 0))
+            # same words are exactly zero apart, whatever the rounding
+            distances[w1[:, :, None] == w2[:, None, :]] = 0
+            distances[np.broadcast_to(w2[:, None, :] < 0, distances.shape)] = np.inf
+            nearest = distances.min(axis=2)
+            nearest[w1 < 0] = -np.inf
+            result[start:end] = np.where(valid, nearest.max(axis=1), 0)
+        return result
+
+    def _batched_procrustes(self, ids1, l1, keep1, ids2, l2, keep2, size, vectors):
+        """Procrustes disparities between the first distinct kept words of
+        both questions, trimmed to the same length of at most size words.
+        Pairs with less than two words on either side get 0."""
+        n = len(l1)
+        n_words = len(vectors)
+
+        def first_distinct(ids, lengths, keep):
+            # rank of each kept word among the distinct kept words of its pair
+            pairs = np.repeat(np.arange(n), lengths)
+            positions = np.flatnonzero(keep)
+            _, first = np.unique(pairs[positions] * n_words + ids[positions],
+                                 return_index=True)
+            positions = np.sort(positions[first])
+            counts = np.bincount(pairs[positions], minlength=n)
+            rank = np.arange(len(positions)) - \
+                   np.repeat(np.cumsum(counts) - counts, counts)
+            return pairs[positions], ids[positions], rank, counts
+
+        p1, w1, r1, c1 = first_distinct(ids1, l1, keep1)
+        p2, w2, r2, c2 = first_distinct(ids2, l2, keep2)
+        k = np.minimum(size, np.minimum(c1, c2))
+        result = np.zeros(n)
+        for start, end in self._matrix_batches(np.full(n, size)):
+            block_k = k[start:end]
+            if not (block_k > 1).any():
+                continue
+            matrices = []
+            for p, w, r in ((p1, w1, r1), (p2, w2, r2)):
+                sel = (p >= start) & (p < end)
+                sel[sel] = r[sel] < k[p[sel]]
+                m = np.zeros((end - start, size, vectors.shape[1]))
+                m[p[sel] - start, r[sel]] = vectors[w[sel]]
+                # centre on the mean of the k words, keeping the padding at zero
+                mask = (np.arange(size)[None, :] < block_k[:, None])[:, :, None]
+                mean = m.sum(axis=1, keepdims=True) / np.maximum(block_k, 1)[:, None, None]
+                m = (m - mean) * mask
+                matrices.append(m)
+            a, b = matrices
+            norm_a = np.sqrt(np.einsum('nik,nik->n', a, a))
+            norm_b = np.sqrt(np.einsum('nik,nik->n', b, b))
+            valid = (block_k > 1) & (norm_a > 0) & (norm_b > 0)
+            a = a / np.where(valid, norm_a, 1)[:, None, None]
+            b = b / np.where(valid, norm_b, 1)[:, None, None]
+            # The disparity of unit matrices is 1 - (nuclear norm of a'b)^2.
+            # a'b shares its singular values with s u'b, where a = u s v'.
+            u, s, _ = np.linalg.svd(a, full_matrices=False)
+            reduced = s[:, :, None] * np.matmul(u.transpose(0, 2, 1), b)
+            nuclear = np.linalg.svd(reduced, compute_uv=False).sum(axis=1)
+            result[start:end] = np.where(valid, np.maximum(1 - nuclear**2, 0), 0)
+        return result
+
+    def _batched_block_features(self, q1_ids, q1_offsets, q2_ids, q2_offsets,
+                                vectors, is_stop):
+        """Computes the word2vec features of a block of pairs at once."""
+        n = len(q1_offsets) - 1
+        l1 = np.diff(q1_offsets)
+        l2 = np.diff(q2_offsets)
+        n_words = len(vectors)
+
+        # A q1 word is unique if it is missing from q2 of the same pair.
+        pair1 = np.repeat(np.arange(n), l1)
+        pair2 = np.repeat(np.arange(n), l2)
+        unique1 = ~np.isin(pair1 * n_words + q1_ids, pair2 * n_words + q2_ids)
+        unique2 = ~np.isin(pair2 * n_words + q2_ids, pair1 * n_words + q1_ids)
+        u1 = np.bincount(pair1[unique1], minlength=n)
+        u2 = np.bincount(pair2[unique2], minlength=n)
+
+        def sums(ids, offsets, keep=None):
+            # the rows of the sparse matrix keep the order of the words
+            if keep is not None:
+                ids = ids[keep]
+                kept = np.bincount(np.repeat(np.arange(n), np.diff(offsets))[keep],
+                                   minlength=n)
+                offsets = np.concatenate([[0], np.cumsum(kept)])
+            return sparse.csr_matrix((np.ones(len(ids)), ids, offsets),
+                                     shape=(n, n_words)) @ vectors
+
+        s1 = sums(q1_ids, q1_offsets)
+        s2 = sums(q2_ids, q2_offsets)
+        valid = (l1 > 0) & (l2 > 0)
+        d1 = np.where(valid, l1, 1)[:, None]
+        d2 = np.where(valid, l2, 1)[:, None]
+
+        def stats(m):
+            return np.stack([np.mean(m, axis=1), np.var(m, axis=1),
+                             np.median(m, axis=1)], axis=1)
+
+        def correlations(u, v):
+            u = u - u.mean(axis=1, keepdims=True)
+            v = v - v.mean(axis=1, keepdims=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dist = 1.0 - np.einsum('ij,ij->i', u, v) / \
+                       np.sqrt(np.einsum('ij,ij->i', u, u) *
+                               np.einsum('ij,ij->i', v, v))
+            return np.clip(dist, 0.0, 2.0)
+
+        features = {}
+        for prefix, m1, m2 in (('', s1 / d1, s2 / d2),
+                               ('unique_', sums(q1_ids, q1_offsets, unique1) / d1,
+                                sums(q2_ids, q2_offsets, unique2) / d2)):
+            cross = np.cross(stats(m1), stats(m2))
+            features[prefix + 'dot_mean'] = np.einsum('ij,ij->i', m1, m2)
+            features[prefix + 'euch_cross_mean'] = np.linalg.norm(cross, axis=1)
+            features[prefix + 'one_cross_mean'] = np.abs(cross).sum(axis=1)
+            features[prefix + 'correlation_am'] = correlations(m1, m2)
+        features['log_diff'] = np.log(1 + np.linalg.norm((1 + s2) - (1 + s1), axis=1)
+                                      / np.where(valid, l1 + l2, 1))
+        features['naive_diff'] = np.abs(np.linalg.norm(1 + s2, axis=1) / d2[:, 0] -
+                                        np.linalg.norm(1 + s1, axis=1) / d1[:, 0])
+        for name in features:
+            features[name] = np.where(valid, features[name], 0.0)
+
+        features['directed_hausdorff'] = self._batched_hausdorff(
+            q1_ids, l1, q2_ids, l2, vectors)
+        features['directed_hausdorff_unique'] = self._batched_hausdorff(
+            q1_ids[unique1], u1, q2_ids[unique2], u2, vectors)
+        features['procrustes'] = self._batched_procrustes(
+            q1_ids, l1, ~is_stop[q1_ids], q2_ids, l2, ~is_stop[q2_ids], 4, vectors)
+        features['procrustes_unique'] = self._batched_procrustes(
+            q1_ids, l1, unique1 & ~is_stop[q1_ids],
+            q2_ids, l2, unique2 & ~is_stop[q2_ids], 3, vectors)
+        return features
+
+    def batched_features(self, data):
+        """Computes the word2vec features of all pairs, BATCH_SIZE pairs
+        at a time."""
+        (q1_ids, q1_offsets), (q2_ids, q2_offsets), vectors, is_stop = \
+            self._embed_tokens(data)
+        blocks = []
+        for start in range(0, len(data), BATCH_SIZE):
+            end = min(start + BATCH_SIZE, len(data))
+            a1, b1 = q1_offsets[start], q1_offsets[end]
+            a2, b2 = q2_offsets[start], q2_offsets[end]
+            blocks.append(self._batched_block_features(
+                q1_ids[a1:b1], q1_offsets[start:end + 1] - a1,
+                q2_ids[a2:b2], q2_offsets[start:end + 1] - a2,
+                vectors, is_stop))
+            print("Processed {:10.0f} pairs in {:10.0f} s "
+                  .format(end, time.time() - start_time))
+        return pd.DataFrame({name: np.concatenate([b[name] for b in blocks])
+                             for name in (blocks[0] if blocks else [])},
+                            index=data.index)
+
+    def build_features(self, data, batched=True):
         X = pd.DataFrame()
-        # Commented features are too computationally expensive.
-        # print("Calculating procrustes_word2vec...")
-        # X['procrustes_word2vec'] = data.apply(self.procrustes_word2vec, axis=1, raw=True)
-        # print("Calculating procrustes_unique_word2vec...")
-        # X['procrustes_unique_word2vec'] = data.apply(self.procrustes_unique_word2vec, axis=1, raw=True)                
-        print("Calculating dot_mean_word2vec...")
-        X['dot_mean_word2vec'] = data.apply(self.dot_mean_word2vec, axis=1, raw=True)
-        print("Calculating euch_cross_mean_word2vec...")
-        X['euch_cross_mean_word2vec'] = data.apply(self.euch_cross_mean_word2vec, axis=1, raw=True)
-        print("Calculating one_cross_mean_word2vec...")
-        X['one_cross_mean_word2vec'] = data.apply(self.one_cross_mean_word2vec, axis=1, raw=True)
-        print("Calculating unique_dot_mean_word2vec...")
-        X['unique_dot_mean_word2vec'] = data.apply(self.unique_dot_mean_word2vec, axis=1, raw=True)
-        print("Calculating unique_euch_cross_mean_word2vec...")
-        X['unique_euch_cross_mean_word2vec'] = data.apply(self.unique_euch_cross_mean_word2vec, axis=1, raw=True)
-        print("Calculating unique_one_cross_mean_word2vec...")
-        X['unique_one_cross_mean_word2vec'] = data.apply(self.unique_one_cross_mean_word2vec, axis=1, raw=True)
-        print("Calculating log_diff_word2vec...")
-        X['log_diff_word2vec'] = data.apply(self.log_diff_word2vec, axis=1, raw=True)
-        print("Calculating naive_diff_word2vec...")
-        X['naive_diff_word2vec'] = data.apply(self.naive_diff_word2vec, axis=1, raw=True)
-        print("Calculating directed_hausdorff_word2vec...")
-        X['directed_hausdorff_word2vec'] = data.apply(self.directed_hausdorff_word2vec, axis=1, raw=True)
-        print("Calculating directed_hausdorff_unique_word2vec...")
-        X['directed_hausdorff_unique_word2vec'] = data.apply(self.directed_hausdorff_unique_word2vec, axis=1, raw=True)
-        print("Calculating correlation_am_word2vec...")
-        X['correlation_am_word2vec'] = data.apply(self.correlation_am_word2vec, axis=1, raw=True).fillna(0.0)
-        print("Calculating correlation_unique_am_word2vec...")
-        X['correlation_unique_am_word2vec'] = data.apply(self.correlation_unique_am_word2vec, axis=1, raw=True).fillna(0.0)
+        if batched:
+            print("Calculating the word2vec features in batches...")
+            B = self.batched_features(data)
+            for name in ('procrustes', 'procrustes_unique', 'dot_mean',
+                         'euch_cross_mean', 'one_cross_mean', 'unique_dot_mean',
+                         'unique_euch_cross_mean', 'unique_one_cross_mean',
+                         'log_diff', 'naive_diff', 'directed_hausdorff',
+                         'directed_hausdorff_unique'):
+                X[name + '_word2vec'] = B[name]
+            X['correlation_am_word2vec'] = B['correlation_am'].fillna(0.0)
+            X['correlation_unique_am_word2vec'] = B['unique_correlation_am'].fillna(0.0)
+        else:
+            print("Calculating procrustes_word2vec...")
+            X['procrustes_word2vec'] = data.apply(self.procrustes_word2vec, axis=1, raw=True)
+            print("Calculating procrustes_unique_word2vec...")
+            X['procrustes_unique_word2vec'] = data.apply(self.procrustes_unique_word2vec, axis=1, raw=True)
+            print("Summing word vectors per question...")
+            sums = QuestionSketches(data, self.word2vec_sum)
+            print("Calculating dot_mean_word2vec...")
+            X['dot_mean_word2vec'] = sums.combine(self._dot_mean_word2vec)
+            print("Calculating euch_cross_mean_word2vec...")
+            X['euch_cross_mean_word2vec'] = sums.combine(self._euch_cross_mean_word2vec)
+            print("Calculating one_cross_mean_word2vec...")
+            X['one_cross_mean_word2vec'] = sums.combine(self._one_cross_mean_word2vec)
+            print("Calculating unique_dot_mean_word2vec...")
+            X['unique_dot_mean_word2vec'] = data.apply(self.unique_dot_mean_word2vec, axis=1, raw=True)
+            print("Calculating unique_euch_cross_mean_word2vec...")
+            X['unique_euch_cross_mean_word2vec'] = data.apply(self.unique_euch_cross_mean_word2vec, axis=1, raw=True)
+            print("Calculating unique_one_cross_mean_word2vec...")
+            X['unique_one_cross_mean_word2vec'] = data.apply(self.unique_one_cross_mean_word2vec, axis=1, raw=True)
+            print("Calculating log_diff_word2vec...")
+            X['log_diff_word2vec'] = sums.combine(self._log_diff_word2vec)
+            print("Calculating naive_diff_word2vec...")
+            X['naive_diff_word2vec'] = sums.combine(self._naive_diff_word2vec)
+            print("Calculating directed_hausdorff_word2vec...")
+            X['directed_hausdorff_word2vec'] = data.apply(self.directed_hausdorff_word2vec, axis=1, raw=True)
+            print("Calculating directed_hausdorff_unique_word2vec...")
+            X['directed_hausdorff_unique_word2vec'] = data.apply(self.directed_hausdorff_unique_word2vec, axis=1, raw=True)
+            print("Calculating correlation_am_word2vec...")
+            X['correlation_am_word2vec'] = sums.combine(self._correlation_am_word2vec).fillna(0.0)
+            print("Calculating correlation_unique_am_word2vec...")
+            X['correlation_unique_am_word2vec'] = data.apply(self.correlation_unique_am_word2vec, axis=1, raw=True).fillna(0.0)
 
         return X
 
+    def _build_features(self, data):
+        if self.n_workers == 1:
+            return self.build_features(data)
+        factory = functools.partial(BukyFeatures,
+                                    self.TRAIN_DATA_FILENAME,
+                                    self.TEST_DATA_FILE)
+        return ShardedRunner(factory, self.n_workers).build_features(data)
+
     def run(self):
         if exists(self.CUSTOM_FEATURES_TRAIN) and exists(self.CUSTOM_FEATURES_TEST):
             print("Using cached buky features for {}..."
@@ -552,20 +720,11 @@ class BukyFeatures:
             if exists(self.CUSTOM_FEATURES_TRAIN):
                 print("Using cached features for the training data set...")
             else:
-                if exists(PREPROCESSED_TRAIN_DF):
-                    df_train = pd.read_hdf(PREPROCESSED_TRAIN_DF, 'df_data')
-                else:
-                    df_train = pd.read_csv(self.TRAIN_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_train['question1'] = df_train['question1']\
-                                            .map(lambda x: str(x).strip().split())
-                    df_train['question2'] = df_train['question2']\
-                                            .map(lambda x: str(x).strip().split())
-
-                    df_train.to_hdf(PREPROCESSED_TRAIN_DF,'df_data',mode='w')
+                df_train = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                                self.TEST_DATA_FILE).frame('train')
 
                 print("Computing features for the training data set...")
-                X_train = self.build_features(df_train)
+                X_train = self._build_features(df_train)
                 print("Saving...")
                 X_train.to_csv(self.CUSTOM_FEATURES_TRAIN, index=False)
 
@@ -573,18 +732,10 @@ class BukyFeatures:
                 print("Using cached features for the test data set...")
             else:
                 print("Processing the testing data set...")
-                if exists(PREPROCESSED_TEST_DF):
-                    df_test = pd.read_hdf(PREPROCESSED_TEST_DF, 'df_data')
-                else:
-                    df_test = pd.read_csv(self.TEST_DATA_FILE,
-                                           encoding="utf-8").fillna(" ")
-                    df_test['question1'] = df_test['question1']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test['question2'] = df_test['question2']\
-                                           .map(lambda x: str(x).strip().split())
-                    df_test.to_hdf(PREPROCESSED_TEST_DF,'df_data',mode='w')
+                df_test = QuestionStore.cached(self.TRAIN_DATA_FILENAME,
+                                               self.TEST_DATA_FILE).frame('test')
 
                 print("Computing features for the test data set...")
-                X_test = self.build_features(df_test)
+                X_test = self._build_features(df_test)
                 print("Saving...")
                 X_test.to_csv(self.CUSTOM_FEATURES_TEST, index=False)
@@ -1,12 +1,16 @@
 # coding: utf-8
-# Based on notebook by https://www.kaggle.com/shubh24 
+# Based on notebook by https://www.kaggle.com/shubh24
 # https://www.kaggle.com/shubh24/pagerank-on-quora-a-basic-implementation
 # See also the work of ZFTurbo: https://kaggle.com/zfturbo
+
+# * Libraries
+from os.path import exists
+import numpy as np
 import pandas as pd
-import hashlib
-import gc 
-import time
+from helpers.question_graph import QuestionGraph, DAMPING, TOLERANCE, \
+    is_stale, update_rows
 
+# * Variables
 BASE_DIR = 'data/'
 TRAIN_DATA_FILENAME = "vanilla_train"
 TRAIN_DATA_FILE = BASE_DIR + TRAIN_DATA_FILENAME + '.csv'
@@ -17,77 +21,71 @@ PAGERANK_TRAIN = 'custom/' + \
                  "-pagerank-train.csv"
 PAGERANK_TEST = 'custom/' + "pagerank-test.csv"
 
-start_time = time.time()
-
-
-df_train = pd.read_csv(TRAIN_DATA_FILE).fillna("")
-df_test = pd.read_csv(TEST_DATA_FILE).fillna("")
-
-
-# Generating a graph of Questions and their neighbors
-def generate_qid_graph_table(row):
-    hash_key1 = hashlib.md5(row["question1"].encode('utf-8')).hexdigest()
-    hash_key2 = hashlib.md5(row["question2"].encode('utf-8')).hexdigest()
-
-    qid_graph.setdefault(hash_key1, []).append(hash_key2)
-    qid_graph.setdefault(hash_key2, []).append(hash_key1)
-
-
-qid_graph = {}
-print('Generating a qid graph for the train dataframe...')
-df_train.apply(generate_qid_graph_table, axis=1)
-print('Generating a qid graph for the test dataframe...')
-df_test.apply(generate_qid_graph_table, axis=1)
-
-
-def pagerank():
-    MAX_ITER = 20
-    d = 0.85
-
-    # Initializing -- every node gets a uniform value!
-    pagerank_dict = {i: 1 / len(qid_graph) for i in qid_graph}
-    num_nodes = len(pagerank_dict)
-
-    for iter in range(0, MAX_ITER):
-
-        for node in qid_graph:
-            local_pr = 0
-
-            for neighbor in qid_graph[node]:
-                local_pr += pagerank_dict[neighbor] / len(qid_graph[neighbor])
-
-            pagerank_dict[node] = (1 - d) / num_nodes + d * local_pr
-
-    return pagerank_dict
-
-print('Building the main PR generator...')
-pagerank_dict = pagerank()
-
-def get_pagerank_value(row):
-    try:
-        if row['id'] % 10000 == 0:
-            elapsed = time.time() - start_time
-            print("Processed {:10.0f} questions in {:10.0f} s ".format(row['id'], elapsed))
-    except KeyError:
-        if row['test_id'] % 10000 == 0:
-            elapsed = time.time() - start_time
-            print("Processed {:10.0f} questions in {:10.0f} s ".format(row['test_id'], elapsed))
-    q1 = hashlib.md5(row["question1"].encode('utf-8')).hexdigest()
-    q2 = hashlib.md5(row["question2"].encode('utf-8')).hexdigest()
-    s = pd.Series({
-        "q1_pr": pagerank_dict[q1],
-        "q2_pr": pagerank_dict[q2]
-    })
-    return s
-
-print('Computing pageranks for the train dataframe...')
-pagerank_feats_train = df_train.apply(get_pagerank_value, axis=1)
-print('Writing the pageranks...')
-pagerank_feats_train.to_csv(PAGERANK_TRAIN, index=False)
-del df_train
-gc.collect()
-print('Computing pageranks for the test dataframe...')
-pagerank_feats_test = df_test.apply(get_pagerank_value, axis=1)
-print('Writing the pageranks...')
-pagerank_feats_test.to_csv(PAGERANK_TEST, index=False)
-
+# * Constructor
+class PageRank:
+    def __init__(self,
+                 train_data_filename=TRAIN_DATA_FILENAME,
+                 test_data_filename=TEST_DATA_FILE,
+                 damping=DAMPING,
+                 tol=TOLERANCE,
+                 question_graph=None):
+
+        self.TRAIN_DATA_FILENAME = train_data_filename
+        self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
+        self.TEST_DATA_FILE = test_data_filename
+        self.PAGERANK_TRAIN = 'custom/' + \
+                              train_data_filename + \
+                              "-pagerank-train.csv"
+        self.PAGERANK_TEST = PAGERANK_TEST
+        self.damping = damping
+        self.tol = tol
+        self.question_graph = question_graph
+
+    def build_graph(self):
+        """Loads the shared question graph of the train and test pairs."""
+        if self.question_graph is None:
+            self.question_graph = QuestionGraph(self.TRAIN_DATA_FILENAME,
+                                                self.TEST_DATA_FILE)
+
+    def compute(self):
+        print('Building the main PR generator...')
+        self.pagerank = self.question_graph.pagerank(self.damping, self.tol)
+
+    def build_features(self, split, rows=None):
+        """Gathers the pageranks of the questions of each pair of a split,
+        or of the given rows of it."""
+        q1, q2 = self.question_graph.pairs(split)
+        if rows is not None:
+            q1, q2 = q1[rows], q2[rows]
+        return pd.DataFrame({'q1_pr': np.take(self.pagerank, q1),
+                             'q2_pr': np.take(self.pagerank, q2)})
+
+    def run(self):
+        if exists(self.PAGERANK_TRAIN) and exists(self.PAGERANK_TEST) and \
+           not is_stale(self.TRAIN_DATA_FILENAME, self.PAGERANK_TRAIN, self.PAGERANK_TEST):
+            print("Using cached pageranks for {}..."
+                  .format(self.TRAIN_DATA_FILENAME))
+            return
+        print('Generating a qid graph for the train and test dataframes...')
+        self.build_graph()
+        self.compute()
+
+        print('Computing pageranks for the train dataframe...')
+        pagerank_feats_train = self.build_features('train')
+        print('Writing the pageranks...')
+        pagerank_feats_train.to_csv(self.PAGERANK_TRAIN, index=False)
+        print('Computing pageranks for the test dataframe...')
+        pagerank_feats_test = self.build_features('test')
+        print('Writing the pageranks...')
+        pagerank_feats_test.to_csv(self.PAGERANK_TEST, index=False)
+
+    def update(self, affected):
+        """Rewrites the rows of the pageranks listed in affected, as returned
+        by QuestionGraph.add_pairs."""
+        self.build_graph()
+        self.compute()
+        for split, filename in (('train', self.PAGERANK_TRAIN), ('test', self.PAGERANK_TEST)):
+            update_rows(filename, affected[split], self.build_features(split, affected[split]))
+
+if __name__ == "__main__":
+    PageRank().run()
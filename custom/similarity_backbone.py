@@ -14,6 +14,7 @@ from nltk.corpus import brown
 import math
 import numpy as np
 import sys
+from functools import lru_cache
 
 # Parameters to the algorithm. Currently set to values that was reported
 # in the paper to produce "best" results.
@@ -23,6 +24,11 @@ ETA = 0.4
 PHI = 0.2
 DELTA = 0.85
 
+# synsets whose hypernym maps and lemma names are kept, and word pairs
+# whose similarities are kept
+SYNSET_CACHE_SIZE = 2**16
+WORD_CACHE_SIZE = 2**20
+
 brown_freqs = dict()
 N = 0
 
@@ -33,18 +39,77 @@ class SimilarityBackbone:
         self.words = {}
         self.N = N
         self.tokens = {}
+        # caches of this backbone only; on the class they would be shared
+        # by all the backbones and keep them and their synsets alive
+        self.hypernym_maps = lru_cache(maxsize=SYNSET_CACHE_SIZE)(self._hypernym_maps)
+        self.lemma_names = lru_cache(maxsize=SYNSET_CACHE_SIZE)(self._lemma_names)
+        self._word_similarity = lru_cache(maxsize=WORD_CACHE_SIZE)(
+            self._compute_word_similarity)
     
     ######################### word similarity ##########################
     def get_synsets(self, word):
-        """Get a synset for a word.
-        If the argument <words> is not None, cache the results.
+        """Get the synsets of a word.
+        The synsets of the argument <raw_words> are looked up once, the first
+        time, and those of any other word when it is first asked for.
         """
-        if self.raw_words:
-            for w in self.raw_words:                
+        if self.raw_words and not self.words:
+            for w in self.raw_words:
                 self.words[w] = wn.synsets(w)
-            return self.words[word]
-        else:
-            return wn.synset(word)
+        if word not in self.words:
+            self.words[word] = wn.synsets(word)
+        return self.words[word]
+
+    def _hypernym_maps(self, synset):
+        """
+        Return the shortest and the longest distances from a synset to each
+        of its hypernyms, itself included, as two dicts. The shortest are
+        those NLTK measures paths with; the longest those the maximum of
+        hypernym_distances() gives.
+        """
+        shortest = {synset: 0}
+        longest = {synset: 0}
+        for hypernym in synset.hypernyms() + synset.instance_hypernyms():
+            hypernym_shortest, hypernym_longest = self.hypernym_maps(hypernym)
+            for ancestor, d in hypernym_shortest.items():
+                if d + 1 < shortest.get(ancestor, sys.maxsize):
+                    shortest[ancestor] = d + 1
+            for ancestor, d in hypernym_longest.items():
+                if d + 1 > longest.get(ancestor, -1):
+                    longest[ancestor] = d + 1
+        return shortest, longest
+
+    def _lemma_names(self, synset):
+        return set([str(x.name()) for x in synset.lemmas()])
+
+    def shortest_path_distance(self, synset_1, synset_2, simulate_root=False):
+        """
+        Synset.shortest_path_distance from the hypernym maps: the shortest
+        path goes through the closest common hypernym, or through a fake
+        root one further than the farthest hypernym of each if
+        simulate_root.
+        """
+        if synset_1 == synset_2:
+            return 0
+        hypernyms_1 = self.hypernym_maps(synset_1)[0]
+        hypernyms_2 = self.hypernym_maps(synset_2)[0]
+        if len(hypernyms_1) > len(hypernyms_2):
+            hypernyms_1, hypernyms_2 = hypernyms_2, hypernyms_1
+        distance = min((d + hypernyms_2[h] for h, d in hypernyms_1.items()
+                        if h in hypernyms_2), default=None)
+        if simulate_root:
+            root = max(hypernyms_1.values()) + max(hypernyms_2.values()) + 2
+            distance = root if distance is None else min(distance, root)
+        return distance
+
+    def path_similarity(self, synset_1, synset_2):
+        """wn.path_similarity from the hypernym maps."""
+        distance = self.shortest_path_distance(
+            synset_1, synset_2,
+            simulate_root=synset_1.pos() != wn.NOUN or synset_2.pos() != wn.NOUN)
+        if distance is None:
+            return None
+        return 1.0 / (distance + 1)
+
     def get_best_synset_pair(self, word_1, word_2):
         """ 
         Choose the pair with highest path similarity among all pairs. 
@@ -61,7 +126,7 @@ class SimilarityBackbone:
             best_pair = None, None
             for synset_1 in synsets_1:
                 for synset_2 in synsets_2:
-                   sim = wn.path_similarity(synset_1, synset_2)
+                   sim = self.path_similarity(synset_1, synset_2)
                    if sim == None:
                         sim = 0
                    if sim > max_sim:
@@ -82,14 +147,14 @@ class SimilarityBackbone:
             # if synset_1 and synset_2 are the same synset return 0
             l_dist = 0.0
         else:
-            wset_1 = set([str(x.name()) for x in synset_1.lemmas()])        
-            wset_2 = set([str(x.name()) for x in synset_2.lemmas()])
+            wset_1 = self.lemma_names(synset_1)
+            wset_2 = self.lemma_names(synset_2)
             if len(wset_1.intersection(wset_2)) > 0:
                 # if synset_1 != synset_2 but there is word overlap, return 1.0
                 l_dist = 1.0
             else:
                 # just compute the shortest path between the two
-                l_dist = synset_1.shortest_path_distance(synset_2)
+                l_dist = self.shortest_path_distance(synset_1, synset_2)
                 if l_dist is None:
                     l_dist = 0.0
         # normalize path length to the range [0,1]
@@ -106,33 +171,31 @@ class SimilarityBackbone:
             return h_dist
         if synset_1 == synset_2:
             # return the depth of one of synset_1 or synset_2
-            h_dist = max([x[1] for x in synset_1.hypernym_distances()])
+            h_dist = max(self.hypernym_maps(synset_1)[1].values())
         else:
-            # find the max depth of least common subsumer
-            hypernyms_1 = {x[0]:x[1] for x in synset_1.hypernym_distances()}
-            hypernyms_2 = {x[0]:x[1] for x in synset_2.hypernym_distances()}
-            lcs_candidates = set(hypernyms_1.keys()).intersection(
-                set(hypernyms_2.keys()))
-            if len(lcs_candidates) > 0:
-                lcs_dists = []
-                for lcs_candidate in lcs_candidates:
-                    lcs_d1 = 0
-                    if lcs_candidate in hypernyms_1:
-                        lcs_d1 = hypernyms_1[lcs_candidate]
-                    lcs_d2 = 0
-                    if lcs_candidate in hypernyms_2:
-                        lcs_d2 = hypernyms_2[lcs_candidate]
-                    lcs_dists.append(max([lcs_d1, lcs_d2]))
+            # find the max depth of least common subsumer, a hypernym
+            # reached by several paths counting with its longest
+            hypernyms_1 = self.hypernym_maps(synset_1)[1]
+            hypernyms_2 = self.hypernym_maps(synset_2)[1]
+            lcs_dists = [max([d, hypernyms_2[h]]) for h, d in hypernyms_1.items()
+                         if h in hypernyms_2]
+            if len(lcs_dists) > 0:
                 h_dist = max(lcs_dists)
             else:
                 h_dist = 0
         return ((math.exp(BETA * h_dist) - math.exp(-BETA * h_dist)) / 
             (math.exp(BETA * h_dist) + math.exp(-BETA * h_dist)))
         
-    def word_similarity(self, word_1, word_2):
+    def _compute_word_similarity(self, word_1, word_2):
         synset_pair = self.get_best_synset_pair(word_1, word_2)
         return (self.length_dist(synset_pair[0], synset_pair[1]) * 
             self.hierarchy_dist(synset_pair[0], synset_pair[1]))
+
+    def word_similarity(self, word_1, word_2):
+        # the similarity is symmetric, so both orders share a cache entry
+        if word_2 < word_1:
+            word_1, word_2 = word_2, word_1
+        return self._word_similarity(word_1, word_2)
     
     ######################### sentence similarity ##########################
     
@@ -171,7 +234,48 @@ class SimilarityBackbone:
         n = 0 if lookup_word not in brown_freqs else brown_freqs[lookup_word]
         return 1.0 - (math.log(n + 1) / math.log(self.N + 1))
         
-    def semantic_vector(self, words, joint_words, info_content_norm):
+    def tokens_of(self, sentence):
+        """Tokenize a sentence, once."""
+        if sentence not in self.tokens:
+            self.tokens[sentence] = nltk.word_tokenize(sentence)
+        return self.tokens[sentence]
+
+    def similarity_matrix(self, joint_words, *sentences):
+        """
+        Computes the similarities of the words in the list joint_words to the
+        words of each sentence they are not in, the only ones the semantic
+        and word order vectors of the sentences need. Entry (i, j) is the
+        similarity of joint_words[i] to joint_words[j].
+        """
+        windex = {x[1]: x[0] for x in enumerate(joint_words)}
+        similarities = np.zeros((len(joint_words), len(joint_words)))
+        for words in sentences:
+            word_set = set(words)
+            for i, joint_word in enumerate(joint_words):
+                if joint_word not in word_set:
+                    for word in word_set:
+                        similarities[i, windex[word]] = self.word_similarity(joint_word, word)
+        return similarities
+
+    def most_similar_words(self, words, joint_words, similarities):
+        """
+        Finds, for each word in the list joint_words, whether it is in the
+        sentence and the index in joint_words of the most similar word of the
+        sentence with its similarity, as most_similar_word does: the words
+        are scanned in the order of set(words) and the first best kept.
+        """
+        windex = {x[1]: x[0] for x in enumerate(joint_words)}
+        columns = np.array([windex[word] for word in set(words)], dtype=np.int64)
+        in_sentence = np.zeros(len(joint_words), dtype=bool)
+        in_sentence[columns] = True
+        if len(columns) == 0:
+            return (in_sentence,
+                    np.zeros(len(joint_words), dtype=np.int64),
+                    np.full(len(joint_words), -1.0))
+        best = columns[np.argmax(similarities[:, columns], axis=1)]
+        return in_sentence, best, similarities[np.arange(len(joint_words)), best]
+
+    def semantic_vector(self, words, joint_words, info_content_norm, similarities=None):
         """
         Computes the semantic vector of a sentence. The sentence is passed in as
         a collection of words. The size of the semantic vector is the same as the
@@ -181,50 +285,37 @@ class SimilarityBackbone:
         further normalized by the word's (and similar word's) information content
         if info_content_norm is True.
         """
-        sent_set = set(words)
-        semvec = np.zeros(len(joint_words))
-        i = 0
-        for joint_word in joint_words:
-            if joint_word in sent_set:
-                # if word in union exists in the sentence, s(i) = 1 (unnormalized)
-                semvec[i] = 1.0
-                if info_content_norm:
-                    semvec[i] = semvec[i] * math.pow(self.info_content(joint_word), 2)
-            else:
-                # find the most similar word in the joint set and set the sim value
-                sim_word, max_sim = self.most_similar_word(joint_word, sent_set)
-                semvec[i] = PHI if max_sim > PHI else 0.0
-                if info_content_norm:
-                    semvec[i] = semvec[i] * self.info_content(joint_word) * self.info_content(sim_word)
-            i = i + 1
+        joint_words = list(joint_words)
+        if similarities is None:
+            similarities = self.similarity_matrix(joint_words, words)
+        in_sentence, best, max_sim = self.most_similar_words(words, joint_words, similarities)
+        # if word in union exists in the sentence, s(i) = 1 (unnormalized),
+        # otherwise the value for the most similar word
+        semvec = np.where(in_sentence, 1.0, np.where(max_sim > PHI, PHI, 0.0))
+        if info_content_norm:
+            info_content = np.array([self.info_content(w) for w in joint_words])
+            semvec = np.where(in_sentence,
+                              semvec * np.square(info_content),
+                              semvec * info_content * info_content[best])
         return semvec                
                 
-    def semantic_similarity(self, sentence_1, sentence_2, info_content_norm):
+    def semantic_similarity(self, sentence_1, sentence_2, info_content_norm, similarities=None):
         """
         Computes the semantic similarity between two sentences as the cosine
         similarity between the semantic vectors computed for each sentence.
         """
-        
-        if sentence_1 in self.tokens:
-            words_1 = self.tokens[sentence_1]
-        else:
-            words_1 = nltk.word_tokenize(sentence_1)
-            self.tokens[sentence_1] = words_1
-
-        if sentence_2 in self.tokens:
-            words_2 = self.tokens[sentence_2]
-        else:
-            words_2 = nltk.word_tokenize(sentence_2)
-            self.tokens[sentence_2] = words_2
-            
-        joint_words = set(words_1).union(set(words_2))
-        vec_1 = self.semantic_vector(words_1, joint_words, info_content_norm)
-        vec_2 = self.semantic_vector(words_2, joint_words, info_content_norm)
+        words_1 = self.tokens_of(sentence_1)
+        words_2 = self.tokens_of(sentence_2)
+        joint_words = list(set(words_1).union(set(words_2)))
+        if similarities is None:
+            similarities = self.similarity_matrix(joint_words, words_1, words_2)
+        vec_1 = self.semantic_vector(words_1, joint_words, info_content_norm, similarities)
+        vec_2 = self.semantic_vector(words_2, joint_words, info_content_norm, similarities)
         return np.dot(vec_1, vec_2.T) / (np.linalg.norm(vec_1) * np.linalg.norm(vec_2))
     
     ######################### word order similarity ##########################
     
-    def word_order_vector(self, words, joint_words, windex):
+    def word_order_vector(self, words, joint_words, windex, similarities=None):
         """
         Computes the word order vector for a sentence. The sentence is passed
         in as a collection of words. The size of the word order vector is the
@@ -235,45 +326,27 @@ class SimilarityBackbone:
         position of the most similar word in the sentence as long as the similarity
         is above the threshold ETA.
         """
-        wovec = np.zeros(len(joint_words))
-        i = 0
-        wordset = set(words)
-        for joint_word in joint_words:
-            if joint_word in wordset:
-                # word in joint_words found in sentence, just populate the index
-                wovec[i] = windex[joint_word]
-            else:
-                # word not in joint_words, find most similar word and populate
-                # word_vector with the thresholded similarity
-                sim_word, max_sim = self.most_similar_word(joint_word, wordset)
-                if max_sim > ETA:
-                    wovec[i] = windex[sim_word]
-                else:
-                    wovec[i] = 0
-            i = i + 1
-        return wovec
+        joint_words = list(joint_words)
+        if similarities is None:
+            similarities = self.similarity_matrix(joint_words, words)
+        in_sentence, best, max_sim = self.most_similar_words(words, joint_words, similarities)
+        positions = np.array([windex[w] for w in joint_words], dtype=float)
+        return np.where(in_sentence, positions,
+                        np.where(max_sim > ETA, positions[best], 0.0))
     
-    def word_order_similarity(self, sentence_1, sentence_2):
+    def word_order_similarity(self, sentence_1, sentence_2, similarities=None):
         """
         Computes the word-order similarity between two sentences as the normalized
         difference of word order between the two sentences.
         """
-        if sentence_1 in self.tokens:
-            words_1 = self.tokens[sentence_1]
-        else:
-            words_1 = nltk.word_tokenize(sentence_1)
-            self.tokens[sentence_1] = words_1
-
-        if sentence_2 in self.tokens:
-            words_2 = self.tokens[sentence_2]
-        else:
-            words_2 = nltk.word_tokenize(sentence_2)
-            self.tokens[sentence_2] = words_2
-        
+        words_1 = self.tokens_of(sentence_1)
+        words_2 = self.tokens_of(sentence_2)
         joint_words = list(set(words_1).union(set(words_2)))
         windex = {x[1]: x[0] for x in enumerate(joint_words)}
-        r1 = self.word_order_vector(words_1, joint_words, windex)
-        r2 = self.word_order_vector(words_2, joint_words, windex)
+        if similarities is None:
+            similarities = self.similarity_matrix(joint_words, words_1, words_2)
+        r1 = self.word_order_vector(words_1, joint_words, windex, similarities)
+        r2 = self.word_order_vector(words_2, joint_words, windex, similarities)
         return 1.0 - (np.linalg.norm(r1 - r2) / np.linalg.norm(r1 + r2))
     
     ######################### overall similarity ##########################
@@ -284,6 +357,12 @@ class SimilarityBackbone:
         parameter is True or False depending on whether information content
         normalization is desired or not.
         """
-        return DELTA * self.semantic_similarity(sentence_1, sentence_2, info_content_norm) + \
-            (1.0 - DELTA) * self.word_order_similarity(sentence_1, sentence_2)
+        # both similarities build the same joint word list from the same
+        # sets, so they can share its similarity matrix
+        words_1 = self.tokens_of(sentence_1)
+        words_2 = self.tokens_of(sentence_2)
+        joint_words = list(set(words_1).union(set(words_2)))
+        similarities = self.similarity_matrix(joint_words, words_1, words_2)
+        return DELTA * self.semantic_similarity(sentence_1, sentence_2, info_content_norm, similarities) + \
+            (1.0 - DELTA) * self.word_order_similarity(sentence_1, sentence_2, similarities)
      
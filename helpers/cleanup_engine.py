@@ -0,0 +1,224 @@
+# * Libraries
+import re
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# * Variables
+# distinct questions per task sent to a worker
+CHUNK_SIZE = 1000
+
+# ** Rules
+# The rules are (pattern, replacement, flags) triples, applied one after
+# another in the order given, exactly like the chains of re.sub they
+# replace: a rule sees the output of the rules before it.
+
+def pad(text):
+    return ' ' + text + ' '
+
+def decap_first_character(regex):
+    "Lower first character after the regex match."
+    match = regex.group(0)
+    # save the previous character in the match
+    # and lower the next
+    return match[:-1] + match[-1].lower()
+
+# decapitalise the words after ., ?, !, ', "
+DECAP = ("(?<=[\.\?\)\!\'\"])[\s]*.", decap_first_character, 0)
+
+# Replace weird chars in text. None of the replacements is itself
+# replaced, so a single str.translate does them all.
+WEIRD_CHARACTERS = {"’": "'",
+                    "`": "'",
+                    "“": '"',
+                    "？": "?",
+                    "…": ".",
+                    "é": "e"}
+
+CONTRACTIONS = [("\'s", " ", 0),
+                ("\bwhats\b", " what is ", re.IGNORECASE),
+                ("\'ve", " have ", re.IGNORECASE),
+                ("can't", "can not", re.IGNORECASE),
+                ("n't", " not ", re.IGNORECASE),
+                ("i'm", "i am", re.IGNORECASE),
+                ("\'re", " are ", re.IGNORECASE),
+                ("\'d", " would ", re.IGNORECASE),
+                ("\'ll", " will ", re.IGNORECASE),
+                ("e\.g\.", " eg ", re.IGNORECASE),
+                ("b\.g\.", " bg ", re.IGNORECASE),
+                ("i\.e\.", " ie ", re.IGNORECASE)]
+
+# replace shortcuts for thousands, better regex provided by @armamut
+THOUSANDS = (r"(\W|^)([0-9]+)[kK](\W|$)", r"\1\g<2>000\3", 0)
+
+TYPOS = [(" e-mail ", " email ", re.IGNORECASE),
+         (r" india ", " India ", 0),
+         (r" switzerland ", " Switzerland ", 0),
+         (r" china ", " China ", 0),
+         (r" chinese ", " Chinese ", 0),
+         (r" imrovement ", " improvement ", re.IGNORECASE),
+         (r" intially ", " initially ", re.IGNORECASE),
+         (r" quora ", " Quora ", re.IGNORECASE),
+         (r" dms ", " direct messages ", re.IGNORECASE),
+         (r" demonitization ", " demonetization ", re.IGNORECASE),
+         (r" actived ", " active ", re.IGNORECASE),
+         (r" kms ", " kilometers ", re.IGNORECASE),
+         (r" cs ", " computer science ", re.IGNORECASE),
+         (r" upvote", " up vote", re.IGNORECASE),
+         (r" iPhone ", " phone ", re.IGNORECASE),
+         (r" \0rs ", " rs ", re.IGNORECASE),
+         (r" calender ", " calendar ", re.IGNORECASE),
+         (r" ios ", " operating system ", re.IGNORECASE),
+         (r" gps ", " GPS ", re.IGNORECASE),
+         (r" gst ", " GST ", re.IGNORECASE),
+         (r" programing ", " programming ", re.IGNORECASE),
+         (r" bestfriend ", " best friend ", re.IGNORECASE),
+         (r" dna ", " DNA ", re.IGNORECASE),
+         (r" III ", " 3 ", 0),
+         (r" banglore ", " Bangalore ", re.IGNORECASE),
+         (r" J K ", " JK ", re.IGNORECASE),
+         (r" J\.K\. ", " JK ", re.IGNORECASE),
+         (r" quikly ", " quickly ", 0),
+         (r" unseccessful ", " unsuccessful ", 0),
+         (r" demoniti[\S]+ ", " demonetization ", re.IGNORECASE),
+         (r" demoneti[\S]+ ", " demonetization ", re.IGNORECASE),
+         (r" addmision ", " admission ", 0),
+         (r" childern", " children ", 0),
+         (r" insititute ", " institute ", 0),
+         (r" connectionn ", " connection ", 0),
+         (r" permantley ", " permanently ", 0),
+         (r" sylabus ", " syllabus ", 0),
+         (r" sequrity ", " security ", 0),
+         # not typo, but GloVe can't find it
+         (r" undergraduation ", " undergraduate ", 0)]
+
+# "ig " is common enough to get a run of its own
+ING = (r"(?=[a-zA-Z])ig ", "ing ", 0)
+
+LATE_TYPOS = [(r" latop", " laptop", 0),
+              (r" programmning ", " programming ", 0),
+              (r" begineer ", " beginner ", 0),
+              (r" qoura ", " Quora ", 0),
+              (r" wtiter ", " writer ", 0),
+              (r" litrate ", " literate ", 0)]
+
+NUMBERS = [("\(s\)", " ", re.IGNORECASE),
+           ("[c-fC-F]\:\/", " disk ", re.IGNORECASE),
+           # remove comma between numbers, i.e. 15,000 -> 15000
+           ('(?<=[0-9])\,(?=[0-9])', "", 0),
+           # float numbers are replaced by an arbitrary number
+           ('[0-9]+\.[0-9]+', " " + str(42) + " ", 0)]
+
+# Handle punctuations and special chars: the symbols are spelt out and
+# the punctuation padded, neither producing the other's characters.
+SYMBOLS = {'$': " dollar ",
+           '%': " percent ",
+           '&': " and "}
+SYMBOLS.update((character, pad(character)) for character in "!#*+,./:;=?@\\^`|~")
+
+NON_ASCII = '[^\x00-\x7F]+'
+
+# quoted and bracketed items
+QUOTED = ['\".*\"', "\'.*\'", "\(.*\)", "\[.*\]", "\{.*\}", "\<.*\>"]
+
+BRACKETS = dict((character, pad(character)) for character in "\"'()<>[]{}")
+
+# clean stray s's and whitespaces
+STRAY_S = (' s ', " ", 0)
+WHITESPACE = ('[\s]+', " ", 0)
+
+# * Steps
+class Substitutions:
+    """A run of re.sub rules, compiled once.
+
+    A string that none of the rules matches is returned as is after a
+    single search of the case-insensitive alternation of the rules, which
+    matches wherever any of them does.
+    """
+    def __init__(self, rules):
+        self.rules = [(re.compile(pattern, flags), replacement)
+                      for pattern, replacement, flags in rules]
+        self.guard = None
+        if len(rules) > 1:
+            self.guard = re.compile('|'.join('(?:' + pattern + ')'
+                                             for pattern, _, _ in rules),
+                                    re.IGNORECASE)
+
+    def __call__(self, string):
+        if self.guard is not None and self.guard.search(string) is None:
+            return string
+        for pattern, replacement in self.rules:
+            string = pattern.sub(replacement, string)
+        return string
+
+class Translation:
+    """Single-character replacements in one pass of str.translate."""
+    def __init__(self, table):
+        self.table = str.maketrans(table)
+
+    def __call__(self, string):
+        return string.translate(self.table)
+
+class QuotedItems:
+    """Replaces the quoted and bracketed items with parser(string, match),
+    string being the text the pattern is matched against."""
+    def __init__(self, parser):
+        self.patterns = [re.compile(pattern) for pattern in QUOTED]
+        self.parser = parser
+
+    def __call__(self, string):
+        for pattern in self.patterns:
+            string = pattern.sub(partial(self.parser, string), string)
+        return string
+
+def primary_steps(non_ascii_token, typos=TYPOS, quoted_parser=None):
+    """The steps of the primary clean-up, quoted items included if a
+    parser is given."""
+    steps = [Substitutions([DECAP]),
+             Translation(WEIRD_CHARACTERS),
+             Substitutions(CONTRACTIONS),
+             Substitutions([THOUSANDS]),
+             Substitutions(typos),
+             Substitutions([ING]),
+             Substitutions(LATE_TYPOS),
+             Substitutions(NUMBERS),
+             Translation(SYMBOLS),
+             Substitutions([(NON_ASCII, pad(non_ascii_token), 0)])]
+    if quoted_parser is not None:
+        steps.append(QuotedItems(quoted_parser))
+    steps += [Translation(BRACKETS),
+              Substitutions([STRAY_S]),
+              Substitutions([WHITESPACE])]
+    return steps
+
+# * Constructor
+class CleanupEngine:
+    """Cleans up questions with a list of steps, each distinct question
+    once."""
+    def __init__(self, steps):
+        self.steps = steps
+
+    def clean(self, string):
+        # Deal with empty questions
+        if type(string) != str or string == '':
+            return ''
+        # the first letter of a question is likely to be capitalised
+        string = string[0].lower() + string[1:]
+        for step in self.steps:
+            string = step(string)
+        return string.strip()
+
+    def clean_column(self, questions, n_workers=1):
+        """Cleans a column of questions, on n_workers processes if more than
+        one."""
+        # a dict rather than pd.factorize, which cuts strings at a NUL
+        uniques = list(OrderedDict.fromkeys(questions))
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                cleaned = list(executor.map(self.clean, uniques,
+                                            chunksize=CHUNK_SIZE))
+        else:
+            cleaned = [self.clean(question) for question in uniques]
+        cleaned = dict(zip(uniques, cleaned))
+        return np.array([cleaned[question] for question in questions], dtype=object)
@@ -0,0 +1,148 @@
+# * Libraries
+import os
+from os.path import exists, splitext
+import hashlib
+import time
+import numpy as np
+
+# * Variables
+BASE_DIR = 'data/'
+EMBEDDING_FILE = BASE_DIR + 'GoogleNews-vectors-negative300.bin'
+
+# words converted between progress messages
+REPORT_EVERY = 500000
+
+# * Helpers
+def _word_keys(words):
+    # 64-bit keys of the words; collisions are resolved by comparing the words
+    return np.array([int.from_bytes(hashlib.md5(w.encode('utf-8')).digest()[:8],
+                                    'little') for w in words],
+                    dtype=np.uint64)
+
+# * Constructor
+class EmbeddingStore:
+    """Word vectors of a word2vec binary file, memory-mapped from .npy files.
+
+    The binary file is converted once into a float32 matrix of vectors and
+    a vocabulary index: the utf-8 bytes of all words with their offsets,
+    and the 64-bit hash keys of the words sorted for binary search. All the
+    arrays are memory-mapped on load, so opening the store is instant and
+    processes reading the same vectors share the pages of the file.
+
+    Lookups behave like KeyedVectors: store[word] returns the vector and
+    raises KeyError for unknown words.
+    """
+    def __init__(self, embedding_file=EMBEDDING_FILE):
+        self.EMBEDDING_FILE = embedding_file
+        self.STORE_DIR = splitext(embedding_file)[0] + '-store/'
+
+        if not exists(self.STORE_DIR + 'keys.npy'):
+            self._convert()
+        self._load()
+
+    def _path(self, name):
+        return self.STORE_DIR + name + '.npy'
+
+    def _convert(self):
+        print("Converting {} to a memory-mapped store...".format(self.EMBEDDING_FILE))
+        start_time = time.time()
+        os.makedirs(self.STORE_DIR, exist_ok=True)
+        with open(self.EMBEDDING_FILE, 'rb') as f:
+            n_words, dim = map(int, f.readline().split())
+            # written in place, so the whole matrix never sits in memory
+            vectors = np.lib.format.open_memmap(self._path('vectors'), mode='w+',
+                                                dtype=np.float32,
+                                                shape=(n_words, dim))
+            row_bytes = dim * np.dtype(np.float32).itemsize
+            words = []
+            for i in range(n_words):
+                word = bytearray()
+                while True:
+                    c = f.read(1)
+                    if c == b'':
+                        raise ValueError("{} ends after {} of its {} words"
+                                         .format(self.EMBEDDING_FILE, i, n_words))
+                    if c == b' ':
+                        break
+                    if c != b'\n':
+                        word += c
+                words.append(word.decode('utf-8'))
+                row = f.read(row_bytes)
+                if len(row) != row_bytes:
+                    raise ValueError("{} ends inside the vector of word {} of {}"
+                                     .format(self.EMBEDDING_FILE, i + 1, n_words))
+                vectors[i] = np.frombuffer(row, dtype='<f4')
+                if (i + 1) % REPORT_EVERY == 0:
+                    print("Converted {} words of {} in {:.0f} s"
+                          .format(i + 1, n_words, time.time() - start_time))
+            vectors.flush()
+            del vectors
+
+        encoded = [w.encode('utf-8') for w in words]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        np.save(self._path('offsets'),
+                np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+        np.save(self._path('words'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+        keys = _word_keys(words)
+        order = np.argsort(keys, kind='stable')
+        np.save(self._path('order'), order.astype(np.int64))
+        # keys.npy marks a complete store, so it is saved last
+        np.save(self._path('keys'), keys[order])
+        print("Saved {} word vectors to {} in {:.0f} s"
+              .format(n_words, self.STORE_DIR, time.time() - start_time))
+
+    def _load(self):
+        self.vectors = np.load(self._path('vectors'), mmap_mode='r')
+        self.offsets = np.load(self._path('offsets'), mmap_mode='r')
+        self.words = np.load(self._path('words'), mmap_mode='r')
+        self.order = np.load(self._path('order'), mmap_mode='r')
+        self.keys = np.load(self._path('keys'), mmap_mode='r')
+
+# * Access
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def word(self, i):
+        """Returns the i-th word of the vocabulary."""
+        return bytes(self.words[self.offsets[i]:self.offsets[i+1]]).decode('utf-8')
+
+    def lookup(self, words):
+        """Returns the rows of the words in the vectors, -1 for unknown words."""
+        words = list(words)
+        rows = np.full(len(words), -1, dtype=np.int64)
+        if not words or not len(self):
+            return rows
+        keys = _word_keys(words)
+        lo = np.searchsorted(self.keys, keys, side='left')
+        hi = np.searchsorted(self.keys, keys, side='right')
+        for k in np.flatnonzero(hi > lo):
+            for j in range(lo[k], hi[k]):
+                if self.word(self.order[j]) == words[k]:
+                    rows[k] = self.order[j]
+                    break
+        return rows
+
+    def __contains__(self, word):
+        return self.lookup([word])[0] >= 0
+
+    def __getitem__(self, word):
+        row = self.lookup([word])[0]
+        if row < 0:
+            raise KeyError("word '{}' not in vocabulary".format(word))
+        return self.vectors[row]
+
+    def embedding_matrix(self, word_index, nb_words):
+        """Builds the (nb_words, dim) embedding matrix of a Keras tokenizer's
+        word_index, leaving zero rows for the words without a vector."""
+        words = [w for w, i in word_index.items() if i < nb_words]
+        rows = self.lookup(words)
+        index = np.array([word_index[w] for w in words], dtype=np.int64)
+        found = rows >= 0
+        embedding_matrix = np.zeros((nb_words, self.dim))
+        embedding_matrix[index[found]] = self.vectors[rows[found]]
+        return embedding_matrix
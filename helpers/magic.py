@@ -8,6 +8,7 @@ import os
 from os.path import exists
 import numpy as np
 import pandas as pd
+from helpers.question_graph import QuestionGraph, is_stale, update_rows
 
 # * Variables
 
@@ -23,68 +24,57 @@ MAGIC_TEST = 'magic/test.csv'
 class Magic:
     def __init__(self,
                  train_data_filename=TRAIN_DATA_FILENAME,                 
-                 test_data_filename=TEST_DATA_FILE):
+                 test_data_filename=TEST_DATA_FILE,
+                 question_graph=None):
         self.TRAIN_DATA_FILENAME = train_data_filename
         self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
         self.TEST_DATA_FILE = test_data_filename
         self.MAGIC_TRAIN = 'magic/' + self.TRAIN_DATA_FILENAME + "-train.csv"
         self.MAGIC_TEST = 'magic/test.csv'
+        self.question_graph = question_graph
+
+    def _question_graph(self):
+        if self.question_graph is None:
+            self.question_graph = QuestionGraph(self.TRAIN_DATA_FILENAME,
+                                                self.TEST_DATA_FILE)
+        return self.question_graph
+
+    def _features(self, split, rows=None):
+        graph = self._question_graph()
+        # the number of pairs each question appears in
+        freqs = graph.degree()
+        q1, q2 = graph.pairs(split)
+        if rows is not None:
+            q1, q2 = q1[rows], q2[rows]
+        return pd.DataFrame({'q1_hash': q1,
+                             'q2_hash': q2,
+                             'q1_freq': np.take(freqs, q1),
+                             'q2_freq': np.take(freqs, q2)},
+                            columns=['q1_hash','q2_hash','q1_freq','q2_freq'])
 
     def _compute_freqs(self):
+        """q1_hash and q2_hash are the question graph ids of the questions of
+        a pair and q1_freq and q2_freq their degrees, all gathered with
+        array indexing."""
         print("Computing magic frequencies...")
-        
-        train_orig =  pd.read_csv(self.TRAIN_DATA_FILE, header=0)
-        test_orig =  pd.read_csv(self.TEST_DATA_FILE, header=0)
-        
-        df1 = train_orig[['question1']].copy()
-        df2 = train_orig[['question2']].copy()
-        df1_test = test_orig[['question1']].copy()
-        df2_test = test_orig[['question2']].copy()
+        train_comb = pd.read_csv(self.TRAIN_DATA_FILE, usecols=['id', 'is_duplicate'])
+        test_comb = pd.read_csv(self.TEST_DATA_FILE, usecols=['test_id'])
+        test_comb.rename(columns={'test_id':'id'}, inplace=True)
+        for split, comb in (('train', train_comb), ('test', test_comb)):
+            features = self._features(split)
+            for column in features.columns:
+                comb[column] = features[column].values
 
-        df2.rename(columns = {'question2':'question1'},inplace=True)
-        df2_test.rename(columns = {'question2':'question1'},inplace=True)
-
-        train_questions = df1.append(df2)
-        train_questions = train_questions.append(df1_test)
-        train_questions = train_questions.append(df2_test)
-        
-        train_questions.drop_duplicates(subset = ['question1'],inplace=True)
-
-        train_questions.reset_index(inplace=True,drop=True)
-        questions_dict = pd.Series(train_questions.index.values,index=train_questions.question1.values).to_dict()
-        train_cp = train_orig.copy()
-        test_cp = test_orig.copy()
-        train_cp.drop(['qid1','qid2'],axis=1,inplace=True)
-
-        test_cp['is_duplicate'] = -1
-        test_cp.rename(columns={'test_id':'id'},inplace=True)
-        comb = pd.concat([train_cp,test_cp])
-
-        comb['q1_hash'] = comb['question1'].map(questions_dict)
-        comb['q2_hash'] = comb['question2'].map(questions_dict)
-
-        q1_vc = comb.q1_hash.value_counts().to_dict()
-        q2_vc = comb.q2_hash.value_counts().to_dict()
-
-        def try_apply_dict(x,dict_to_apply):
-            try:
-                return dict_to_apply[x]
-            except KeyError:
-                return 0
-            #map to frequency space
-
-        comb['q1_freq'] = comb['q1_hash'].map(lambda x: try_apply_dict(x,q1_vc) + try_apply_dict(x,q2_vc))
-        comb['q2_freq'] = comb['q2_hash'].map(lambda x: try_apply_dict(x,q1_vc) + try_apply_dict(x,q2_vc))
-
-        train_comb = comb[comb['is_duplicate'] >= 0][['id','q1_hash','q2_hash','q1_freq','q2_freq','is_duplicate']]
-        test_comb = comb[comb['is_duplicate'] < 0][['id','q1_hash','q2_hash','q1_freq','q2_freq']]
+        train_comb = train_comb[['id','q1_hash','q2_hash','q1_freq','q2_freq','is_duplicate']]
+        test_comb = test_comb[['id','q1_hash','q2_hash','q1_freq','q2_freq']]
 
         print("Done.")
 
         return (train_comb, test_comb)
 
     def spell(self):
-        if exists(self.MAGIC_TRAIN) and exists(self.MAGIC_TEST):
+        if exists(self.MAGIC_TRAIN) and exists(self.MAGIC_TEST) and \
+           not is_stale(self.TRAIN_DATA_FILENAME, self.MAGIC_TRAIN, self.MAGIC_TEST):
             print("Magic features for {} and {} have already been computed.".format(self.TRAIN_DATA_FILENAME,
                                                                                     self.TEST_DATA_FILE))
         else:            
@@ -100,3 +90,12 @@ class Magic:
                               index=False)
             print("Saved magic features for the test set {}".format(self.TEST_DATA_FILE))
             
+
+    def update(self, affected):
+        """Rewrites the rows of the magic features listed in affected, as
+        returned by QuestionGraph.add_pairs. The pair ids are the row numbers."""
+        for split, filename in (('train', self.MAGIC_TRAIN), ('test', self.MAGIC_TEST)):
+            rows = affected[split]
+            features = self._features(split, rows)
+            features.insert(0, 'id', rows)
+            update_rows(filename, rows, features)
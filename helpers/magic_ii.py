@@ -0,0 +1,89 @@
+# Krzysztof Dziedzic's magic feature II, the number of neighbours the
+# questions of a pair share in the question graph.
+# See https://www.kaggle.com/c/quora-question-pairs/discussion/33287
+# and @justfor's https://www.kaggle.com/justfor/edges/code
+
+# * Libraries
+import os
+from os.path import exists
+import numpy as np
+import pandas as pd
+from helpers.question_graph import QuestionGraph, is_stale
+
+# * Variables
+BASE_DIR = 'data/'
+TRAIN_DATA_FILENAME = "vanilla_train"
+TEST_DATA_FILE = BASE_DIR + 'test.csv'
+MAGIC_II_TRAIN = 'magic2/train_ic.csv'
+MAGIC_II_TEST = 'magic2/test_ic.csv'
+
+# the columns the models read from the magic II files
+MAGIC_II_COLUMNS = ['q1_q2_intersect']
+
+# * Constructor
+class MagicII:
+    def __init__(self,
+                 train_data_filename=TRAIN_DATA_FILENAME,
+                 test_data_filename=TEST_DATA_FILE,
+                 question_graph=None,
+                 columns=MAGIC_II_COLUMNS):
+        self.TRAIN_DATA_FILENAME = train_data_filename
+        self.TEST_DATA_FILE = test_data_filename
+        self.MAGIC_II_TRAIN = MAGIC_II_TRAIN
+        self.MAGIC_II_TEST = MAGIC_II_TEST
+        self.question_graph = question_graph
+        self.columns = columns
+
+    def _question_graph(self):
+        if self.question_graph is None:
+            self.question_graph = QuestionGraph(self.TRAIN_DATA_FILENAME,
+                                                self.TEST_DATA_FILE)
+        return self.question_graph
+
+    def build_features(self, split):
+        """Common neighbours, Jaccard and Adamic-Adar indices of the
+        questions of each pair of a split.
+
+        The Adamic-Adar indices weigh each shared neighbour by 1 / log of
+        its degree; both come from one pass of common_neighbours.
+        """
+        graph = self._question_graph()
+        # the sizes of the neighbour sets, self-pairs included
+        degrees = np.diff(graph.neighbour_adjacency().indptr)
+        # a shared neighbour has a degree of at least 2, unless q1 == q2
+        weights = np.zeros(len(degrees))
+        weights[degrees > 1] = 1 / np.log(degrees[degrees > 1])
+
+        q1, q2 = graph.pairs(split)
+        shared = graph.common_neighbours(q1, q2, np.column_stack([np.ones(len(degrees)),
+                                                                  weights]))
+        # the counts are sums of ones, exact in floating point
+        intersect = shared[:, 0].astype(np.int64)
+        adamic_adar = shared[:, 1]
+
+        union = degrees[q1] + degrees[q2] - intersect
+        jaccard = np.divide(intersect, union,
+                            out=np.zeros(len(q1)), where=union > 0)
+        return pd.DataFrame({'q1_q2_intersect': intersect,
+                             'q1_q2_jaccard': jaccard,
+                             'q1_q2_adamic_adar': adamic_adar},
+                            columns=['q1_q2_intersect',
+                                     'q1_q2_jaccard',
+                                     'q1_q2_adamic_adar'])
+
+    def spell(self):
+        if exists(self.MAGIC_II_TRAIN) and exists(self.MAGIC_II_TEST) and \
+           not is_stale(self.TRAIN_DATA_FILENAME, self.MAGIC_II_TRAIN, self.MAGIC_II_TEST):
+            print("Magic II features for {} and {} have already been computed."
+                  .format(self.TRAIN_DATA_FILENAME, self.TEST_DATA_FILE))
+            return
+        os.makedirs(os.path.dirname(self.MAGIC_II_TRAIN), exist_ok=True)
+        for split, filename in (('train', self.MAGIC_II_TRAIN),
+                                ('test', self.MAGIC_II_TEST)):
+            print("Computing magic II features for the {} set...".format(split))
+            features = self.build_features(split)
+            features[self.columns].to_csv(filename,
+                                          sep=',',
+                                          encoding='utf-8',
+                                          index=False)
+            print("Saved magic II features to {}".format(filename))
@@ -0,0 +1,58 @@
+# * Libraries
+import os
+import time
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+
+# * Variables
+# shards per worker, so that a slow shard does not hold up the whole pool
+SHARDS_PER_WORKER = 4
+
+# the feature builder of the current worker process
+_worker_features = None
+
+# * Worker
+def _init_worker(factory):
+    # Stopword sets, stemmers, WordNet and the embedding model are loaded
+    # here, once per worker, rather than once per shard.
+    global _worker_features
+    _worker_features = factory()
+
+def _build_shard(shard, args):
+    return _worker_features.build_features(shard, *args)
+
+# * Constructor
+class ShardedRunner:
+    """Runs the build_features of a feature class on a process pool.
+
+    The pairs are split into contiguous shards, each worker builds its
+    own feature object with factory() on start-up, and the shards' results
+    are concatenated in the order of the pairs, whatever order the workers
+    finish in. The factory must be picklable, e.g. the feature class itself
+    or a functools.partial of it.
+    """
+    def __init__(self, factory, n_workers=None, shards_per_worker=SHARDS_PER_WORKER):
+        self.factory = factory
+        self.n_workers = n_workers or os.cpu_count()
+        self.shards_per_worker = shards_per_worker
+
+    def shards(self, data):
+        n_shards = min(len(data), self.n_workers * self.shards_per_worker)
+        bounds = np.linspace(0, len(data), max(n_shards, 1) + 1).astype(int)
+        return [data.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def build_features(self, data, *args):
+        shards = self.shards(data)
+        print("Building features for {} pairs in {} shards on {} workers..."
+              .format(len(data), len(shards), self.n_workers))
+        start_time = time.time()
+        # the initializer of ProcessPoolExecutor needs Python 3.7
+        with Pool(self.n_workers, initializer=_init_worker,
+                  initargs=(self.factory,)) as pool:
+            # starmap() returns the results in the order of the shards
+            results = pool.starmap(_build_shard,
+                                   [(shard, args) for shard in shards],
+                                   chunksize=1)
+        print("Built the features in {:.0f} s".format(time.time() - start_time))
+        return pd.concat(results).reset_index(drop=True)
@@ -1,7 +1,11 @@
 # * Libraries
 # ** Utilities
 from itertools import chain
+from collections import OrderedDict, Counter
 from random import sample
+import os
+from os.path import exists
+import hashlib
 import time
 # ** Core Processing
 import numpy as np # linear algebra
@@ -14,15 +18,37 @@ import string
 # ** NLP
 # *** SpaCy
 import spacy # nlp
+from spacy.tokens import DocBin
 import en_core_web_sm as en # en library
 nlp = en.load()
+# questions per nlp.pipe batch and processes parsing them
+BATCH_SIZE = 1000
+N_PROCESS = 1
+# no feature reads the dependency parse
+DISABLED_PIPES = ['parser']
+# the parsed questions and entity frequencies are cached here
+SPACY_CACHE_DIR = 'data/preprocessed/spacy/'
+DOC_ATTRS = ['ORTH', 'LEMMA', 'TAG', 'POS', 'ENT_IOB', 'ENT_TYPE']
+
+def doc_cache_name():
+    """Names the cached spaCy objects after what they depend on: the
+    model and its version, the spaCy version, the disabled pipes and the
+    attributes kept in the DocBin."""
+    settings = hashlib.md5(' '.join(DISABLED_PIPES + ['|'] + DOC_ATTRS).encode('utf-8'))
+    return '{}_{}-{}-spacy-{}-{}'.format(nlp.meta['lang'], nlp.meta['name'],
+                                         nlp.meta['version'], spacy.__version__,
+                                         settings.hexdigest()[:8])
 # *** NLTK
 from nltk.corpus import wordnet
+# ** Clean-up
+from helpers.cleanup_engine import CleanupEngine, primary_steps, pad
 # * Constructor
 class Preprocessor:
-    def __init__(self, filename):
+    def __init__(self, filename, spacy_cache_dir=SPACY_CACHE_DIR):
 # ** storing data
         self.filename = filename
+        self.SPACY_CACHE_DIR = None if spacy_cache_dir is None else \
+                               spacy_cache_dir + doc_cache_name() + '/'
         self.training_data = pd.read_csv(self.filename, encoding = 'utf8')
 # ** SpaCy processing variables
         self.SPECIAL_TOKENS = {
@@ -30,6 +56,8 @@ class Preprocessor:
             'non-ascii': 'non_ascii_word',
             'undefined': 'something'
         }
+        self.cleanup_engine = CleanupEngine(primary_steps(self.SPECIAL_TOKENS['non-ascii'],
+                                                          quoted_parser=self._quoted_string_parser))
         self.ENTITY_ENUM = {
             '': '',
             'PERSON': 'person',
@@ -70,6 +98,11 @@ class Preprocessor:
 
                 
         
+        self.DOCS = OrderedDict() # holds the spaCy objects parsed so far by question hash
+        self.DOC_BIN = DocBin(attrs=DOC_ATTRS) # holds the same objects serialized
+        self.HAS_VECTOR = {} # holds has_vector for the words checked so far
+        self._load_doc_cache()
+
         self.QUESTION_DICT = self._build_question_dict()        
                                 
         # create a dictionary with spaCy objects
@@ -123,29 +156,91 @@ class Preprocessor:
                     QUESTION_DICT[series['qid2']] = ''                                    
         return QUESTION_DICT
                 
+    def _hash(self, text):
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    def _cache_path(self, name):
+        return self.SPACY_CACHE_DIR + name
+
+    def _load_doc_cache(self):
+        if self.SPACY_CACHE_DIR is None or not exists(self._cache_path('hashes.npy')):
+            return
+        print('   Loading the cached spaCy objects...')
+        hashes = np.load(self._cache_path('hashes.npy')).tolist()
+        with open(self._cache_path('docs.spacy'), 'rb') as f:
+            self.DOC_BIN = DocBin(attrs=DOC_ATTRS).from_bytes(f.read())
+        self.DOCS = OrderedDict(zip(hashes, self.DOC_BIN.get_docs(nlp.vocab)))
+        print('   Loaded {} spaCy objects.'.format(len(self.DOCS)))
+
+    def _save_doc_cache(self):
+        if self.SPACY_CACHE_DIR is None:
+            return
+        os.makedirs(self.SPACY_CACHE_DIR, exist_ok=True)
+        with open(self._cache_path('docs.spacy'), 'wb') as f:
+            f.write(self.DOC_BIN.to_bytes())
+        # the hashes are in the order the objects were added to the DocBin
+        np.save(self._cache_path('hashes.npy'), np.array(list(self.DOCS), dtype='U32'))
+
+    def _parse(self, texts):
+        """Returns the spaCy objects of the texts, parsing the distinct texts
+        not seen before in batches with nlp.pipe and adding them to the
+        cache."""
+        hashes = [self._hash(text) for text in texts]
+        new = OrderedDict((h, text) for h, text in zip(hashes, texts) if h not in self.DOCS)
+        docs = nlp.pipe(list(new.values()), batch_size=BATCH_SIZE, n_process=N_PROCESS,
+                        disable=DISABLED_PIPES)
+        for i, (h, doc) in enumerate(zip(new, docs)):
+            if i % 100000 == 0:
+                print('   Processed {} out of {} questions with spaCy...'.format(i, len(new)))
+            self.DOCS[h] = doc
+            self.DOC_BIN.add(doc)
+        if new:
+            self._save_doc_cache()
+        return [self.DOCS[h] for h in hashes]
+
+    def _has_vector(self, word):
+        """Whether the vocabulary of the model has a vector for a word,
+        checked once per word without running the pipeline."""
+        try:
+            return self.HAS_VECTOR[word]
+        except KeyError:
+            self.HAS_VECTOR[word] = nlp.vocab.has_vector(word)
+            return self.HAS_VECTOR[word]
+
     def _build_nlp_dict(self):
-        NLP_DICT = {}
-        for i,k in enumerate(self.QUESTION_DICT):
+        keys = list(self.QUESTION_DICT)
+        docs = self._parse([self.QUESTION_DICT[k] for k in keys])
+        return dict(zip(keys, docs))
+
+    def _entity_frequencies(self, NLP_DICT):
+        """Counts the (lowercase word, entity type) pairs of the tokens as
+        three arrays, cached for the set of questions they were counted on."""
+        key = hashlib.md5(''.join(sorted(self._hash(doc.text) for doc in NLP_DICT.values()))
+                          .encode('utf-8')).hexdigest()
+        path = self._cache_path('entity_frequencies-' + key + '.npz') \
+               if self.SPACY_CACHE_DIR is not None else None
+        if path is not None and exists(path):
+            table = np.load(path)
+            return table['words'], table['types'], table['counts']
+
+        counts = Counter()
+        for i, qid in enumerate(NLP_DICT):
             if i % 100000 == 0:
-                print('   Processed {} out of {} questions with spaCy...'.format(i, len(self.QUESTION_DICT)))        
-            NLP_DICT[k] = nlp(self.QUESTION_DICT[k])
-        return NLP_DICT
+                print('   Processed frequencies of {} out of {} spaCy objects...'.format(i, len(NLP_DICT)))
+            counts.update((token.lower_, token.ent_type_) for token in NLP_DICT[qid])
+        pairs = list(counts)
+        words = np.array([word for word, _ in pairs], dtype=str)
+        types = np.array([ent_type for _, ent_type in pairs], dtype=str)
+        frequencies = np.array([counts[pair] for pair in pairs], dtype=np.int64)
+        if path is not None:
+            os.makedirs(self.SPACY_CACHE_DIR, exist_ok=True)
+            np.savez(path, words=words, types=types, counts=frequencies)
+        return words, types, frequencies
+
     def _build_freq_dict(self, NLP_DICT):
         FREQ_DICT = {}
-        for qid in set(NLP_DICT):
-            
-            if qid % 100000 == 0:
-                print('   Processed frequencies of {} out of {} spaCy objects...'.format(qid, len(NLP_DICT)))        
-                
-            for token in set(NLP_DICT[qid]):
-                
-                if token.lower_ not in set(FREQ_DICT):
-                    FREQ_DICT[token.lower_] = {}
-
-                if token.ent_type_ not in set(FREQ_DICT[token.lower_]):
-                    FREQ_DICT[token.lower_][token.ent_type_] = 0
-                    
-                FREQ_DICT[token.lower_][token.ent_type_] += 1
+        for word, ent_type, count in zip(*self._entity_frequencies(NLP_DICT)):
+            FREQ_DICT.setdefault(str(word), {})[str(ent_type)] = int(count)
         return FREQ_DICT
         
 
@@ -156,6 +251,24 @@ class Preprocessor:
         self.training_data.to_csv("data/"+saved_filename, sep=',', encoding='utf-8', index=False)
 # * Primary Cleanup
 
+    def _quoted_string_parser(self, string, pattern):
+        """Keeps a quoted or bracketed item if any of the tokens of string
+        is meaningful."""
+        text = pattern.group(0)
+        parsed = nlp(string[1:-1])
+        is_meaningful = False
+        for token in parsed:
+            # if one of the token is meaningful, we'll take the full string as meaningful
+            if len(token.text)>2 and not token.text.isdigit() and token.has_vector:
+                is_meaningful = True
+            elif token.text in self.SPECIAL_TOKENS.values():
+                is_meaningful = True
+                
+        if is_meaningful:
+            return text
+        else:
+            return pad(text[0]) + self.SPECIAL_TOKENS['quoted'] + pad(text[-1])
+
     def _primary_cleanup(self, string):
         """Cleans up the text.
         
@@ -164,181 +277,15 @@ class Preprocessor:
             and
             https://www.kaggle.com/currie32/the-importance-of-cleaning-text
 
+            The rules live in cleanup_engine.
         """
-        def pad(text):
-            return ' ' + text + ' '
-        
-        # Deal with empty questions
-        
-        if type(string) != str or string=='':
-            return ''
-        
-        # We need to deal with capitalisation to train the model better.
-        # There are several cases when we can predict there would be capital
-        # letters not belonging to proper nouns.
-        
-        # First, the first letter of a question is likely to be
-        # capitalised.
-        
-        string = string[0].lower() + string[1:]
-        
-        # Next, we are going to decapitalise the words after ., ?, !, ', ".
-        
-        def decap_first_character(regex):
-            "Lower first character after the regex match."
-            match = regex.group(0)
-            # save the previous character in the match
-            # and lower the next
-            return match[:-1] + match[-1].lower()
-        
-        string = re.sub("(?<=[\.\?\)\!\'\"])[\s]*.", decap_first_character , string)
-        
-        
-        # We make an assumption that the number of proper nouns at the
-        # beginning of a sentence is small.
-        
-        # Inspired by hubert0527 (see the link above), we fix common oddities.
-        
-        # Replace weird chars in text
-        
-        string = re.sub("’", "'", string)
-        string = re.sub("`", "'", string)
-        string = re.sub("“", '"', string)
-        string = re.sub("？", "?", string)
-        string = re.sub("…", ".", string)
-        string = re.sub("é", "e", string)
-        
-        string = re.sub("\'s", " ", string)
-        string = re.sub("\bwhats\b", " what is ", string, flags=re.IGNORECASE)
-        string = re.sub("\'ve", " have ", string, flags=re.IGNORECASE)
-        string = re.sub("can't", "can not", string, flags=re.IGNORECASE)
-        string = re.sub("n't", " not ", string, flags=re.IGNORECASE)
-        string = re.sub("i'm", "i am", string, flags=re.IGNORECASE)
-        string = re.sub("\'re", " are ", string, flags=re.IGNORECASE)
-        string = re.sub("\'d", " would ", string, flags=re.IGNORECASE)
-        string = re.sub("\'ll", " will ", string, flags=re.IGNORECASE)
-        string = re.sub("e\.g\.", " eg ", string, flags=re.IGNORECASE)
-        string = re.sub("b\.g\.", " bg ", string, flags=re.IGNORECASE)
-        string = re.sub("i\.e\.", " ie ", string, flags=re.IGNORECASE)
-        
-        # replace shortcuts for thousands
-        string = re.sub(r"(\W|^)([0-9]+)[kK](\W|$)", r"\1\g<2>000\3", string) # better regex provided by @armamut
-        
-        string = re.sub(" e-mail ", " email ", string, flags=re.IGNORECASE)
-        string = re.sub(r" india ", " India ", string)
-        string = re.sub(r" switzerland ", " Switzerland ", string)
-        string = re.sub(r" china ", " China ", string)
-        string = re.sub(r" chinese ", " Chinese ", string) 
-        string = re.sub(r" imrovement ", " improvement ", string, flags=re.IGNORECASE)
-        string = re.sub(r" intially ", " initially ", string, flags=re.IGNORECASE)
-        string = re.sub(r" quora ", " Quora ", string, flags=re.IGNORECASE)
-        string = re.sub(r" dms ", " direct messages ", string, flags=re.IGNORECASE)  
-        string = re.sub(r" demonitization ", " demonetization ", string, flags=re.IGNORECASE) 
-        string = re.sub(r" actived ", " active ", string, flags=re.IGNORECASE)
-        string = re.sub(r" kms ", " kilometers ", string, flags=re.IGNORECASE)
-        string = re.sub(r" cs ", " computer science ", string, flags=re.IGNORECASE) 
-        string = re.sub(r" upvote", " up vote", string, flags=re.IGNORECASE)
-        string = re.sub(r" iPhone ", " phone ", string, flags=re.IGNORECASE)
-        string = re.sub(r" \0rs ", " rs ", string, flags=re.IGNORECASE)
-        string = re.sub(r" calender ", " calendar ", string, flags=re.IGNORECASE)
-        string = re.sub(r" ios ", " operating system ", string, flags=re.IGNORECASE)
-        string = re.sub(r" gps ", " GPS ", string, flags=re.IGNORECASE)
-        string = re.sub(r" gst ", " GST ", string, flags=re.IGNORECASE)
-        string = re.sub(r" programing ", " programming ", string, flags=re.IGNORECASE)
-        string = re.sub(r" bestfriend ", " best friend ", string, flags=re.IGNORECASE)
-        string = re.sub(r" dna ", " DNA ", string, flags=re.IGNORECASE)
-        string = re.sub(r" III ", " 3 ", string)
-        string = re.sub(r" banglore ", " Bangalore ", string, flags=re.IGNORECASE)
-        string = re.sub(r" J K ", " JK ", string, flags=re.IGNORECASE)
-        string = re.sub(r" J\.K\. ", " JK ", string, flags=re.IGNORECASE)
-        string = re.sub(r" quikly ", " quickly ", string)
-        string = re.sub(r" unseccessful ", " unsuccessful ", string)
-        string = re.sub(r" demoniti[\S]+ ", " demonetization ", string, flags=re.IGNORECASE)
-        string = re.sub(r" demoneti[\S]+ ", " demonetization ", string, flags=re.IGNORECASE)  
-        string = re.sub(r" addmision ", " admission ", string)
-        string = re.sub(r" childern", " children ", string)
-        string = re.sub(r" insititute ", " institute ", string)
-        string = re.sub(r" connectionn ", " connection ", string)
-        string = re.sub(r" permantley ", " permanently ", string)
-        string = re.sub(r" sylabus ", " syllabus ", string)
-        string = re.sub(r" sequrity ", " security ", string)
-        string = re.sub(r" undergraduation ", " undergraduate ", string) # not typo, but GloVe can't find it
-        string = re.sub(r"(?=[a-zA-Z])ig ", "ing ", string)
-        string = re.sub(r" latop", " laptop", string)
-        string = re.sub(r" programmning ", " programming ", string)  
-        string = re.sub(r" begineer ", " beginner ", string)  
-        string = re.sub(r" qoura ", " Quora ", string)
-        string = re.sub(r" wtiter ", " writer ", string)  
-        string = re.sub(r" litrate ", " literate ", string)  
-        
-        
-        string = re.sub("\(s\)", " ", string, flags=re.IGNORECASE)
-        string = re.sub("[c-fC-F]\:\/", " disk ", string, flags=re.IGNORECASE)
-        
-        # Next, we need to deal with numbers.
-        
-        # First, we remove comma between numbers, i.e. 15,000 -> 15000
-        string = re.sub('(?<=[0-9])\,(?=[0-9])', "", string)
-        
-        # Secondly, float numbers are fixed -- by replacing them with an
-        # arbitrary number.
-        arbitrary_integer = 42
-        string = re.sub('[0-9]+\.[0-9]+', " " + str(arbitrary_integer) + " ", string)
-        
-        # Handle punctuations and special chars
-        
-        string = re.sub('\$', " dollar ", string)
-        string = re.sub('\%', " percent ", string)
-        string = re.sub('\&', " and ", string)
-        
-        def pad_regex(regex):
-            match = regex.group(0)
-            return pad(match)
-        
-        string = re.sub('[\!\?\@\^\+\*\/\,\~\|\`\=\:\;\.\#\\\]', pad_regex, string)
-        
-        # Handling non-ascii characters
-        string = re.sub('[^\x00-\x7F]+', pad(self.SPECIAL_TOKENS['non-ascii']), string)
-        
-        # Handling quoted and bracketed items
-        def quoted_string_parser(pattern):
-            text = pattern.group(0)
-            parsed = nlp(string[1:-1])
-            is_meaningful = False
-            for token in parsed:
-                # if one of the token is meaningful, we'll take the full string as meaningful
-                if len(token.text)>2 and not token.text.isdigit() and token.has_vector:
-                    is_meaningful = True
-                elif token.text in self.SPECIAL_TOKENS.values():
-                    is_meaningful = True
-                    
-            if is_meaningful:
-                return text
-            else:
-                return pad(text[0]) + self.SPECIAL_TOKENS['quoted'] + pad(text[-1])
-                        
-        string = re.sub('\".*\"', quoted_string_parser, string)
-        string = re.sub("\'.*\'", quoted_string_parser, string)
-        string = re.sub("\(.*\)", quoted_string_parser, string)
-        string = re.sub("\[.*\]", quoted_string_parser, string)
-        string = re.sub("\{.*\}", quoted_string_parser, string)
-        string = re.sub("\<.*\>", quoted_string_parser, string)
-        
-        string = re.sub('[\(\)\[\]\{\}\<\>\'\"]', pad_regex, string) 
-        
-        # clean stray s's
-        string = re.sub(' s ', " ", string)
-        
-        # clean stray whitespaces
-        
-        string = re.sub('[\s]+', " ", string)
-        string = string.strip()
-        return string
+        return self.cleanup_engine.clean(string)
 
     def rough_cleanup(self):
         print("1. Cleaning up the text...")
-        self.training_data["question1"] = self.training_data["question1"].apply(self._primary_cleanup)
-        self.training_data["question2"] = self.training_data["question2"].apply(self._primary_cleanup)
+        # the quoted items are parsed with spaCy, so a single process
+        for column in ["question1", "question2"]:
+            self.training_data[column] = self.cleanup_engine.clean_column(self.training_data[column])
         print("   Finished the rudimentary clean-up.")
         print("   Saving to the file...")
         self.save_to_file("rudimentary_cleanup_train")
@@ -350,7 +297,7 @@ class Preprocessor:
     def _get_type(self, token):
         
         if type(token) == str:
-            token = nlp(token)[0]
+            token = nlp.make_doc(token)[0]
             
         key = token.lower_
         
@@ -363,7 +310,7 @@ class Preprocessor:
     def _has_secondary_type(self, token):
         
         if type(token) == str:
-            token = nlp(token)[0]
+            token = nlp.make_doc(token)[0]
             
         key = token.lower_
         
@@ -375,7 +322,7 @@ class Preprocessor:
     def _get_secondary_type(self, token):
         
         if type(token)==str:
-            token = nlp(token)[0]
+            token = nlp.make_doc(token)[0]
             
         key = token.lower_
         
@@ -464,7 +411,7 @@ class Preprocessor:
                     previous_ent_type = None
                     
                 # the lemma can be identified
-                elif nlp(token.lemma_)[0].has_vector:
+                elif self._has_vector(token.lemma_):
                     WORD_LIST.append(token.lemma_)
                     result = token.lemma_
                     previous_ent_type = None
@@ -478,12 +425,15 @@ class Preprocessor:
                     if debug: print(token.text, ' : used the secondary ent_type for ', self.ENTITY_ENUM[second_type])
                     
                 # neither glove nor spacy identifies the token
-                elif nlp(token.lower_)[0].has_vector:
+                elif self._has_vector(token.lower_):
                     WORD_LIST.append(token.lower_)
                     result = token.lower_
                     previous_ent_type = None
                     if debug: print(token.text, ' : t', token.lower_)
-                elif token.has_vector:
+                # Checked in the vocabulary rather than on the token, whose
+                # has_vector falls back to the doc tensor, which the cached
+                # spaCy objects do not keep.
+                elif self._has_vector(token.text):
                     WORD_LIST.append(token.text)
                     result = token.text
                     previous_ent_type = None
@@ -509,8 +459,11 @@ class Preprocessor:
 
     def apply_spacy_filter(self):
         print("2. Applying the spaCy filter...")
-        self.training_data["question1"] = self.training_data["question1"].apply(nlp).apply(self._treat_with_spacy)
-        self.training_data["question2"] = self.training_data["question2"].apply(nlp).apply(self._treat_with_spacy)
+        questions1 = self.training_data["question1"].tolist()
+        questions2 = self.training_data["question2"].tolist()
+        docs = self._parse(questions1 + questions2)
+        self.training_data["question1"] = [self._treat_with_spacy(doc) for doc in docs[:len(questions1)]]
+        self.training_data["question2"] = [self._treat_with_spacy(doc) for doc in docs[len(questions1):]]
         print("   Finished.")
         print("   Saving to the file...")
         self.save_to_file("spacy_filtered_train")        
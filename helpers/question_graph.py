@@ -0,0 +1,468 @@
+# * Libraries
+import os
+from os.path import exists, getmtime
+import glob
+import hashlib
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+# * Variables
+BASE_DIR = 'data/'
+TRAIN_DATA_FILENAME = "vanilla_train"
+TEST_DATA_FILE = BASE_DIR + 'test.csv'
+PREPROCESSED = 'preprocessed/'
+
+DAMPING = 0.85
+# L1 change of the pagerank vector at which the iteration stops
+TOLERANCE = 1e-10
+MAX_ITER = 200
+# pairs per block of the neighbour intersections
+BLOCK_SIZE = 100000
+# relative change of a pagerank past which an update re-emits its pairs
+PAGERANK_CHANGE = 0.01
+
+SPLITS = ('train', 'test')
+
+# * Graph Algorithms
+def simple_graph(u, v, n, self_loops=False):
+    """Builds the CSR adjacency of an undirected graph on n nodes from
+    edge endpoint arrays, dropping repeated edges and, unless self_loops,
+    self-loops."""
+    if not self_loops:
+        keep = u != v
+        u, v = u[keep], v[keep]
+    adjacency = sparse.csr_matrix((np.ones(2 * len(u), dtype=np.int8),
+                                   (np.concatenate([u, v]), np.concatenate([v, u]))),
+                                  shape=(n, n))
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1
+    return adjacency
+
+def core_numbers(adjacency):
+    """Core number of every node of a simple undirected graph given as a
+    CSR adjacency, with the bucket algorithm of Batagelj and Zaversnik
+    (2003): nodes are processed in increasing order of their current
+    degree, each removal decrementing its unprocessed neighbours, so the
+    whole decomposition is one pass over the edges."""
+    indptr = adjacency.indptr.tolist()
+    indices = adjacency.indices.tolist()
+    degrees = np.diff(adjacency.indptr)
+    n = len(degrees)
+    # nodes bucketed by degree; bin_start[d] is the first slot of degree d
+    vert = np.argsort(degrees, kind='stable').tolist()
+    bin_start = np.concatenate([[0], np.cumsum(np.bincount(degrees))]).tolist() \
+                if n else [0]
+    pos = [0] * n
+    for i, v in enumerate(vert):
+        pos[v] = i
+    deg = degrees.tolist()
+    for i in range(n):
+        v = vert[i]
+        dv = deg[v]
+        for u in indices[indptr[v]:indptr[v + 1]]:
+            du = deg[u]
+            if du > dv:
+                # move u to the front of its bucket, then into the bucket below
+                pu = pos[u]
+                pw = bin_start[du]
+                w = vert[pw]
+                if u != w:
+                    vert[pu] = w
+                    pos[w] = pu
+                    vert[pw] = u
+                    pos[u] = pw
+                bin_start[du] += 1
+                deg[u] = du - 1
+    return np.array(deg, dtype=np.int64)
+
+def insert_core_edges(adjacency, core, u, v):
+    """Updates the core numbers of a simple graph in place as the edges
+    (u, v) are inserted one by one, and returns the nodes whose core number
+    changed.
+
+    adjacency is the CSR adjacency before the insertions and core may have
+    more nodes than it, the new ones with a core number of 0. Inserting an
+    edge whose lower end has core number k can only raise nodes of core
+    number k connected to that end through nodes of core number k, and only
+    to k + 1. Each insertion uses the traversal algorithm of Sariyuce et al.
+    (2013): the walk only goes through nodes with more than k neighbours of
+    core number k or more, and evicts the nodes that cannot reach k + 1
+    neighbours of the new core as it goes.
+    """
+    indptr, indices = adjacency.indptr, adjacency.indices
+    n_old = adjacency.shape[0]
+    extra = defaultdict(set)
+
+    def neighbours(x):
+        if x < n_old:
+            return indices[indptr[x]:indptr[x + 1]].tolist() + list(extra[x])
+        return list(extra[x])
+
+    def mcd(x):
+        # neighbours that can stay in the core of x
+        return sum(1 for y in neighbours(x) if core[y] >= core[x])
+
+    def pcd(x):
+        # neighbours that can support x in a higher core
+        return sum(1 for y in neighbours(x)
+                   if core[y] > core[x] or (core[y] == core[x] and mcd(y) > core[x]))
+
+    changed = set()
+    for a, b in zip(u.tolist(), v.tolist()):
+        if a == b or b in extra[a] or \
+           (a < n_old and b < n_old and b in indices[indptr[a]:indptr[a + 1]]):
+            continue
+        extra[a].add(b)
+        extra[b].add(a)
+        root = a if core[a] <= core[b] else b
+        k = core[root]
+        # cd counts the candidates' possible neighbours in the (k + 1)-core,
+        # less the evicted ones, which may be counted before their visit
+        cd = defaultdict(int)
+        cd[root] = pcd(root)
+        visited = {root}
+        evicted = set()
+        stack = [root]
+        while stack:
+            x = stack.pop()
+            if cd[x] > k:
+                for y in neighbours(x):
+                    if core[y] == k and y not in visited and mcd(y) > k:
+                        visited.add(y)
+                        cd[y] += pcd(y)
+                        stack.append(y)
+            elif x not in evicted:
+                evictions = [x]
+                while evictions:
+                    w = evictions.pop()
+                    if w in evicted:
+                        continue
+                    evicted.add(w)
+                    for y in neighbours(w):
+                        if core[y] == k:
+                            cd[y] -= 1
+                            if cd[y] == k and y not in evicted:
+                                evictions.append(y)
+        for x in visited - evicted:
+            core[x] = k + 1
+            changed.add(x)
+    return np.array(sorted(changed), dtype=np.int64)
+
+def is_stale(train_data_filename, *filenames):
+    """True if the question graph of a train set was updated after any of
+    the files was written."""
+    pair_files = glob.glob(BASE_DIR + PREPROCESSED + train_data_filename +
+                           '-graph/*_q[12].npy')
+    if not pair_files:
+        return False
+    updated = max(map(getmtime, pair_files))
+    return any(getmtime(f) < updated for f in filenames)
+
+def update_rows(filename, rows, features):
+    """Writes the features of the given rows into a cached CSV, appending
+    the rows past its end."""
+    if not len(rows):
+        return
+    df = pd.read_csv(filename, encoding='utf-8')
+    df = df.reindex(range(max(len(df), rows.max() + 1)))
+    for column in features.columns:
+        df.loc[rows, column] = features[column].values
+        # the appended rows are NaN until filled, which makes ints floats
+        df[column] = df[column].astype(features[column].dtype)
+    df.to_csv(filename, sep=',', encoding='utf-8', index=False)
+    print("Updated {} rows of {}".format(len(rows), filename))
+
+def pagerank(adjacency, damping=DAMPING, tol=TOLERANCE, max_iter=MAX_ITER,
+             start=None):
+    """Computes the pagerank of every node of a symmetric graph.
+
+    adjacency is a sparse matrix whose entries count the edges between
+    two nodes, so repeated pairs weigh more. Every node is assumed to have
+    an edge. Each iteration is one sparse mat-vec,
+
+        pr = (1 - d) / n + d * A (pr / degree),
+
+    and the iteration stops when the L1 change falls below tol. start can
+    warm-start the iteration from a previous vector.
+    """
+    adjacency = sparse.csr_matrix(adjacency)
+    n = adjacency.shape[0]
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    pr = np.full(n, 1 / n) if start is None else np.asarray(start, dtype=np.float64)
+    for iteration in range(max_iter):
+        previous = pr
+        pr = (1 - damping) / n + damping * (adjacency @ (pr / degree))
+        change = np.abs(pr - previous).sum()
+        if change < tol:
+            break
+    print("PageRank stopped after {} iterations with an L1 change of {:.2e}"
+          .format(iteration + 1, change))
+    return pr
+
+# * Constructor
+class QuestionGraph:
+    """The graph of the questions of the train and test sets, with an edge
+    per pair.
+
+    Questions are identified by their text and get dense ids in the order
+    of their first appearance in train question1, train question2, test
+    question1 and test question2. The ids of the pairs are built once and
+    saved as .npy files, as are the MD5 hashes of the questions, and the
+    graph features (degree, core number, pagerank, component size and
+    neighbour intersections) are all computed from them.
+    """
+    def __init__(self,
+                 train_data_filename=TRAIN_DATA_FILENAME,
+                 test_data_filename=TEST_DATA_FILE):
+        self.TRAIN_DATA_FILENAME = train_data_filename
+        self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
+        self.TEST_DATA_FILE = test_data_filename
+        self.GRAPH_DIR = BASE_DIR + PREPROCESSED + \
+                         train_data_filename + '-graph/'
+
+        # containers for the lazily computed features
+        self._adjacency = None
+        self._simple = None
+        self._neighbours = None
+        self._degree = None
+        self._core = None
+        self._pagerank = {}
+
+        if exists(self._path('test_q2')):
+            print("Using the cached question graph for {}..."
+                  .format(self.TRAIN_DATA_FILENAME))
+        else:
+            self._build()
+        self._load()
+
+    def _path(self, name):
+        return self.GRAPH_DIR + name + '.npy'
+
+    def _build(self):
+        print("Building the question graph for {}...".format(self.TRAIN_DATA_FILENAME))
+        os.makedirs(self.GRAPH_DIR, exist_ok=True)
+        # Read as categoricals, the columns hold each distinct question once
+        # and the pairs as integer codes.
+        categories = []
+        column_codes = []
+        sizes = {}
+        for split, filename in (('train', self.TRAIN_DATA_FILE),
+                                ('test', self.TEST_DATA_FILE)):
+            df = pd.read_csv(filename, usecols=['question1', 'question2'],
+                             dtype='category', encoding='utf-8')
+            sizes[split] = len(df)
+            for column in ('question1', 'question2'):
+                offset = sum(map(len, categories))
+                categories.append(df[column].cat.categories.astype(str).values)
+                # the codes are int8 or int16 for few categories
+                codes = df[column].cat.codes.values.astype(np.int64)
+                column_codes.append(np.where(codes < 0, -1, codes + offset))
+            del df
+        # the missing questions, coded -1, pick this empty one appended last
+        categories.append(np.array([""], dtype=object))
+        category_ids, texts = pd.factorize(np.concatenate(categories))
+        # ids numbered in the order of first appearance, as in magic
+        codes, first_seen = pd.factorize(category_ids[np.concatenate(column_codes)])
+        questions = texts[first_seen]
+        np.save(self._path('hashes'),
+                np.array([hashlib.md5(q.encode('utf-8')).hexdigest()
+                          for q in questions], dtype='S32'))
+        start = 0
+        for split in SPLITS:
+            n = sizes[split]
+            np.save(self._path(split + '_q1'), codes[start:start + n].astype(np.int32))
+            np.save(self._path(split + '_q2'), codes[start + n:start + 2*n].astype(np.int32))
+            start += 2*n
+        print("Saved a graph of {} questions and {} pairs to {}."
+              .format(len(questions), start // 2, self.GRAPH_DIR))
+
+    def _load(self):
+        self.hashes = np.load(self._path('hashes'), mmap_mode='r')
+        self.pair_questions = {}
+        for split in SPLITS:
+            self.pair_questions[split] = (np.load(self._path(split + '_q1')),
+                                          np.load(self._path(split + '_q2')))
+
+# * Access
+    def __len__(self):
+        return len(self.hashes)
+
+    def pairs(self, split):
+        """Returns the question ids of (question1, question2) for a split."""
+        return self.pair_questions[split]
+
+    def edges(self):
+        """Returns the question ids of both ends of all the pairs."""
+        return (np.concatenate([self.pair_questions[s][0] for s in SPLITS]),
+                np.concatenate([self.pair_questions[s][1] for s in SPLITS]))
+
+    def adjacency(self):
+        """CSR adjacency counting the pairs between two questions."""
+        if self._adjacency is None:
+            u, v = self.edges()
+            n = len(self)
+            self._adjacency = sparse.csr_matrix(
+                (np.ones(2 * len(u)), (np.concatenate([u, v]), np.concatenate([v, u]))),
+                shape=(n, n))
+        return self._adjacency
+
+    def simple_adjacency(self):
+        """CSR adjacency of the questions without self-loops or repeats."""
+        if self._simple is None:
+            self._simple = simple_graph(*self.edges(), len(self))
+        return self._simple
+
+    def neighbour_adjacency(self):
+        """CSR adjacency of the neighbour sets of the magic features: no
+        repeats, but a question paired with itself is its own neighbour."""
+        if self._neighbours is None:
+            self._neighbours = simple_graph(*self.edges(), len(self), self_loops=True)
+        return self._neighbours
+
+# * Features
+    def degree(self):
+        """Number of pair slots of each question, i.e. the magic frequency."""
+        if self._degree is None:
+            if exists(self._path('degree')):
+                self._degree = np.load(self._path('degree'))
+            else:
+                u, v = self.edges()
+                self._degree = np.bincount(u, minlength=len(self)) + \
+                               np.bincount(v, minlength=len(self))
+                np.save(self._path('degree'), self._degree)
+        return self._degree
+
+    def core_number(self):
+        """Core number of each question in the simple graph."""
+        if self._core is None:
+            if exists(self._path('core_number')):
+                self._core = np.load(self._path('core_number'))
+            else:
+                print("Computing the core numbers...")
+                self._core = core_numbers(self.simple_adjacency())
+                np.save(self._path('core_number'), self._core)
+        return self._core
+
+    def _pagerank_path(self, damping, tol):
+        # the tolerance may hold a '-', so the parameters are split by '_'
+        return self._path('pagerank-{}_{}'.format(damping, tol))
+
+    def pagerank(self, damping=DAMPING, tol=TOLERANCE):
+        """Pagerank of each question, with repeated pairs weighing more.
+        Cached per damping factor and tolerance."""
+        if (damping, tol) not in self._pagerank:
+            path = self._pagerank_path(damping, tol)
+            if exists(path):
+                self._pagerank[damping, tol] = np.load(path)
+            else:
+                print("Computing the pageranks...")
+                self._pagerank[damping, tol] = pagerank(self.adjacency(), damping, tol)
+                np.save(path, self._pagerank[damping, tol])
+        return self._pagerank[damping, tol]
+
+    def component_size(self):
+        """Number of questions in the connected component of each question."""
+        _, labels = connected_components(self.simple_adjacency(), directed=False)
+        return np.bincount(labels)[labels]
+
+    def common_neighbours(self, q1, q2, weights=None):
+        """Number of neighbours shared by the questions of each pair, in
+        the neighbour sets of neighbour_adjacency, for BLOCK_SIZE pairs at
+        a time.
+
+        Given weights of the questions, a vector or a matrix with a column
+        per weighting, the weights of the shared neighbours are summed
+        instead of counted.
+        """
+        adjacency = self.neighbour_adjacency()
+        if weights is None:
+            weights = np.ones(len(self), dtype=np.int64)
+        counts = np.empty((len(q1),) + np.shape(weights)[1:],
+                          dtype=np.result_type(weights, np.int64))
+        for start in range(0, len(q1), BLOCK_SIZE):
+            end = min(start + BLOCK_SIZE, len(q1))
+            shared = adjacency[q1[start:end]].multiply(adjacency[q2[start:end]]).tocsr()
+            counts[start:end] = shared @ weights
+        return counts
+
+# * Incremental Updates
+    def add_pairs(self, question1, question2, split='test'):
+        """Appends new pairs of question texts to a split of the graph and
+        returns the rows of each split whose graph features changed.
+
+        The new questions get the next ids. The degrees are updated with the
+        new edges only, the core numbers by walking the subcores around them,
+        and the cached pageranks are iterated again from their previous
+        values. The rows returned are the new pairs and the pairs of the
+        questions whose degree or core number changed or whose pagerank
+        moved by more than PAGERANK_CHANGE.
+        """
+        texts = pd.Series(question1).fillna("").astype(str).tolist() + \
+                pd.Series(question2).fillna("").astype(str).tolist()
+        hashes = np.array([hashlib.md5(q.encode('utf-8')).hexdigest()
+                           for q in texts], dtype='S32')
+        ids = pd.Index(self.hashes).get_indexer(hashes)
+        n_old = len(self)
+        new = ids < 0
+        new_codes, new_hashes = pd.factorize(hashes[new])
+        ids[new] = n_old + new_codes
+        self.hashes = np.concatenate([self.hashes, new_hashes.astype('S32')])
+        n = len(self)
+        u, v = ids[:len(ids) // 2], ids[len(ids) // 2:]
+        print("Adding {} pairs with {} new questions to the question graph..."
+              .format(len(u), len(new_hashes)))
+
+        changed = np.zeros(n, dtype=bool)
+        changed[u] = changed[v] = True
+
+        # the features are read before the pairs change
+        degree = np.concatenate([self.degree(), np.zeros(n - n_old, dtype=np.int64)])
+        np.add.at(degree, u, 1)
+        np.add.at(degree, v, 1)
+        if exists(self._path('core_number')):
+            core = np.concatenate([self.core_number(),
+                                   np.zeros(n - n_old, dtype=np.int64)])
+            changed[insert_core_edges(self.simple_adjacency(), core, u, v)] = True
+        else:
+            core = None
+        old_pageranks = {}
+        for path in glob.glob(self._path('pagerank-*_*')):
+            damping, tol = path[path.rindex('pagerank-') + 9:-4].split('_')
+            old_pageranks[float(damping), float(tol)] = np.load(path)
+
+        self.pair_questions[split] = tuple(np.concatenate([old, new_ids]).astype(np.int32)
+                                           for old, new_ids
+                                           in zip(self.pair_questions[split], (u, v)))
+        self._adjacency = self._simple = self._neighbours = None
+        self._degree, self._core, self._pagerank = degree, core, {}
+
+        for (damping, tol), previous in old_pageranks.items():
+            print("Updating the pageranks from the previous ones...")
+            start = np.concatenate([previous * n_old / n, np.full(n - n_old, 1 / n)])
+            self._pagerank[damping, tol] = pagerank(self.adjacency(), damping, tol,
+                                                    start=start)
+            moved = np.abs(self._pagerank[damping, tol][:n_old] - previous) > \
+                    PAGERANK_CHANGE * previous
+            changed[:n_old] |= moved
+            np.save(self._pagerank_path(damping, tol), self._pagerank[damping, tol])
+
+        np.save(self._path('degree'), degree)
+        if core is not None:
+            np.save(self._path('core_number'), core)
+        np.save(self._path('hashes'), self.hashes)
+        for suffix, ids in zip(('_q1', '_q2'), self.pair_questions[split]):
+            np.save(self._path(split + suffix), ids)
+
+        affected = self.affected_rows(changed)
+        print("{} questions and {} pairs are affected."
+              .format(changed.sum(), sum(map(len, affected.values()))))
+        return affected
+
+    def affected_rows(self, changed):
+        """Returns the rows of each split with a question flagged in changed."""
+        return {split: np.flatnonzero(changed[self.pair_questions[split][0]] |
+                                      changed[self.pair_questions[split][1]])
+                for split in SPLITS}
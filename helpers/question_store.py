@@ -0,0 +1,251 @@
+# * Libraries
+import os
+from os.path import exists, getsize, getmtime
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+
+# * Variables
+BASE_DIR = 'data/'
+TRAIN_DATA_FILENAME = "vanilla_train"
+TRAIN_DATA_FILE = BASE_DIR + TRAIN_DATA_FILENAME + '.csv'
+TEST_DATA_FILE = BASE_DIR + 'test.csv'
+PREPROCESSED = 'preprocessed/'
+
+# the name of the pair id column in each split
+SPLITS = {'train': 'id', 'test': 'test_id'}
+
+# * Helpers
+def _signature(*filenames):
+    """MD5 of the names, sizes and mtimes of the given files."""
+    return hashlib.md5(''.join('{}:{}:{}\n'.format(f, getsize(f), getmtime(f))
+                               for f in filenames).encode('utf-8')).hexdigest()
+
+# * Constructor
+class QuestionStore:
+    """Tokenized questions of the train and test sets, each stored once.
+
+    Every distinct question text is kept exactly once and keyed by the
+    MD5 hash of the text. Questions are tokenized with str.split() into
+    ids of a shared vocabulary, laid out as a flat id array plus
+    per-question offsets, so that question i spans
+    token_ids[offsets[i]:offsets[i+1]]. The pairs of each split refer to
+    the questions by their position in the store.
+
+    The arrays are saved as .npy files and memory-mapped on load, so the
+    CSV files are parsed and split once for all the feature modules. The
+    store is rebuilt when either CSV file changes in size or mtime.
+    """
+    # stores opened in this process, by CSV files and their signature
+    _opened = {}
+
+    @classmethod
+    def cached(cls,
+               train_data_filename=TRAIN_DATA_FILENAME,
+               test_data_filename=TEST_DATA_FILE):
+        """Returns the store of the given CSV files, opened once per process
+        and shared by every feature module reading them."""
+        key = (train_data_filename, test_data_filename,
+               _signature(BASE_DIR + train_data_filename + '.csv', test_data_filename))
+        if key not in cls._opened:
+            # a store of older versions of the files is rebuilt under it
+            for stale in [k for k in cls._opened if k[:2] == key[:2]]:
+                del cls._opened[stale]
+            cls._opened[key] = cls(train_data_filename, test_data_filename)
+        return cls._opened[key]
+
+    def __init__(self,
+                 train_data_filename=TRAIN_DATA_FILENAME,
+                 test_data_filename=TEST_DATA_FILE):
+        self.TRAIN_DATA_FILENAME = train_data_filename
+        self.TRAIN_DATA_FILE = BASE_DIR + train_data_filename + '.csv'
+        self.TEST_DATA_FILE = test_data_filename
+        self.STORE_DIR = BASE_DIR + PREPROCESSED + \
+                         train_data_filename + '-questions/'
+
+        # containers for decoded questions
+        self._decoded = {}
+        self._lower = None
+
+        self.signature = _signature(self.TRAIN_DATA_FILE, self.TEST_DATA_FILE)
+        if self._cached_signature() == self.signature:
+            print("Using the cached question store for {}..."
+                  .format(self.TRAIN_DATA_FILENAME))
+        else:
+            self._build()
+        self._load()
+
+    def _path(self, name):
+        return self.STORE_DIR + name + '.npy'
+
+    def _cached_signature(self):
+        if not (exists(self.STORE_DIR + 'vocabulary.txt') and
+                exists(self.STORE_DIR + 'signature.txt')):
+            return None
+        with open(self.STORE_DIR + 'signature.txt', encoding='utf-8') as f:
+            return f.read()
+
+    def _build(self):
+        print("Building the question store for {}...".format(self.TRAIN_DATA_FILENAME))
+        os.makedirs(self.STORE_DIR, exist_ok=True)
+        if exists(self.STORE_DIR + 'signature.txt'):
+            os.remove(self.STORE_DIR + 'signature.txt')
+        texts = []
+        ids = {}
+        for split, filename in (('train', self.TRAIN_DATA_FILE),
+                                ('test', self.TEST_DATA_FILE)):
+            df = pd.read_csv(filename, encoding="utf-8")
+            ids[split] = df[SPLITS[split]].values
+            for column in ('question1', 'question2'):
+                texts.append(df[column].fillna("").astype(str).values)
+            del df
+
+        # Questions repeat heavily across pairs, so we hash and tokenize
+        # the distinct texts only.
+        codes, questions = pd.factorize(np.concatenate(texts))
+        print("Found {} unique questions in {} question slots."
+              .format(len(questions), len(codes)))
+        hashes = np.array([hashlib.md5(q.encode('utf-8')).hexdigest()
+                           for q in questions], dtype='S32')
+
+        tokenized = [q.split() for q in questions]
+        lengths = np.fromiter(map(len, tokenized),
+                              dtype=np.int64, count=len(tokenized))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        words = pd.Series(list(itertools.chain.from_iterable(tokenized)),
+                          dtype=object)
+        token_ids, vocabulary = pd.factorize(words)
+
+        np.save(self._path('hashes'), hashes)
+        np.save(self._path('offsets'), offsets)
+        np.save(self._path('token_ids'), token_ids.astype(np.int32))
+
+        start = 0
+        for split in ('train', 'test'):
+            n = len(ids[split])
+            np.save(self._path(split + '_ids'), ids[split])
+            np.save(self._path(split + '_q1'),
+                    codes[start:start + n].astype(np.int32))
+            np.save(self._path(split + '_q2'),
+                    codes[start + n:start + 2*n].astype(np.int32))
+            start += 2*n
+
+        # str.split() never leaves whitespace inside a token,
+        # so a newline is a safe separator.
+        with open(self.STORE_DIR + 'vocabulary.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocabulary))
+        # written last, so an interrupted build is never taken as cached
+        with open(self.STORE_DIR + 'signature.txt', 'w', encoding='utf-8') as f:
+            f.write(self.signature)
+        print("Saved the question store to {}.".format(self.STORE_DIR))
+
+    def _load(self):
+        self.hashes = np.load(self._path('hashes'), mmap_mode='r')
+        self.offsets = np.load(self._path('offsets'), mmap_mode='r')
+        self.token_ids = np.load(self._path('token_ids'), mmap_mode='r')
+        self.pair_ids = {}
+        self.pair_questions = {}
+        for split in ('train', 'test'):
+            self.pair_ids[split] = np.load(self._path(split + '_ids'),
+                                           mmap_mode='r')
+            self.pair_questions[split] = (np.load(self._path(split + '_q1'),
+                                                  mmap_mode='r'),
+                                          np.load(self._path(split + '_q2'),
+                                                  mmap_mode='r'))
+        with open(self.STORE_DIR + 'vocabulary.txt', encoding='utf-8') as f:
+            text = f.read()
+        self.vocabulary = np.array(text.split('\n') if text else [],
+                                   dtype=object)
+
+# * Access
+    def __len__(self):
+        return len(self.hashes)
+
+    def pairs(self, split):
+        """Returns the store positions of (question1, question2) for a split."""
+        return self.pair_questions[split]
+
+    def lookup(self, hashes):
+        """Returns the store positions of questions given their MD5 hex hashes.
+        Unknown hashes get -1."""
+        order = np.argsort(self.hashes)
+        sorted_hashes = self.hashes[order]
+        hashes = np.asarray(hashes, dtype='S32')
+        idx = np.searchsorted(sorted_hashes, hashes)
+        idx = np.minimum(idx, len(sorted_hashes) - 1)
+        found = sorted_hashes[idx] == hashes
+        return np.where(found, order[idx], -1)
+
+    def flat(self, lower=False):
+        """Returns (token_ids, offsets), optionally with lowercased ids."""
+        if lower:
+            lower_ids, _ = self._lowercase()
+            return (lower_ids[self.token_ids], self.offsets)
+        return (np.asarray(self.token_ids), self.offsets)
+
+    def words(self, split=None, lower=False):
+        """Returns the set of words used in a split (or in both)."""
+        token_ids, offsets = self.flat(lower)
+        vocabulary = self._lowercase()[1] if lower else self.vocabulary
+        if split is None:
+            used = np.unique(token_ids)
+        else:
+            q1, q2 = self.pairs(split)
+            questions = np.unique(np.concatenate([q1, q2]))
+            lengths = offsets[questions + 1] - offsets[questions]
+            # positions of all the tokens of the selected questions
+            starts = np.repeat(offsets[questions] - np.cumsum(lengths) + lengths,
+                               lengths)
+            used = np.unique(token_ids[starts + np.arange(lengths.sum())])
+        return set(vocabulary[used])
+
+    def word_counts(self, split, lower=False):
+        """Counts the words over all the question slots of the pairs in a split,
+        i.e. a question appearing in n pairs contributes its words n times."""
+        token_ids, offsets = self.flat(lower)
+        vocabulary = self._lowercase()[1] if lower else self.vocabulary
+        q1, q2 = self.pairs(split)
+        occurrences = np.bincount(q1, minlength=len(self)) + \
+                      np.bincount(q2, minlength=len(self))
+        per_token = np.repeat(occurrences, np.diff(offsets))
+        counts = np.bincount(token_ids, weights=per_token,
+                             minlength=len(vocabulary)).astype(np.int64)
+        nonzero = np.flatnonzero(counts)
+        return dict(zip(vocabulary[nonzero], counts[nonzero]))
+
+    def questions(self, lower=False):
+        """Decodes every stored question into a list of words, once."""
+        if lower not in self._decoded:
+            token_ids, offsets = self.flat(lower)
+            vocabulary = self._lowercase()[1] if lower else self.vocabulary
+            words = vocabulary[token_ids].tolist()
+            self._decoded[lower] = [words[offsets[i]:offsets[i+1]]
+                                    for i in range(len(self))]
+        return self._decoded[lower]
+
+    def frame(self, split, lower=False):
+        """Returns the pairs of a split as a dataframe of word lists.
+
+        Pairs sharing a question share the same list object, so the frame
+        holds each question once regardless of how often it repeats. The
+        q1_index and q2_index columns hold the store positions of the
+        questions, which identify them for per-question memoization.
+        """
+        questions = self.questions(lower)
+        q1, q2 = self.pairs(split)
+        df = pd.DataFrame()
+        df[SPLITS[split]] = np.asarray(self.pair_ids[split])
+        df['question1'] = pd.Series([questions[i] for i in q1], dtype=object)
+        df['question2'] = pd.Series([questions[i] for i in q2], dtype=object)
+        df['q1_index'] = np.asarray(q1)
+        df['q2_index'] = np.asarray(q2)
+        return df
+
+    def _lowercase(self):
+        if self._lower is None:
+            lower_ids, lower_vocabulary = pd.factorize(
+                pd.Series([w.lower() for w in self.vocabulary], dtype=object))
+            self._lower = (lower_ids.astype(np.int32),
+                           np.asarray(lower_vocabulary, dtype=object))
+        return self._lower
@@ -0,0 +1,58 @@
+# * Libraries
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# * Constructor
+class QuestionSketches:
+    """Per-question summaries ("sketches") of the pairs in a dataframe.
+
+    Many pairwise features first summarise each question (stems, character
+    counts, mean vectors) and then compare the two summaries. A question
+    occurs in many pairs, so the sketch function runs once per distinct
+    question here, and combine() only does the cheap pairwise step per row.
+
+    Questions are identified by the q1_index/q2_index columns of frames
+    built by QuestionStore; for other frames they are identified by text.
+    """
+    def __init__(self, data, sketch):
+        if 'q1_index' in data and 'q2_index' in data:
+            positions = np.concatenate([data['q1_index'].values,
+                                        data['q2_index'].values])
+        else:
+            texts = pd.Series([' '.join(q) for q in data['question1']] +
+                              [' '.join(q) for q in data['question2']],
+                              dtype=object)
+            positions, _ = pd.factorize(texts)
+        _, first, codes = np.unique(positions,
+                                    return_index=True,
+                                    return_inverse=True)
+        questions = list(data['question1']) + list(data['question2'])
+
+        start_time = time.time()
+        self.table = [sketch(questions[k]) for k in first]
+        print("Sketched {} unique questions of {} in {:.0f} s"
+              .format(len(self.table), len(questions), time.time() - start_time))
+
+        self.index = data.index
+        self.q1 = codes[:len(data)]
+        self.q2 = codes[len(data):]
+
+    def combine(self, combine):
+        """Applies combine(sketch1, sketch2) to every pair of the dataframe."""
+        table = self.table
+        return pd.Series([combine(table[i], table[j])
+                          for i, j in zip(self.q1, self.q2)],
+                         index=self.index)
+
+    def combine_columns(self, combine, columns):
+        """Applies combine(sketch1, sketch2), which returns one value per
+        column, to every pair in a single pass, writing into preallocated
+        arrays."""
+        table = self.table
+        out = np.empty((len(columns), len(self.q1)))
+        for k, (i, j) in enumerate(zip(self.q1, self.q2)):
+            out[:, k] = combine(table[i], table[j])
+        return pd.DataFrame(OrderedDict(zip(columns, out)),
+                            columns=columns, index=self.index)
@@ -1,9 +1,8 @@
 # * Libraries
 import os
 from os.path import exists
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer 
 import pandas as pd # data processing, CSV file I/O
+from helpers.stem_table import StemTable, map_unique
 
 # * Variables
 BASE_DIR = 'data/'
@@ -11,43 +10,55 @@ TRAIN_DATA_FILENAME = "2017-05-24-1818-shorties_trimmed_train"
 TRAIN_DATA_FILE = BASE_DIR + TRAIN_DATA_FILENAME + '.csv'
 OUTPUT_DATA_FILE = BASE_DIR + "stemmed_clean_train.csv"
 
-STOPWORDS = set(stopwords.words('english'))
-
 # * Constructor
 class Stem:
     def __init__(self,
-                 train_data_filename=TRAIN_DATA_FILE):
+                 train_data_filename=TRAIN_DATA_FILE,
+                 stem_table=None):
         self.TRAIN_DATA_FILE = train_data_filename
         self.TRAINING_DATA = pd.read_csv(self.TRAIN_DATA_FILE,
                                          encoding = 'utf8')
+        # every distinct word is stemmed once
+        self.stem_table = stem_table if stem_table is not None else StemTable()
+
     def _stemmed(self, text):
-        text = text.split()
-        stemmer = SnowballStemmer('english')
-        stemmed_words = [stemmer.stem(word) for word in text]
-        text = " ".join(stemmed_words)
-        return text
+        return " ".join(self.stem_table.stem_words(text.split()))
     
     def _cleaned_stopwords(self, text):
         text = text.split()
-        text = [word for word in text if not word in STOPWORDS]
-        text = " ".join(text)
-        return text
+        stops = self.stem_table.stops
+        return " ".join([word for word in text if not word in stops])
     
     def stem(self, text):
-        text = self._cleaned_stopwords(text)
-        text = self._stemmed(text)
-        return text
+        return " ".join(self.stem_table.stem_words(text.split(), keep_stops=False))
 
-    def stem_questions(self):
+    def _cleaned_and_stemmed(self, text):
+        return (self._cleaned_stopwords(text), self.stem(text))
+
+    def stem_questions(self, stopword_output_file=None):
+        """Removes the stopwords of the questions and stems them, each
+        distinct question once. If stopword_output_file is given, the
+        questions with only the stopwords removed are written there from the
+        same pass."""
         if exists(OUTPUT_DATA_FILE):
             print("The train data set {} have already been stemmed.".format(TRAIN_DATA_FILENAME))
         else:
-            self.TRAINING_DATA["question1"] \
-                = self.TRAINING_DATA["question1"].apply(self.stem)
-            self.TRAINING_DATA["question2"] \
-                = self.TRAINING_DATA["question2"].apply(self.stem)
+            cleaned = self.TRAINING_DATA.copy() if stopword_output_file else None
+            for column in ["question1", "question2"]:
+                if cleaned is None:
+                    self.TRAINING_DATA[column] = map_unique(self.TRAINING_DATA[column],
+                                                            self.stem)
+                else:
+                    results = map_unique(self.TRAINING_DATA[column],
+                                         self._cleaned_and_stemmed)
+                    cleaned[column] = [result[0] for result in results]
+                    self.TRAINING_DATA[column] = [result[1] for result in results]
             self.TRAINING_DATA.to_csv(OUTPUT_DATA_FILE,
                                       sep=',',
                                       encoding='utf-8',
                                       index=False)
-
+            if cleaned is not None:
+                cleaned.to_csv(stopword_output_file,
+                               sep=',',
+                               encoding='utf-8',
+                               index=False)
@@ -0,0 +1,74 @@
+# * Libraries
+import numpy as np
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer
+
+# * Utilities
+def map_unique(questions, function):
+    """Applies function once to each distinct question and returns the
+    results in the order of the questions."""
+    results = dict((question, function(question)) for question in set(questions))
+    return [results[question] for question in questions]
+
+# * Constructor
+class StemTable:
+    """Vocabulary-level stems and stopword flags.
+
+    Every distinct word gets an integer id and is stemmed once, when it is
+    first seen. word_stems maps word ids to stem ids and is_stop flags the
+    stopwords, so features can work on integer stem sequences instead of
+    calling the stemmer on every word of every pair. Equal stems get equal
+    ids; stem_vocabulary holds the stem of each id.
+    """
+    def __init__(self, language='english'):
+        self.stemmer = SnowballStemmer(language)
+        self.stops = set(stopwords.words(language))
+
+        self.word_ids = {}
+        self.stem_ids = {}
+        self.stem_vocabulary = []
+        self.word_stems = np.zeros(0, dtype=np.int32)
+        self.is_stop = np.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def add(self, words):
+        """Stems the words that are not in the table yet."""
+        new_words = [w for w in dict.fromkeys(words) if w not in self.word_ids]
+        if not new_words:
+            return
+        stems = np.empty(len(new_words), dtype=np.int32)
+        for i, word in enumerate(new_words):
+            self.word_ids[word] = len(self.word_ids)
+            stem = self.stemmer.stem(word)
+            if stem not in self.stem_ids:
+                self.stem_ids[stem] = len(self.stem_vocabulary)
+                self.stem_vocabulary.append(stem)
+            stems[i] = self.stem_ids[stem]
+        self.word_stems = np.concatenate([self.word_stems, stems])
+        self.is_stop = np.concatenate([self.is_stop,
+                                       [w in self.stops for w in new_words]])
+
+    def ids(self, words):
+        """Returns the word ids of a list of words."""
+        word_ids = self.word_ids
+        try:
+            return np.array([word_ids[w] for w in words], dtype=np.int64)
+        except KeyError:
+            self.add(words)
+            return np.array([word_ids[w] for w in words], dtype=np.int64)
+
+    def stems(self, words, keep_stops=True):
+        """Returns the stem ids of a list of words, in order, optionally
+        without the stopwords."""
+        ids = self.ids(words)
+        if not keep_stops:
+            ids = ids[~self.is_stop[ids]]
+        return self.word_stems[ids]
+
+    def stem_words(self, words, keep_stops=True):
+        """Returns the stems of a list of words as strings, optionally
+        without the stopwords."""
+        vocabulary = self.stem_vocabulary
+        return [vocabulary[stem] for stem in self.stems(words, keep_stops)]
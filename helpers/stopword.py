@@ -3,6 +3,7 @@ import os
 from os.path import exists
 from nltk.corpus import stopwords
 import pandas as pd # data processing, CSV file I/O
+from helpers.stem_table import map_unique
 
 # * Variables
 BASE_DIR = 'data/'
@@ -31,10 +32,10 @@ class StopwordTrim:
         if exists(OUTPUT_DATA_FILE):
             print("The train data set {} have already been cleaned.".format(TRAIN_DATA_FILENAME))
         else:
-            self.TRAINING_DATA["question1"] \
-                = self.TRAINING_DATA["question1"].apply(self._cleaned_stopwords)
-            self.TRAINING_DATA["question2"] \
-                = self.TRAINING_DATA["question2"].apply(self._cleaned_stopwords)
+            # each distinct question is cleaned once
+            for column in ["question1", "question2"]:
+                self.TRAINING_DATA[column] = map_unique(self.TRAINING_DATA[column],
+                                                        self._cleaned_stopwords)
             self.TRAINING_DATA.to_csv(OUTPUT_DATA_FILE,
                                       sep=',',
                                       encoding='utf-8',
@@ -64,6 +64,8 @@ import collections
 import doctest
 import pprint
 
+import numpy as np
+
 
 # Default cost functions.
 
@@ -83,6 +85,96 @@ def SUBSTITUTION(A, B, cost=1):
 Trace = collections.namedtuple("Trace", ["cost", "ops"])
 
 
+# Cost-only fast paths.
+
+
+def levenshtein(A, B):
+    """
+    Unit-cost Levenshtein distance between two sequences of hashable items
+    (strings, lists of tokens), computed with the bit-parallel algorithm of
+    Myers (1999) in the formulation of Hyyro (2001). Each column of the
+    dynamic programming table is packed into the bits of an integer, so
+    the cost is O(len(A)) big-integer operations and no table is built.
+
+    >>> levenshtein("sitting", "kitten")
+    3
+    >>> levenshtein("banana", "angioplastical")
+    11
+    >>> levenshtein("the big dog".split(), "big dog".split())
+    1
+    >>> levenshtein("", "abc")
+    3
+    """
+    if len(A) < len(B):
+        A, B = B, A
+    m = len(B)
+    if m == 0:
+        return len(A)
+    # bit i of peq[c] is set when B[i] == c
+    peq = {}
+    for i, c in enumerate(B):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv = mask
+    mv = 0
+    score = m
+    for c in A:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
+
+
+def wagner_fischer_cost(A, B, insertion=INSERTION, deletion=DELETION,
+                        substitution=SUBSTITUTION):
+    """
+    Cost of the optimal alignment of A and B under arbitrary edit costs,
+    keeping two rows of the dynamic programming table as NumPy arrays.
+    Within a row, the chain of insertions is resolved with a running
+    minimum, so each row is a handful of vectorized operations. With
+    non-integer costs, the result may differ from WagnerFischer in the
+    last bits.
+
+    >>> wagner_fischer_cost("sitting", "kitten")
+    3
+    >>> wagner_fischer_cost("god", "gawd", substitution=lambda A, B: 3)
+    3
+    >>> wagner_fischer_cost("ab", "b", deletion=lambda A: 0.5)
+    0.5
+    """
+    ins = np.array([insertion(b) for b in B])
+    dels = np.array([deletion(a) for a in A])
+    if not len(B):
+        return dels.sum().item() if len(A) else 0
+    # cumulative insertion costs along the row
+    ins_cost = np.concatenate([[0], np.cumsum(ins)])
+    row = ins_cost
+    for a, del_cost in zip(A, dels):
+        sub = np.array([0 if a == b else substitution(a, b) for b in B])
+        candidates = np.empty(len(row), dtype=np.result_type(row, sub, del_cost))
+        candidates[0] = row[0] + del_cost
+        candidates[1:] = np.minimum(row[1:] + del_cost, row[:-1] + sub)
+        if np.isfinite(ins_cost).all():
+            # cur[j] = min over k <= j of candidates[k] + insertions k+1..j
+            row = ins_cost + np.minimum.accumulate(candidates - ins_cost)
+        else:
+            row = candidates
+            for j in range(1, len(row)):
+                row[j] = min(row[j], row[j - 1] + ins[j - 1])
+    return row[-1].item()
+
+
 class WagnerFischer(object):
 
     """
@@ -145,9 +237,24 @@ class WagnerFischer(object):
                  substitution=SUBSTITUTION):
         # Stores cost functions in a dictionary for programmatic access.
         self.costs = {"I": insertion, "D": deletion, "S": substitution}
-        # Initializes table.
+        self.A = A
+        self.B = B
         self.asz = len(A)
         self.bsz = len(B)
+        # The table is only needed for alignments, so with the default
+        # costs it is filled in on first access and the cost comes from
+        # the bit-parallel fast path.
+        self._table = None
+        if (insertion is INSERTION and deletion is DELETION and
+                substitution is SUBSTITUTION):
+            self.cost = levenshtein(A, B)
+        else:
+            self._fill()
+
+    def _fill(self):
+        A = self.A
+        B = self.B
+        # Initializes table.
         self._table = [[None for _ in range(self.bsz + 1)] for
                        _ in range(self.asz + 1)]
         # From now on, all indexing done using self.__getitem__.
@@ -185,9 +292,13 @@ class WagnerFischer(object):
         self.cost = self[-1][-1].cost
 
     def __repr__(self):
+        if self._table is None:
+            self._fill()
         return self.pprinter.pformat(self._table)
 
     def __iter__(self):
+        if self._table is None:
+            self._fill()
         for row in self._table:
             yield row
 
@@ -196,6 +307,8 @@ class WagnerFischer(object):
         Returns the i-th row of the table, which is a list and so
         can be indexed. Therefore, e.g.,  self[2][3] == self._table[2][3]
         """
+        if self._table is None:
+            self._fill()
         return self._table[i]
 
     # Stuff for generating alignments.
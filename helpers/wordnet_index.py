@@ -0,0 +1,278 @@
+# * Libraries
+import os
+from os.path import exists
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from scipy import sparse
+from nltk.corpus import wordnet as wn
+
+# * Variables
+# the ragged arrays of the index: for each word, the ids of its synsets,
+# of the names of their hypernyms and of the names of their lemmas
+KINDS = ('synsets', 'hypernyms', 'lemmas')
+
+# ancestor maps and synset pairs whose path similarities are kept
+SYNSET_CACHE_SIZE = 2**16
+PAIR_CACHE_SIZE = 2**20
+# entries of the synsets x synsets x ancestors blocks of path_similarities
+ANCESTOR_BLOCK_SIZE = 2**20
+
+# * Helpers
+def _head(name):
+    # 'dog.n.01' -> 'dog', the way the features have always named them
+    return name.split('.')[0]
+
+def _unique(ids):
+    return list(OrderedDict.fromkeys(ids))
+
+def _vocabulary_hash(vocabulary):
+    # words never contain a newline, see QuestionStore
+    return hashlib.md5('\n'.join(vocabulary).encode('utf-8')).hexdigest()
+
+# * Constructor
+class WordNetIndex:
+    """WordNet synsets, hypernyms and lemmas of a vocabulary as integers.
+
+    Word i of the vocabulary gets the ids of its synsets, of the names of
+    their hypernyms and of the names of their lemmas, stored as flat id
+    arrays plus per-word offsets, so that the synsets of word i are
+    synsets[synsets_offsets[i]:synsets_offsets[i+1]]. Synset ids index
+    synset_names and the hypernym and lemma ids index names.
+
+    Each synset also gets its ancestors in the hypernym hierarchy with
+    their distances, so the path similarity of two synsets comes from
+    their lowest common ancestor without walking WordNet again.
+
+    WordNet is queried once per word and once per synset when the index
+    is built; the arrays are saved as .npy files and memory-mapped on
+    load, so train, test and later runs share them. The index is rebuilt
+    for a vocabulary of another MD5 hash.
+    """
+    def __init__(self, vocabulary, index_dir):
+        self.INDEX_DIR = index_dir
+        self.vocabulary_hash = _vocabulary_hash(vocabulary)
+        if self._cached_hash() == self.vocabulary_hash:
+            print("Using the cached WordNet index in {}...".format(self.INDEX_DIR))
+        else:
+            self._build(vocabulary)
+        self._load()
+        # caches of this index only; on the class they would be shared by
+        # all the indexes and keep them and their memmaps alive
+        self._ancestors = lru_cache(maxsize=SYNSET_CACHE_SIZE)(self._read_ancestors)
+        self._path_similarity = lru_cache(maxsize=PAIR_CACHE_SIZE)(
+            self._compute_path_similarity)
+
+    def _path(self, name):
+        return self.INDEX_DIR + name + '.npy'
+
+    def _cached_hash(self):
+        if not exists(self.INDEX_DIR + 'vocabulary.md5'):
+            return None
+        with open(self.INDEX_DIR + 'vocabulary.md5', encoding='utf-8') as f:
+            return f.read()
+
+    def _save_ragged(self, name, lists, dtype=np.int32):
+        lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+        np.save(self._path(name),
+                np.fromiter((i for items in lists for i in items),
+                            dtype=dtype, count=lengths.sum()))
+        np.save(self._path(name + '_offsets'),
+                np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+
+    def _build(self, vocabulary):
+        print("Indexing WordNet for {} words...".format(len(vocabulary)))
+        os.makedirs(self.INDEX_DIR, exist_ok=True)
+        if exists(self.INDEX_DIR + 'vocabulary.md5'):
+            os.remove(self.INDEX_DIR + 'vocabulary.md5')
+        synset_ids = {}
+        name_ids = {}
+        # the hypernym and lemma name ids of each synset seen so far
+        synset_names = {}
+        ids = dict((kind, []) for kind in KINDS)
+        for word in vocabulary:
+            synsets = wn.synsets(word)
+            for synset in synsets:
+                if synset.name() not in synset_ids:
+                    synset_ids[synset.name()] = len(synset_ids)
+                    hypernyms = [name_ids.setdefault(_head(h.name()), len(name_ids))
+                                 for h in synset.hypernyms()]
+                    lemmas = [name_ids.setdefault(_head(l.name()), len(name_ids))
+                              for l in synset.lemmas()]
+                    synset_names[synset.name()] = (hypernyms, lemmas)
+            ids['synsets'].append([synset_ids[s.name()] for s in synsets])
+            ids['hypernyms'].append(_unique(h for s in synsets
+                                            for h in synset_names[s.name()][0]))
+            ids['lemmas'].append(_unique(l for s in synsets
+                                         for l in synset_names[s.name()][1]))
+        for kind in KINDS:
+            self._save_ragged(kind, ids[kind])
+
+        # The ancestors of each synset, itself included, with the lengths
+        # of the shortest hypernym paths to them as NLTK finds them: the
+        # distance to an ancestor is one more than the shortest from a
+        # parent. The ancestors get synset ids too.
+        ancestors = {}
+        needs_root = {}
+        def ancestor_distances(synset):
+            i = synset_ids.setdefault(synset.name(), len(synset_ids))
+            if i not in ancestors:
+                distances = OrderedDict([(i, 0)])
+                for parent in synset.hypernyms() + synset.instance_hypernyms():
+                    for ancestor, distance in ancestor_distances(parent).items():
+                        if ancestor not in distances or distance + 1 < distances[ancestor]:
+                            distances[ancestor] = distance + 1
+                ancestors[i] = distances
+                # NLTK joins the taxonomies other than the nouns' with a
+                # simulated root
+                needs_root[i] = synset.pos() != wn.NOUN
+            return ancestors[i]
+        for name in list(synset_ids):
+            ancestor_distances(wn.synset(name))
+        self._save_ragged('ancestors', [list(ancestors[i]) for i in range(len(synset_ids))])
+        np.save(self._path('ancestor_distances'),
+                np.fromiter((d for i in range(len(synset_ids))
+                             for d in ancestors[i].values()),
+                            dtype=np.int32))
+        np.save(self._path('needs_root'),
+                np.array([needs_root[i] for i in range(len(synset_ids))], dtype=bool))
+
+        # WordNet names never contain a newline
+        for filename, names in (('synset_names.txt', synset_ids),
+                                ('names.txt', name_ids)):
+            ordered = sorted(names, key=names.get)
+            with open(self.INDEX_DIR + filename, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(ordered))
+        # written last, so an interrupted build is never taken as cached
+        with open(self.INDEX_DIR + 'vocabulary.md5', 'w', encoding='utf-8') as f:
+            f.write(self.vocabulary_hash)
+        print("Saved the WordNet index to {}.".format(self.INDEX_DIR))
+
+    def _load(self):
+        self.ids = {}
+        self.offsets = {}
+        for kind in KINDS + ('ancestors',):
+            self.ids[kind] = np.load(self._path(kind), mmap_mode='r')
+            self.offsets[kind] = np.load(self._path(kind + '_offsets'), mmap_mode='r')
+        # the number of synsets of each word
+        self.synset_counts = np.diff(self.offsets['synsets'])
+        self.ancestor_distances = np.load(self._path('ancestor_distances'), mmap_mode='r')
+        self.needs_root = np.load(self._path('needs_root'))
+        # the distance of each synset to its farthest ancestor
+        self.depths = np.maximum.reduceat(self.ancestor_distances,
+                                          self.offsets['ancestors'][:-1])
+        for attribute, filename in (('synset_names', 'synset_names.txt'),
+                                    ('names', 'names.txt')):
+            with open(self.INDEX_DIR + filename, encoding='utf-8') as f:
+                text = f.read()
+            setattr(self, attribute, np.array(text.split('\n') if text else [],
+                                              dtype=object))
+
+# * Access
+    def __len__(self):
+        return len(self.synset_counts)
+
+    def _positions(self, kind, words):
+        # positions of all the ids of the words, with their lengths
+        offsets = self.offsets[kind]
+        starts = offsets[words]
+        lengths = offsets[np.asarray(words) + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + \
+                    np.arange(lengths.sum())
+        return positions, lengths
+
+    def lookup(self, kind, words):
+        """Returns the ids of a kind for the given word ids, concatenated."""
+        positions, _ = self._positions(kind, words)
+        return self.ids[kind][positions]
+
+    def incidence(self, kind, token_ids, offsets):
+        """Returns a binary CSR matrix with a row per text and a column per
+        id of a kind, the texts being given as flat word ids and offsets
+        like those of QuestionStore.flat."""
+        token_ids = np.asarray(token_ids)
+        ids = self.lookup(kind, token_ids)
+        lengths = self.offsets[kind][token_ids + 1] - self.offsets[kind][token_ids]
+        texts = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        n_ids = len(self.synset_names) if kind == 'synsets' else len(self.names)
+        matrix = sparse.csr_matrix((np.ones(len(ids), dtype=np.int32),
+                                    (np.repeat(texts, lengths), ids)),
+                                   shape=(len(offsets) - 1, n_ids))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix
+
+    def _read_ancestors(self, synset):
+        start, end = self.offsets['ancestors'][synset:synset + 2]
+        return dict(zip(self.ids['ancestors'][start:end].tolist(),
+                        self.ancestor_distances[start:end].tolist()))
+
+    def _compute_path_similarity(self, synset1, synset2):
+        if synset1 == synset2:
+            return 1.0
+        ancestors1 = self._ancestors(synset1)
+        ancestors2 = self._ancestors(synset2)
+        if len(ancestors1) > len(ancestors2):
+            ancestors1, ancestors2 = ancestors2, ancestors1
+        # the shortest path goes through the lowest common ancestor
+        distance = min((d + ancestors2[a] for a, d in ancestors1.items()
+                        if a in ancestors2), default=None)
+        if self.needs_root[synset1] or self.needs_root[synset2]:
+            root = int(self.depths[synset1] + self.depths[synset2]) + 2
+            distance = root if distance is None else min(distance, root)
+        if distance is None:
+            return None
+        return 1.0 / (distance + 1)
+
+    def path_similarity(self, synset1, synset2):
+        """The path similarity of two synsets given by their ids, as NLTK's
+        Synset.path_similarity computes it; None if they are not
+        connected."""
+        synset1, synset2 = int(synset1), int(synset2)
+        if synset1 > synset2:
+            synset1, synset2 = synset2, synset1
+        return self._path_similarity(synset1, synset2)
+
+    def _ancestor_distances(self, synsets, common):
+        """The distances of the synsets to the common ancestors, a sorted
+        id array, as a dense matrix with inf for the ancestors they lack."""
+        positions, lengths = self._positions('ancestors', synsets)
+        ancestors = self.ids['ancestors'][positions]
+        rows = np.repeat(np.arange(len(synsets)), lengths)
+        columns = np.minimum(np.searchsorted(common, ancestors), len(common) - 1)
+        shared = common[columns] == ancestors
+        distances = np.full((len(synsets), len(common)), np.inf)
+        distances[rows[shared], columns[shared]] = self.ancestor_distances[positions[shared]]
+        return distances
+
+    def path_similarities(self, synsets1, synsets2):
+        """The path similarities of each synset of synsets1 with each of
+        synsets2, as a matrix of the values of path_similarity with 0 for
+        the synsets that are not connected.
+
+        The shortest path between two synsets goes through one of their
+        common ancestors, so only the ancestors the two lists share are
+        laid out, ANCESTOR_BLOCK_SIZE entries at a time.
+        """
+        synsets1 = np.asarray(synsets1, dtype=np.int64)
+        synsets2 = np.asarray(synsets2, dtype=np.int64)
+        common = np.intersect1d(self.lookup('ancestors', synsets1),
+                                self.lookup('ancestors', synsets2))
+        distances = np.full((len(synsets1), len(synsets2)), np.inf)
+        if len(common):
+            distances1 = self._ancestor_distances(synsets1, common)
+            distances2 = self._ancestor_distances(synsets2, common)
+            step = max(ANCESTOR_BLOCK_SIZE // max(distances.size, 1), 1)
+            for start in range(0, len(common), step):
+                end = min(start + step, len(common))
+                np.minimum(distances,
+                           (distances1[:, None, start:end] +
+                            distances2[None, :, start:end]).min(axis=2),
+                           out=distances)
+        # NLTK joins the taxonomies other than the nouns' with a simulated
+        # root, one step above the farthest ancestor of each synset
+        root = self.depths[synsets1][:, None] + self.depths[synsets2][None, :] + 2
+        needs_root = self.needs_root[synsets1][:, None] | self.needs_root[synsets2][None, :]
+        distances = np.where(needs_root, np.minimum(distances, root), distances)
+        return np.where(np.isfinite(distances), 1.0 / (distances + 1), 0.0)
@@ -17,7 +17,6 @@ import numpy as np
 import pandas as pd
 import pickle
 
-from gensim.models import KeyedVectors
 from keras.preprocessing.text import Tokenizer
 from keras.preprocessing.sequence import pad_sequences
 from keras.layers import Merge, Dense, Input
@@ -232,13 +231,10 @@ class He:
             embedding_matrix = np.load(open(WORD_EMBEDDING_MATRIX_FILE, 'rb'))
         else:
             print('Indexing word vectors')
-            word2vec = KeyedVectors.load_word2vec_format(self.EMBEDDING_FILE,
-                                                         binary=True)
-            print('Found %s word vectors of word2vec' % len(word2vec.vocab))
-            embedding_matrix = np.zeros((nb_words, self.EMBEDDING_DIM))
-            for word, i in self.word_index.items():
-                if word in word2vec.vocab:
-                    embedding_matrix[i] = word2vec.word_vec(word)
+            from embedding_store import EmbeddingStore
+            word2vec = EmbeddingStore(self.EMBEDDING_FILE)
+            print('Found %s word vectors of word2vec' % len(word2vec))
+            embedding_matrix = word2vec.embedding_matrix(self.word_index, nb_words)
             print('Null word embeddings: %d' %
                   np.sum(np.sum(embedding_matrix, axis=1) == 0))
             print('Saving the word embeddings.')
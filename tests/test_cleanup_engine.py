@@ -0,0 +1,184 @@
+# The clean-up engine against the chain of re.sub calls it replaced,
+# copied below from helpers/rough_cleanup.py and helpers/preprocess.py as
+# they were before the engine.
+import random
+import re
+
+import numpy as np
+import pytest
+
+from helpers.cleanup_engine import CleanupEngine, primary_steps
+
+NON_ASCII_TOKEN = 'non_ascii_word'
+QUOTED_TOKEN = 'quoted_item'
+
+# * Baseline
+def pad(text):
+    return ' ' + text + ' '
+
+def quoted_string_parser(string, pattern):
+    """A stand-in for the spaCy check of Preprocessor: an item is kept if
+    one of its words is longer than two letters."""
+    text = pattern.group(0)
+    if any(len(word) > 2 and word.isalpha() for word in string[1:-1].split()):
+        return text
+    return pad(text[0]) + QUOTED_TOKEN + pad(text[-1])
+
+def baseline_cleanup(string, quoted_parser=None):
+    if type(string) != str or string=='':
+        return ''
+    string = string[0].lower() + string[1:]
+
+    def decap_first_character(regex):
+        match = regex.group(0)
+        return match[:-1] + match[-1].lower()
+
+    string = re.sub(r"(?<=[\.\?\)\!\'\"])[\s]*.", decap_first_character , string)
+
+    string = re.sub("’", "'", string)
+    string = re.sub("`", "'", string)
+    string = re.sub("“", '"', string)
+    string = re.sub("？", "?", string)
+    string = re.sub("…", ".", string)
+    string = re.sub("é", "e", string)
+
+    string = re.sub("\'s", " ", string)
+    string = re.sub("\bwhats\b", " what is ", string, flags=re.IGNORECASE)
+    string = re.sub("\'ve", " have ", string, flags=re.IGNORECASE)
+    string = re.sub("can't", "can not", string, flags=re.IGNORECASE)
+    string = re.sub("n't", " not ", string, flags=re.IGNORECASE)
+    string = re.sub("i'm", "i am", string, flags=re.IGNORECASE)
+    string = re.sub("\'re", " are ", string, flags=re.IGNORECASE)
+    string = re.sub("\'d", " would ", string, flags=re.IGNORECASE)
+    string = re.sub("\'ll", " will ", string, flags=re.IGNORECASE)
+    string = re.sub(r"e\.g\.", " eg ", string, flags=re.IGNORECASE)
+    string = re.sub(r"b\.g\.", " bg ", string, flags=re.IGNORECASE)
+    string = re.sub(r"i\.e\.", " ie ", string, flags=re.IGNORECASE)
+
+    string = re.sub(r"(\W|^)([0-9]+)[kK](\W|$)", r"\1\g<2>000\3", string)
+
+    string = re.sub(" e-mail ", " email ", string, flags=re.IGNORECASE)
+    string = re.sub(r" india ", " India ", string)
+    string = re.sub(r" switzerland ", " Switzerland ", string)
+    string = re.sub(r" china ", " China ", string)
+    string = re.sub(r" chinese ", " Chinese ", string)
+    string = re.sub(r" imrovement ", " improvement ", string, flags=re.IGNORECASE)
+    string = re.sub(r" intially ", " initially ", string, flags=re.IGNORECASE)
+    string = re.sub(r" quora ", " Quora ", string, flags=re.IGNORECASE)
+    string = re.sub(r" dms ", " direct messages ", string, flags=re.IGNORECASE)
+    string = re.sub(r" demonitization ", " demonetization ", string, flags=re.IGNORECASE)
+    string = re.sub(r" actived ", " active ", string, flags=re.IGNORECASE)
+    string = re.sub(r" kms ", " kilometers ", string, flags=re.IGNORECASE)
+    string = re.sub(r" cs ", " computer science ", string, flags=re.IGNORECASE)
+    string = re.sub(r" upvote", " up vote", string, flags=re.IGNORECASE)
+    string = re.sub(r" iPhone ", " phone ", string, flags=re.IGNORECASE)
+    string = re.sub(r" \0rs ", " rs ", string, flags=re.IGNORECASE)
+    string = re.sub(r" calender ", " calendar ", string, flags=re.IGNORECASE)
+    string = re.sub(r" ios ", " operating system ", string, flags=re.IGNORECASE)
+    string = re.sub(r" gps ", " GPS ", string, flags=re.IGNORECASE)
+    string = re.sub(r" gst ", " GST ", string, flags=re.IGNORECASE)
+    string = re.sub(r" programing ", " programming ", string, flags=re.IGNORECASE)
+    string = re.sub(r" bestfriend ", " best friend ", string, flags=re.IGNORECASE)
+    string = re.sub(r" dna ", " DNA ", string, flags=re.IGNORECASE)
+    string = re.sub(r" III ", " 3 ", string)
+    string = re.sub(r" banglore ", " Bangalore ", string, flags=re.IGNORECASE)
+    string = re.sub(r" J K ", " JK ", string, flags=re.IGNORECASE)
+    string = re.sub(r" J\.K\. ", " JK ", string, flags=re.IGNORECASE)
+    string = re.sub(r" quikly ", " quickly ", string)
+    string = re.sub(r" unseccessful ", " unsuccessful ", string)
+    string = re.sub(r" demoniti[\S]+ ", " demonetization ", string, flags=re.IGNORECASE)
+    string = re.sub(r" demoneti[\S]+ ", " demonetization ", string, flags=re.IGNORECASE)
+    string = re.sub(r" addmision ", " admission ", string)
+    string = re.sub(r" childern", " children ", string)
+    string = re.sub(r" insititute ", " institute ", string)
+    string = re.sub(r" connectionn ", " connection ", string)
+    string = re.sub(r" permantley ", " permanently ", string)
+    string = re.sub(r" sylabus ", " syllabus ", string)
+    string = re.sub(r" sequrity ", " security ", string)
+    string = re.sub(r" undergraduation ", " undergraduate ", string)
+    string = re.sub(r"(?=[a-zA-Z])ig ", "ing ", string)
+    string = re.sub(r" latop", " laptop", string)
+    string = re.sub(r" programmning ", " programming ", string)
+    string = re.sub(r" begineer ", " beginner ", string)
+    string = re.sub(r" qoura ", " Quora ", string)
+    string = re.sub(r" wtiter ", " writer ", string)
+    string = re.sub(r" litrate ", " literate ", string)
+
+    string = re.sub(r"\(s\)", " ", string, flags=re.IGNORECASE)
+    string = re.sub(r"[c-fC-F]\:\/", " disk ", string, flags=re.IGNORECASE)
+    string = re.sub(r'(?<=[0-9])\,(?=[0-9])', "", string)
+    string = re.sub(r'[0-9]+\.[0-9]+', " " + str(42) + " ", string)
+
+    string = re.sub(r'\$', " dollar ", string)
+    string = re.sub(r'\%', " percent ", string)
+    string = re.sub(r'\&', " and ", string)
+
+    def pad_regex(regex):
+        return pad(regex.group(0))
+
+    string = re.sub(r'[\!\?\@\^\+\*\/\,\~\|\`\=\:\;\.\#\\]', pad_regex, string)
+    string = re.sub('[^\x00-\x7F]+', pad(NON_ASCII_TOKEN), string)
+
+    if quoted_parser is not None:
+        def parser(pattern):
+            return quoted_parser(string, pattern)
+        string = re.sub('\".*\"', parser, string)
+        string = re.sub("\'.*\'", parser, string)
+        string = re.sub(r"\(.*\)", parser, string)
+        string = re.sub(r"\[.*\]", parser, string)
+        string = re.sub(r"\{.*\}", parser, string)
+        string = re.sub(r"\<.*\>", parser, string)
+
+    string = re.sub(r'[\(\)\[\]\{\}\<\>\'\"]', pad_regex, string)
+    string = re.sub(' s ', " ", string)
+    string = re.sub(r'[\s]+', " ", string)
+    string = string.strip()
+    return string
+
+# * Sample
+WORDS = """india India china chinese switzerland quora Quora QUORA dms
+demonitization demonitizations actived kms cs upvote upvotes iPhone iphone ios
+gps gst programing bestfriend dna DNA III iii banglore J K J.K. j.k. quikly
+unseccessful addmision childern insititute connectionn permantley sylabus
+sequrity undergraduation big dig ig Ig latop programmning begineer qoura
+wtiter litrate e-mail E-mail whats What's what's I've can't Can't won't isn't
+I'm you're he'd we'll e.g. E.G. b.g. i.e. 10k 5K (s) C:/ d:/ 15,000 3.14 $ %
+& ! ? @ ^ + * / , ~ | ` = : ; . # \\ ( ) [ ] { } < > ' " ’ “ ？ … é café ü
+日本 s S Is How What Why the a of""".split() + \
+    ['', '\t', '\n', '\x00rs', '\x08whats\x08', '"hello world"', '(a b)',
+     '[no]', '{12}', '<tag>', "'quoted words'"]
+
+def sample(n=5000, seed=0):
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(n):
+        separator = rng.choice([' ', ' ', '', '  '])
+        words = [rng.choice(WORDS) for _ in range(rng.randint(0, 20))]
+        questions.append(separator.join(words) + rng.choice(['', '?', ' ?', '.']))
+    return questions + [float('nan'), None, 3, '', 'A',
+                        'Whats up? Hello. "Yes" (s)',
+                        'What is "the (best) way" to [learn] {it}?']
+
+SAMPLE = sample()
+
+# * Tests
+def test_rough_cleanup_matches_baseline():
+    engine = CleanupEngine(primary_steps(NON_ASCII_TOKEN))
+    for question in SAMPLE:
+        assert engine.clean(question) == baseline_cleanup(question), repr(question)
+
+def test_quoted_items_match_baseline():
+    engine = CleanupEngine(primary_steps(NON_ASCII_TOKEN,
+                                         quoted_parser=quoted_string_parser))
+    for question in SAMPLE:
+        assert engine.clean(question) == \
+               baseline_cleanup(question, quoted_string_parser), repr(question)
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_clean_column_matches_baseline(n_workers):
+    engine = CleanupEngine(primary_steps(NON_ASCII_TOKEN))
+    questions = SAMPLE[:2000] * 2
+    expected = np.array([baseline_cleanup(q) for q in questions], dtype=object)
+    cleaned = engine.clean_column(questions, n_workers)
+    assert cleaned.dtype == object
+    assert cleaned.tolist() == expected.tolist()
@@ -0,0 +1,60 @@
+# The columnar engine of CustomFeatures against its row-wise feature
+# methods, on rows with empty questions in every position.
+import functools
+
+import numpy as np
+import pandas as pd
+
+from custom.features import CustomFeatures
+
+STOPS = {'is', 'the', 'a'}
+WEIGHTS = {'what': 0.5, 'cat': 0.2, 'dog': 1.0, 'x': 2.0}
+
+# * Baseline
+def row_features(features, data, stops, weights):
+    methods = [
+        ('word_match', functools.partial(features.word_match_share, stops=stops)),
+        ('tfidf_wm', functools.partial(features.tfidf_word_match_share,
+                                       weights=weights)),
+        ('tfidf_wm_stops', functools.partial(features.tfidf_word_match_share_stops,
+                                             stops=stops, weights=weights)),
+        ('jaccard', features.jaccard),
+        ('wc_diff', features.wc_diff),
+        ('wc_ratio', features.wc_ratio),
+        ('wc_diff_unique', features.wc_diff_unique),
+        ('wc_ratio_unique', features.wc_ratio_unique),
+        ('wc_diff_unq_stop', functools.partial(features.wc_diff_unique_stop,
+                                               stops=stops)),
+        ('wc_ratio_unique_stop', functools.partial(features.wc_ratio_unique_stop,
+                                                   stops=stops)),
+        ('same_start', features.same_start_word),
+        ('char_diff', features.char_diff),
+        ('char_diff_unq_stop', functools.partial(features.char_diff_unique_stop,
+                                                 stops=stops)),
+        ('total_unique_words', features.total_unique_words),
+        ('total_unq_words_stop', functools.partial(features.total_unq_words_stop,
+                                                   stops=stops)),
+        ('char_ratio', features.char_ratio)]
+    rows = [row for _, row in data.iterrows()]
+    return pd.DataFrame(dict((name, [float(method(row)) for row in rows])
+                             for name, method in methods),
+                        columns=[name for name, _ in methods])
+
+def check(data):
+    features = CustomFeatures()
+    X = features.build_features(data, STOPS, WEIGHTS)
+    expected = row_features(features, data, STOPS, WEIGHTS)
+    assert list(X.columns) == list(expected.columns)
+    np.testing.assert_allclose(X.values.astype(np.float64), expected.values)
+
+# * Tests
+def test_columnar_features_match_rows():
+    check(pd.DataFrame({'question1': [['what', 'is', 'a'], [], ['the', 'cat'], ['x']],
+                        'question2': [['what', 'a'], ['dog'], ['cat'], ['x', 'x']]}))
+
+def test_empty_last_questions():
+    check(pd.DataFrame({'question1': [['what', 'is', 'a'], [], ['the', 'cat']],
+                        'question2': [['what', 'a'], ['dog'], []]}))
+    check(pd.DataFrame({'question1': [['what', 'is', 'a'], ['the', 'cat'], []],
+                        'question2': [['what', 'a'], [], ['dog']]}))
+    check(pd.DataFrame({'question1': [[], []], 'question2': [[], []]}))
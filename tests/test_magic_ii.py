@@ -0,0 +1,74 @@
+# The magic II features against the neighbour sets of @justfor's kernel,
+# https://www.kaggle.com/justfor/edges/code, on random pairs with
+# repeated and self pairs.
+import math
+import random
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from helpers.magic_ii import MagicII
+from helpers.question_graph import QuestionGraph
+
+# * Sample
+def random_pairs(rng, n, questions):
+    pairs = []
+    for _ in range(n):
+        q1 = rng.choice(questions)
+        # a few questions are paired with themselves
+        q2 = q1 if rng.random() < 0.05 else rng.choice(questions)
+        pairs.append((q1, q2))
+    return pairs
+
+def write_sample(seed=0):
+    rng = random.Random(seed)
+    questions = ['Question {}?'.format(i) for i in range(400)]
+    train = random_pairs(rng, 1500, questions)
+    test = random_pairs(rng, 1000, questions + ['New question {}?'.format(i)
+                                                for i in range(100)])
+    pd.DataFrame({'id': range(len(train)),
+                  'question1': [q1 for q1, _ in train],
+                  'question2': [q2 for _, q2 in train],
+                  'is_duplicate': 0}).to_csv('data/vanilla_train.csv', index=False)
+    pd.DataFrame({'test_id': range(len(test)),
+                  'question1': [q1 for q1, _ in test],
+                  'question2': [q2 for _, q2 in test]}).to_csv('data/test.csv', index=False)
+    return train, test
+
+# * Baseline
+def kernel_features(train, test):
+    q_dict = defaultdict(set)
+    for q1, q2 in train + test:
+        q_dict[q1].add(q2)
+        q_dict[q2].add(q1)
+    features = {}
+    for split, pairs in (('train', train), ('test', test)):
+        rows = []
+        for q1, q2 in pairs:
+            shared = q_dict[q1] & q_dict[q2]
+            union = len(q_dict[q1] | q_dict[q2])
+            rows.append((len(shared),
+                         len(shared) / union if union else 0,
+                         sum(1 / math.log(len(q_dict[w]))
+                             for w in shared if len(q_dict[w]) > 1)))
+        features[split] = np.array(rows)
+    return features
+
+# * Tests
+def test_magic_ii_matches_kernel(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    train, test = write_sample()
+    expected = kernel_features(train, test)
+    magic = MagicII(question_graph=QuestionGraph())
+    for split in ('train', 'test'):
+        features = magic.build_features(split)
+        assert list(features.columns) == ['q1_q2_intersect',
+                                          'q1_q2_jaccard',
+                                          'q1_q2_adamic_adar']
+        assert np.array_equal(features['q1_q2_intersect'].values,
+                              expected[split][:, 0])
+        np.testing.assert_allclose(features[['q1_q2_jaccard',
+                                             'q1_q2_adamic_adar']].values,
+                                   expected[split][:, 1:])
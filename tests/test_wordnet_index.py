@@ -0,0 +1,127 @@
+# The path similarities of WordNetIndex against NLTK's
+# Synset.path_similarity, on WordNet when its data is installed and on a
+# small random hierarchy otherwise.
+import gc
+import random
+import weakref
+
+import numpy as np
+import pytest
+from nltk.corpus import wordnet
+from nltk.corpus.reader.wordnet import Synset
+
+import helpers.wordnet_index as wordnet_index
+from helpers.wordnet_index import WordNetIndex
+
+WORDS = ['dog', 'cat', 'run', 'walk', 'happy', 'sad', 'bank', 'river',
+         'computer', 'idea', 'quickly', 'be', 'not_a_word']
+
+# * Helpers
+def nltk_similarities(index, synset_of):
+    synsets = [synset_of(name) for name in index.synset_names]
+    return np.array([[a.path_similarity(b) or 0 for b in synsets]
+                     for a in synsets])
+
+def check_index(index, synset_of):
+    ids = np.arange(len(index.synset_names))
+    expected = nltk_similarities(index, synset_of)
+    assert np.array_equal(index.path_similarities(ids, ids), expected)
+    for i, j in zip(ids.tolist(), ids[::-1].tolist()):
+        assert (index.path_similarity(i, j) or 0) == expected[i, j]
+    # the matrix of two lists of another order and with repeats
+    rows, columns = ids[::-1], np.concatenate([ids[::3], ids[:2]])
+    assert np.array_equal(index.path_similarities(rows, columns),
+                          expected[np.ix_(rows, columns)])
+
+# * A random hierarchy
+class FakeSynset(Synset):
+    def __init__(self, name, pos, reader):
+        self._name = name
+        self._pos = pos
+        self._wordnet_corpus_reader = reader
+        self._parents = []
+        self._instance_parents = []
+
+    def name(self):
+        return self._name
+
+    def pos(self):
+        return self._pos
+
+    def _hypernyms(self):
+        return self._parents
+
+    def _instance_hypernyms(self):
+        return self._instance_parents
+
+    def hypernyms(self):
+        return self._parents
+
+    def instance_hypernyms(self):
+        return self._instance_parents
+
+    def lemmas(self):
+        return []
+
+class RandomWordNet:
+    """Nouns under a single root, verbs under several and adjectives
+    without hypernyms, like WordNet."""
+    NOUN = 'n'
+
+    def __init__(self, seed=0):
+        rng = random.Random(seed)
+        self.by_name = {}
+        for pos, n, roots in (('n', 60, 1), ('v', 40, 3), ('a', 10, 10)):
+            layer = []
+            for i in range(n):
+                synset = FakeSynset('s{}.{}.01'.format(len(self.by_name), pos),
+                                    pos, self)
+                if i >= roots:
+                    synset._parents = rng.sample(layer, min(len(layer), rng.choice([1, 2])))
+                    if rng.random() < 0.2:
+                        synset._instance_parents = rng.sample(layer, 1)
+                layer.append(synset)
+                self.by_name[synset.name()] = synset
+        synsets = list(self.by_name.values())
+        self.words = dict(('w{}'.format(i), rng.sample(synsets, rng.randint(0, 4)))
+                          for i in range(40))
+
+    def get_version(self):
+        return '3.0'
+
+    def synsets(self, word):
+        return list(self.words[word])
+
+    def synset(self, name):
+        return self.by_name[name]
+
+# * Tests
+def test_path_similarities_match_wordnet(tmp_path):
+    try:
+        wordnet.ensure_loaded()
+    except LookupError:
+        pytest.skip("the WordNet data is not installed")
+    index = WordNetIndex(WORDS, str(tmp_path) + '/')
+    assert len(index.synset_names) > len(WORDS)
+    check_index(index, wordnet.synset)
+
+@pytest.mark.parametrize('block_size', [wordnet_index.ANCESTOR_BLOCK_SIZE, 7])
+def test_path_similarities_match_nltk(tmp_path, monkeypatch, block_size):
+    fake = RandomWordNet()
+    monkeypatch.setattr(wordnet_index, 'wn', fake)
+    monkeypatch.setattr(wordnet_index, 'ANCESTOR_BLOCK_SIZE', block_size)
+    index = WordNetIndex(sorted(fake.words), str(tmp_path) + '/')
+    check_index(index, fake.synset)
+
+def test_indexes_have_their_own_caches(tmp_path, monkeypatch):
+    fake = RandomWordNet()
+    monkeypatch.setattr(wordnet_index, 'wn', fake)
+    index = WordNetIndex(sorted(fake.words), str(tmp_path) + '/')
+    other = WordNetIndex(sorted(fake.words), str(tmp_path) + '/')
+    index.path_similarity(0, 1)
+    assert index._path_similarity.cache_info().currsize == 1
+    assert other._path_similarity.cache_info().currsize == 0
+    reference = weakref.ref(index)
+    del index
+    gc.collect()
+    assert reference() is None